@@ -5,16 +5,20 @@ import json
 import time
 import random
 import requests
+from contextlib import ExitStack
 from api.utils.relval_test_submitter import RelvalTestSubmitter
+from api.utils.global_tag_cache import GlobalTagCache
 from database.database import Database
 from core_lib.controller.controller_base import ControllerBase
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.global_config import Config
+from core_lib.utils.exceptions import ObjectAlreadyExists
 from core_lib.utils.common_utils import (clean_split,
                                          cmsweb_reject_workflows,
                                          config_cache_lite_setup,
                                          dbs_datasetlist, get_hash, get_workflows_from_reqmgr2,
-                                         get_workflows_from_reqmgr2_for_prepid,
+                                         get_requests_from_reqmgr2,
+                                         sort_workflows_by_name,
                                          run_commands_in_cmsenv,
                                          dbs_dataset_runs)
 from resources.smart_tricks import check_if_dataset_exists
@@ -39,7 +43,10 @@ class RelValController(ControllerBase):
         self.database_name = 'relvals'
         self.model_class = RelVal
 
-    def create(self, json_data, condition_name=''):
+    def get_prepid_part(self, json_data, condition_name=''):
+        """
+        Return prepid of a new RelVal without the serial number
+        """
         cmssw_release = json_data.get('cmssw_release')
         batch_name = json_data.get('batch_name')
         # Use workflow name for prepid if possible, if not - first step name
@@ -51,7 +58,10 @@ class RelValController(ControllerBase):
             json_data['workflow_name'] = workflow_name
 
         condition_name = f'{condition_name}-' if condition_name else ''
-        prepid_part = f'{cmssw_release}__{batch_name}-{condition_name}{workflow_name}'.strip('-_')
+        return f'{cmssw_release}__{batch_name}-{condition_name}{workflow_name}'.strip('-_')
+
+    def create(self, json_data, condition_name=''):
+        prepid_part = self.get_prepid_part(json_data, condition_name)
         json_data['prepid'] = f'{prepid_part}-00000'
         relval_db = Database('relvals')
         with self.locker.get_lock(f'generate-relval-prepid-{prepid_part}'):
@@ -66,6 +76,56 @@ class RelValController(ControllerBase):
 
         return relval
 
+    def create_many(self, relvals_json):
+        """
+        Create multiple RelVals from a list of (json_data, condition_name) pairs
+        All new RelVals are saved to the database in a single bulk write
+        """
+        relval_db = Database(self.database_name)
+        new_relvals = []
+        serial_numbers = {}
+        with ExitStack() as locks:
+            for json_data, condition_name in relvals_json:
+                prepid_part = self.get_prepid_part(json_data, condition_name)
+                if prepid_part not in serial_numbers:
+                    locks.enter_context(self.locker.get_lock(f'generate-relval-prepid-{prepid_part}'))
+                    serial_numbers[prepid_part] = self.get_highest_serial_number(relval_db,
+                                                                                 f'{prepid_part}-*')
+
+                serial_numbers[prepid_part] += 1
+                prepid = f'{prepid_part}-{serial_numbers[prepid_part]:05d}'
+                json_data['prepid'] = prepid
+                json_data['history'] = []
+                json_data.pop('_id', None)
+                relval = self.model_class(json_input=json_data)
+                self.logger.info('Will create %s', prepid)
+                relval.add_history('create', prepid, None)
+                if not self.check_for_create(relval):
+                    raise Exception(f'Error while checking new item {prepid}')
+
+                self.before_create(relval)
+                new_relvals.append(relval)
+
+            result = relval_db.save_many([r.get_json() for r in new_relvals],
+                                         ordered=True,
+                                         insert_only=True)
+            if result['failed']:
+                # Do not leave half of the RelVals behind
+                for prepid in result['created']:
+                    relval_db.delete_document({'_id': prepid}, purge=True)
+
+                for prepid, error in result['failed'].items():
+                    if error.startswith('E11000'):
+                        # Duplicate key
+                        raise ObjectAlreadyExists(prepid, self.database_name)
+
+                raise Exception(f'Error saving {", ".join(result["failed"])} to database')
+
+        for relval in new_relvals:
+            self.after_create(relval)
+
+        return new_relvals
+
     def after_update(self, old_obj, new_obj, changed_values):
         self.logger.info('Changed values: %s', changed_values)
         if 'workflow_name' in changed_values:
@@ -234,6 +294,80 @@ class RelValController(ControllerBase):
 
         return '\n'.join(bash)
 
+    def get_cmsdriver_batch(self, relvals, cmssw_release, scram_arch, parallel):
+        """
+        Get bash script that sets up CMSSW release area once and runs cmsDriver
+        scripts of multiple RelVals in their own directories in parallel
+        RelVal directories must contain their config_generate.sh and they get a
+        link to the shared release area, so their scripts do not create a new one
+        Script prints "Failed <prepid>" for each RelVal without all config files
+        """
+        prepids = [relval.get_prepid() for relval in relvals]
+        self.logger.debug('Getting batch cmsDriver commands for %s', ', '.join(prepids))
+        # Release area is in a directory of amd64 scram arch, see run_commands_in_cmsenv
+        os_name, _, gcc_version = clean_split(scram_arch, '_')
+        release_dir = f'{os_name}_amd64_{gcc_version}'
+        bash = ['#!/bin/bash',
+                '',
+                'export SINGULARITY_CACHEDIR="/tmp/$(whoami)/singularity"',
+                '',
+                '# Set up release area once for all RelVals']
+        bash += run_commands_in_cmsenv(['echo "Release area is ready"'],
+                                       cmssw_release,
+                                       scram_arch).split('\n')
+        bash += ['',
+                 '# RelVals use the shared release area']
+        bash += [f'ln -sfn $(pwd)/{release_dir} {prepid}/{release_dir}' for prepid in prepids]
+        bash += ['',
+                 f'# Generate configs of up to {parallel} RelVals at a time',
+                 (f'printf "%s\\n" {" ".join(prepids)} | xargs -P {parallel} -I {{}} '
+                  'bash -c \'cd {} && ./config_generate.sh > config_generate.log 2>&1 '
+                  '|| echo "Failed {}"\''),
+                 '',
+                 '# Check if all expected config files are present']
+        for relval in relvals:
+            prepid = relval.get_prepid()
+            for step in relval.get('steps'):
+                config_name = step.get_config_file_name()
+                if config_name:
+                    bash += [f'if [ ! -s "{prepid}/{config_name}.py" ]; then '
+                             f'echo "Failed {prepid}"; fi']
+
+        bash += ['']
+        return '\n'.join(bash)
+
+    def get_config_upload_file_batch(self, relvals, cmssw_release, scram_arch):
+        """
+        Get bash script that uploads config files of multiple RelVals to ReqMgr2
+        with a single config uploader run
+        Hashes are printed in the order of RelVals and their steps
+        """
+        prepids = [relval.get_prepid() for relval in relvals]
+        self.logger.debug('Getting batch config upload script for %s', ', '.join(prepids))
+        database_url = Config.get('cmsweb_url').replace('https://', '').replace('http://', '')
+        bash = ['#!/bin/bash',
+                '']
+
+        # Use ConfigCacheLite and TweakMakerLite instead of WMCore
+        bash += config_cache_lite_setup().split('\n')
+        bash += ['']
+        command = ['$PYTHON_INT config_uploader.py \\',
+                   '  --group ppd \\',
+                   '  --user $(echo $USER) \\',
+                   f'  --db {database_url} \\']
+        for relval in relvals:
+            prepid = relval.get_prepid()
+            for step in relval.get('steps'):
+                config_name = step.get_config_file_name()
+                if config_name:
+                    command += [f'  --file $(pwd)/{prepid}/{config_name}.py '
+                                f'--label {config_name} \\']
+
+        command += ['  || exit $?',
+                    '']
+        bash += run_commands_in_cmsenv(command, cmssw_release, scram_arch).split('\n')
+        return '\n'.join(bash)
+
     def get_task_dict(self, relval, step, step_index):
         #pylint: disable=too-many-statements
         """
@@ -431,7 +565,14 @@ class RelValController(ControllerBase):
 
     def resolve_auto_conditions(self, conditions_tree):
         """
-        Iterate through conditions tree and resolve global tags
+        Resolve global tags of conditions tree in place
+        Cached global tags are used, only new conditions are resolved remotely
+        """
+        GlobalTagCache.resolve(conditions_tree, self.resolve_auto_conditions_remotely)
+
+    def resolve_auto_conditions_remotely(self, conditions_tree):
+        """
+        Iterate through conditions tree and resolve global tags on lxplus
         Conditions tree example:
         {
             "CMSSW_11_2_0_pre9": {
@@ -504,19 +645,63 @@ class RelValController(ControllerBase):
         step = RelValStep.schema()
         return step
 
+    def set_status(self, relval, status, timestamp=None):
+        """
+        Set new status to RelVal and update history accordingly without saving it
+        """
+        relval.set('status', status)
+        relval.add_history('status', status, None, timestamp)
+
     def update_status(self, relval, status, timestamp=None):
         """
         Set new status to RelVal, update history accordingly and save to database
         """
         relval_db = Database(self.database_name)
-        relval.set('status', status)
-        relval.add_history('status', status, None, timestamp)
+        self.set_status(relval, status, timestamp)
         relval_db.save(relval.get_json())
         self.logger.info('Set "%s" status to "%s"', relval.get_prepid(), status)
 
+    def save_moved_relvals(self, relvals, errors):
+        """
+        Save RelVals that were moved to a new status in a single bulk write
+        Return list of saved RelVals, RelVals that could not be saved are
+        added to errors
+        """
+        if not relvals:
+            return []
+
+        relval_db = Database(self.database_name)
+        result = relval_db.save_many([relval.get_json() for relval in relvals])
+        saved = []
+        for relval in relvals:
+            prepid = relval.get_prepid()
+            if prepid in result['failed']:
+                errors[prepid] = Exception(f'Error saving {prepid} to database: '
+                                           f'{result["failed"][prepid]}')
+            else:
+                self.logger.info('Set "%s" status to "%s"', prepid, relval.get('status'))
+                saved.append(relval)
+
+        return saved
+
+    def raise_move_errors(self, errors):
+        """
+        Raise an exception if some RelVals could not be moved to a new status
+        Exception of a single RelVal is raised as it is
+        """
+        if not errors:
+            return
+
+        if len(errors) == 1:
+            raise list(errors.values())[0]
+
+        raise Exception('\n'.join(f'{prepid}: {error}' for prepid, error in errors.items()))
+
     def next_status(self, relvals):
         """
         Trigger list of RelVals to move to next status
+        RelVals that can be moved are moved and saved, others are left
+        unchanged and an exception about them is raised at the end
         """
         by_status = {}
         for relval in relvals:
@@ -601,55 +786,72 @@ class RelValController(ControllerBase):
         self.resolve_auto_conditions(conditions_tree)
         return conditions_tree
 
-    def get_optimal_parameters(self, relval):
-        """Do local testing and fetch optimal parameters for submission"""
+    def skip_local_test(self, relval):
+        """Return whether RelVal or its ticket asks to skip local test"""
         tickets_db = Database('tickets')
         tickets = tickets_db.query(f'created_relvals={relval.get_prepid()}')
         ticket_note = tickets[0].get('notes') if tickets else ''
         relval_note = relval.get('notes')
         ticket_note = ticket_note.strip().startswith('Skip local test')
         relval_note = relval_note.strip().startswith('Skip local test')
-        skip_test = relval_note or ticket_note
-        if not skip_test:
-            RelvalTestSubmitter().add(relval, self)
-        return skip_test
+        return relval_note or ticket_note
 
-    def move_relvals_to_approving(self, relvals):
+    def check_for_approving(self, relval):
         """
-        Try to move RelVals to approving status
+        Raise an exception if RelVal is not ready to be approved
         """
+        prepid = relval.get_prepid()
         # Check if all necessary GPU parameters are set
-        for relval in relvals:
-            prepid = relval.get_prepid()
-            for index, step in enumerate(relval.get('steps')):
-                if step.get_gpu_requires() != 'forbidden':
-                    gpu_dict = step.get('gpu')
-                    if not gpu_dict.get('gpu_memory'):
-                        raise Exception(f'GPU Memory not set in {prepid} step {index + 1}')
+        for index, step in enumerate(relval.get('steps')):
+            if step.get_gpu_requires() != 'forbidden':
+                gpu_dict = step.get('gpu')
+                if not gpu_dict.get('gpu_memory'):
+                    raise Exception(f'GPU Memory not set in {prepid} step {index + 1}')
 
-                    if not gpu_dict.get('cuda_capabilities'):
-                        raise Exception(f'CUDA Capabilities not set in {prepid} step {index + 1}')
+                if not gpu_dict.get('cuda_capabilities'):
+                    raise Exception(f'CUDA Capabilities not set in {prepid} step {index + 1}')
 
-                    if not gpu_dict.get('cuda_runtime'):
-                        raise Exception(f'GPU Runtime not set in {prepid} step {index + 1}')
+                if not gpu_dict.get('cuda_runtime'):
+                    raise Exception(f'GPU Runtime not set in {prepid} step {index + 1}')
 
-            # Check existance of dataset and runs and if they have enough events
-            for step in relval.get('steps'):
-                if step.get_step_type() == 'input_file':
-                    dataset = step.get('input').get('dataset')
-                    runsLs = set(step.get('input').get('lumisection').keys())
-                    runs = set(step.get('input').get('run'))
-            ds_runs = dbs_dataset_runs(dataset)
-            db_runs = {int(run) for run in runs or runsLs}
-            if not set(ds_runs).intersection(db_runs):
-                raise Exception(f'Runs {", ".join(runs or runsLs)} are not there in the dataset {dataset}')
-
-        conditions_tree = self.get_resolved_conditions(relvals)
+        # Check existance of dataset and runs and if they have enough events
+        for step in relval.get('steps'):
+            if step.get_step_type() == 'input_file':
+                dataset = step.get('input').get('dataset')
+                runsLs = set(step.get('input').get('lumisection').keys())
+                runs = set(step.get('input').get('run'))
+        ds_runs = dbs_dataset_runs(dataset)
+        db_runs = {int(run) for run in runs or runsLs}
+        if not set(ds_runs).intersection(db_runs):
+            raise Exception(f'Runs {", ".join(runs or runsLs)} are not there in the dataset {dataset}')
+
+    def move_relvals_to_approving(self, relvals):
+        """
+        Try to move RelVals to approving status
+        """
+        errors = {}
+        ready_relvals = []
+        for relval in relvals:
+            try:
+                self.check_for_approving(relval)
+                ready_relvals.append(relval)
+            except Exception as ex:
+                self.logger.error('Cannot approve %s: %s', relval.get_prepid(), ex)
+                errors[relval.get_prepid()] = ex
+
+        conditions_tree = self.get_resolved_conditions(ready_relvals)
         results = []
         # Go through relvals and set resolved globaltags from the updated dict
-        for relval in relvals:
-            prepid = relval.get_prepid()
-            with self.locker.get_nonblocking_lock(prepid):
+        with ExitStack() as locks:
+            for relval in ready_relvals:
+                prepid = relval.get_prepid()
+                try:
+                    locks.enter_context(self.locker.get_nonblocking_lock(prepid))
+                except Exception as ex:
+                    self.logger.error('Cannot approve %s: %s', prepid, ex)
+                    errors[prepid] = ex
+                    continue
+
                 for step in relval.get('steps'):
                     if step.get_step_type() != 'cms_driver':
                         # Collect only driver steps that have conditions
@@ -663,14 +865,22 @@ class RelValController(ControllerBase):
                         step.set('resolved_globaltag', resolved_conditions)
                     else:
                         step.set('resolved_globaltag', conditions)
-                # Perform local test and fetch optimal params for submission
-                test_skipped = self.get_optimal_parameters(relval)
-                if test_skipped:
-                    self.update_status(relval, 'approved')
+
+                if self.skip_local_test(relval):
+                    self.set_status(relval, 'approved')
                 else:
-                    self.update_status(relval, 'approving')
+                    self.set_status(relval, 'approving')
+
                 results.append(relval)
 
+            results = self.save_moved_relvals(results, errors)
+
+        # Perform local test and fetch optimal params for submission
+        for relval in results:
+            if relval.get('status') == 'approving':
+                RelvalTestSubmitter().add(relval, self)
+
+        self.raise_move_errors(errors)
         return results
 
     def get_dataset_access_types(self, relvals):
@@ -710,38 +920,52 @@ class RelValController(ControllerBase):
 
         return dataset_access_types
 
+    def check_for_submitting(self, relval, dataset_access_types):
+        """
+        Raise an exception if RelVal is not ready to be submitted
+        """
+        # Make sure all datasets are VALID in DBS
+        for step in relval.get('steps'):
+            if step.get_step_type() == 'input_file':
+                dataset = step.get('input')['dataset']
+            elif step.get('driver')['pileup_input']:
+                dataset = step.get('driver')['pileup_input']
+            else:
+                continue
+
+            dataset = dataset[dataset.index('/'):]
+            access_type = dataset_access_types[dataset]
+            if access_type.lower() != 'valid':
+                raise Exception(f'{dataset} type is {access_type}, it must be VALID')
+
     def move_relvals_to_submitting(self, relvals):
         """
         Try to add RelVals to submission queue and get sumbitted
         """
+        errors = {}
         results = []
         dataset_access_types = self.get_dataset_access_types(relvals)
-        for relval in relvals:
-            prepid = relval.get_prepid()
-            with self.locker.get_nonblocking_lock(prepid):
+        relval_db = Database('relvals')
+        campaign_timestamps = {}
+        with ExitStack() as locks:
+            for relval in relvals:
+                prepid = relval.get_prepid()
+                try:
+                    locks.enter_context(self.locker.get_nonblocking_lock(prepid))
+                    self.check_for_submitting(relval, dataset_access_types)
+                except Exception as ex:
+                    self.logger.error('Cannot submit %s: %s', prepid, ex)
+                    errors[prepid] = ex
+                    continue
+
                 batch_name = relval.get('batch_name')
                 cmssw_release = relval.get('cmssw_release')
-                relval_db = Database('relvals')
-                # Make sure all datasets are VALID in DBS
-                steps = relval.get('steps')
-                for step in steps:
-                    if step.get_step_type() == 'input_file':
-                        dataset = step.get('input')['dataset']
-                    elif step.get('driver')['pileup_input']:
-                        dataset = step.get('driver')['pileup_input']
-                    else:
-                        continue
-
-                    dataset = dataset[dataset.index('/'):]
-                    access_type = dataset_access_types[dataset]
-                    if access_type.lower() != 'valid':
-                        raise Exception(f'{dataset} type is {access_type}, it must be VALID')
-
-                # Create or find campaign timestamp
-                # Threshold in seconds
-                threshold = 3600
-                locker_key = f'move-relval-to-submitting-{cmssw_release}__{batch_name}'
-                with self.locker.get_lock(locker_key):
+                # Create or find campaign timestamp, once per campaign
+                campaign = f'{cmssw_release}__{batch_name}'
+                if campaign not in campaign_timestamps:
+                    # Threshold in seconds
+                    threshold = 3600
+                    locks.enter_context(self.locker.get_lock(f'move-relval-to-submitting-{campaign}'))
                     now = int(time.time())
                     # Get RelVal with newest timestamp in this campaign (CMSSW + Batch Name)
                     db_query = f'cmssw_release={cmssw_release}&&batch_name={batch_name}'
@@ -766,79 +990,109 @@ class RelValController(ControllerBase):
                                      cmssw_release,
                                      batch_name,
                                      newest_timestamp)
-                    relval.set('campaign_timestamp', newest_timestamp)
-                    self.update_status(relval, 'submitting')
+                    campaign_timestamps[campaign] = newest_timestamp
 
-                RequestSubmitter().add(relval, self)
+                relval.set('campaign_timestamp', campaign_timestamps[campaign])
+                self.set_status(relval, 'submitting')
                 results.append(relval)
 
+            results = self.save_moved_relvals(results, errors)
+
+        RequestSubmitter().add_many(results, self)
+        self.raise_move_errors(errors)
         return results
 
-    def move_relvals_to_done(self, relvals):
+    def get_done_status(self, relval):
         """
-        Try to move RelVal to done or archived status
+        Return "done" or "archived" status and its timestamp for RelVal with
+        updated workflows or raise an exception if it cannot be moved
         """
-        results = []
+        prepid = relval.get_prepid()
         # RelVal will not have recoveries, so "completed" is the last state
         done_status = ('completed', )
         archived_status = ('normal-archived', 'rejected-archived', 'aborted-archived')
         # Archived threshold - if workflow is archived for more than a week, but
         # is not done normally (VALID datasets) - move it to 'archived' status
         archived_threshold = time.time() - 7 * 24 * 3600
-        for relval in relvals:
-            prepid = relval.get_prepid()
-            with self.locker.get_nonblocking_lock(prepid):
-                relval = self.update_workflows(relval)
-                workflows = relval.get('workflows')
-                workflows = [w for w in workflows if w['type'].lower() != 'resubmission']
-                if not workflows:
-                    raise Exception(f'{prepid} does not have any workflows in computing')
-
-                last_workflow = workflows[-1]
-                datasets = last_workflow['output_datasets']
-                status_history = last_workflow['status_history']
-                # Get all not-VALID datasets
-                not_valid_datasets = [d['name'] for d in datasets if d['type'].lower() != 'valid']
-                # Get time when workflow became completed
-                completed_timestamp = None
-                for status in status_history:
-                    if status['status'] in done_status:
-                        completed_timestamp = status['time']
-                        break
-
-                # All datasets are VALID and workflow was 'completed'
-                if not not_valid_datasets and completed_timestamp:
-                    self.update_status(relval, 'done', completed_timestamp)
-                    results.append(relval)
-                    continue
-
-                # Get time when workflow became archived
-                archived_timestamp = None
-                for status in status_history:
-                    if status['status'] in archived_status:
-                        archived_timestamp = status['time']
-                        break
+        workflows = relval.get('workflows')
+        workflows = [w for w in workflows if w['type'].lower() != 'resubmission']
+        if not workflows:
+            raise Exception(f'{prepid} does not have any workflows in computing')
+
+        last_workflow = workflows[-1]
+        datasets = last_workflow['output_datasets']
+        status_history = last_workflow['status_history']
+        # Get all not-VALID datasets
+        not_valid_datasets = [d['name'] for d in datasets if d['type'].lower() != 'valid']
+        # Get time when workflow became completed
+        completed_timestamp = None
+        for status in status_history:
+            if status['status'] in done_status:
+                completed_timestamp = status['time']
+                break
+
+        # All datasets are VALID and workflow was 'completed'
+        if not not_valid_datasets and completed_timestamp:
+            return 'done', completed_timestamp
+
+        # Get time when workflow became archived
+        archived_timestamp = None
+        for status in status_history:
+            if status['status'] in archived_status:
+                archived_timestamp = status['time']
+                break
+
+        # Workflow was archived for more than the threshold
+        if archived_timestamp and archived_timestamp <= archived_threshold:
+            return 'archived', archived_timestamp
+
+        if not_valid_datasets:
+            datatiers = [ds.split('/')[-1] for ds in not_valid_datasets]
+            raise Exception(f'Could not move {prepid} to "done" because '
+                            f'{len(not_valid_datasets)} datasets are not VALID: '
+                            f'{", ".join(datatiers)}')
+
+        last_workflow_name = last_workflow['name']
+        if not completed_timestamp:
+            raise Exception(f'Could not move {prepid} to "done" because '
+                            f'{last_workflow} is not yet "completed"')
+
+        raise Exception(f'Could not move {prepid} to "archived" because '
+                        f'{last_workflow_name} is not archived long enough')
 
-                # Workflow was archived for more than the threshold
-                if archived_timestamp and archived_timestamp <= archived_threshold:
-                    self.update_status(relval, 'archived', archived_timestamp)
-                    results.append(relval)
+    def move_relvals_to_done(self, relvals):
+        """
+        Try to move RelVal to done or archived status
+        """
+        errors = {}
+        results = []
+        with ExitStack() as locks:
+            locked_relvals = []
+            for relval in relvals:
+                prepid = relval.get_prepid()
+                try:
+                    locks.enter_context(self.locker.get_nonblocking_lock(prepid))
+                    locked_relvals.append(relval)
+                except Exception as ex:
+                    self.logger.error('Cannot move %s to done: %s', prepid, ex)
+                    errors[prepid] = ex
+
+            updated_relvals, failed = self.update_workflows_many(locked_relvals)
+            errors.update(failed)
+            for relval in updated_relvals:
+                try:
+                    status, timestamp = self.get_done_status(relval)
+                except Exception as ex:
+                    self.logger.error('Cannot move %s to done: %s', relval.get_prepid(), ex)
+                    errors[relval.get_prepid()] = ex
                     continue
 
-                if not_valid_datasets:
-                    datatiers = [ds.split('/')[-1] for ds in not_valid_datasets]
-                    raise Exception(f'Could not move {prepid} to "done" because '
-                                    f'{len(not_valid_datasets)} datasets are not VALID: '
-                                    f'{", ".join(datatiers)}')
-
-                last_workflow_name = last_workflow['name']
-                if not completed_timestamp:
-                    raise Exception(f'Could not move {prepid} to "done" because '
-                                    f'{last_workflow} is not yet "completed"')
+                self.set_status(relval, status, timestamp)
+                results.append(relval)
 
-                raise Exception(f'Could not move {prepid} to "archived" because '
-                                f'{last_workflow_name} is not archived long enough')
+            results = self.save_moved_relvals(results, errors)
 
+        self.raise_move_errors(errors)
         return results
 
     def move_relval_back_to_new(self, relval):
@@ -946,33 +1200,83 @@ class RelValController(ControllerBase):
         """
         Update computing workflows from Stats2
         """
-        prepid = relval.get_prepid()
+        updated, failed = self.update_workflows_many([relval])
+        if failed:
+            raise failed[relval.get_prepid()]
+
+        return updated[0]
+
+    def update_workflows_many(self, relvals):
+        """
+        Update computing workflows of multiple RelVals from ReqMgr2
+        Workflows of all RelVals are fetched with a few batched requests
+        Return list of updated RelVals and dictionary of prepids that failed
+        and their exceptions
+        """
+        prepids = [relval.get_prepid() for relval in relvals]
+        reqmgr_workflows, failed_prepids = get_requests_from_reqmgr2('prep_id', prepids)
+        workflows_by_prepid = {}
+        for workflow in reqmgr_workflows:
+            workflows_by_prepid.setdefault(workflow.get('PrepID'), []).append(workflow)
+
+        # Workflows that are in RelVals, but were not found by prepid
+        found_names = {w.get('RequestName') for w in reqmgr_workflows}
+        missing_names = set()
+        for relval in relvals:
+            missing_names.update(w['name'] for w in relval.get('workflows'))
+
+        missing_names -= found_names
+        missing_workflows, failed_names = get_requests_from_reqmgr2('name', missing_names)
+        missing_workflows = {w.get('RequestName'): w for w in missing_workflows}
         relval_db = Database('relvals')
-        with self.locker.get_lock(prepid):
-            relval = self.get(prepid)
-            workflow_names = {w['name'] for w in relval.get('workflows')}
-            stats_workflows = get_workflows_from_reqmgr2_for_prepid(prepid)
-            workflow_names -= {w['RequestName'] for w in stats_workflows}
-            self.logger.info('%s workflows that are not in stats: %s',
-                             len(workflow_names),
-                             workflow_names)
-            stats_workflows += get_workflows_from_reqmgr2(list(workflow_names))
-            all_workflows = {}
-            for workflow in stats_workflows:
-                if not workflow or not workflow.get('RequestName'):
-                    raise Exception('Could not find workflow in Stats2')
-
-                name = workflow.get('RequestName')
-                all_workflows[name] = workflow
-                self.logger.info('Found workflow %s', name)
-
-            output_datasets = self.get_output_datasets(relval, all_workflows)
-            workflows = self.pick_workflows(all_workflows, output_datasets)
-            relval.set('output_datasets', output_datasets)
-            relval.set('workflows', workflows)
-            relval_db.save(relval.get_json())
+        updated = []
+        failed = {}
+        for prepid in prepids:
+            if prepid in failed_prepids:
+                failed[prepid] = failed_prepids[prepid]
+                continue
 
-        return relval
+            try:
+                with self.locker.get_lock(prepid):
+                    relval = self.get(prepid)
+                    stats_workflows = workflows_by_prepid.get(prepid, [])
+                    stats_workflows = sort_workflows_by_name(stats_workflows, 'RequestName')
+                    workflow_names = {w['name'] for w in relval.get('workflows')}
+                    workflow_names -= {w['RequestName'] for w in stats_workflows}
+                    self.logger.info('%s workflows that are not in stats: %s',
+                                     len(workflow_names),
+                                     workflow_names)
+                    failed_workflows = sorted(workflow_names & set(failed_names))
+                    if failed_workflows:
+                        # Exception of the batch that failed to fetch these workflows
+                        raise failed_names[failed_workflows[0]]
+
+                    # Workflows that were added after RelVals were fetched
+                    new_names = workflow_names - set(missing_workflows)
+                    other_workflows = get_workflows_from_reqmgr2(list(new_names))
+                    other_workflows += [missing_workflows[name] for name in workflow_names
+                                        if name in missing_workflows]
+                    stats_workflows += sort_workflows_by_name(other_workflows, 'RequestName')
+                    all_workflows = {}
+                    for workflow in stats_workflows:
+                        if not workflow or not workflow.get('RequestName'):
+                            raise Exception('Could not find workflow in Stats2')
+
+                        name = workflow.get('RequestName')
+                        all_workflows[name] = workflow
+                        self.logger.info('Found workflow %s', name)
+
+                    output_datasets = self.get_output_datasets(relval, all_workflows)
+                    workflows = self.pick_workflows(all_workflows, output_datasets)
+                    relval.set('output_datasets', output_datasets)
+                    relval.set('workflows', workflows)
+                    relval_db.save(relval.get_json())
+                    updated.append(relval)
+            except Exception as ex:
+                self.logger.error('Error updating %s workflows: %s', prepid, ex)
+                failed[prepid] = ex
+
+        return updated, failed
 
     def get_output_datasets(self, relval, all_workflows):
         """
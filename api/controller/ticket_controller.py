@@ -543,9 +543,10 @@ class TicketController(ControllerBase):
                                            relval_controller,
                                            recycle_input_of)
 
-                for relval, relval_tag in zip(relvals, relval_tags):
-                    relval = relval_controller.create(relval.get_json(), condition_name=relval_tag[0])
-                    created_relvals.append(relval)
+                created_relvals = relval_controller.create_many(
+                    [(relval.get_json(), relval_tag[0]) for relval, relval_tag in zip(relvals, relval_tags)]
+                )
+                for relval in created_relvals:
                     self.logger.info('Created %s', relval.get_prepid())
 
                 created_relval_prepids = [r.get('prepid') for r in created_relvals]
@@ -336,12 +336,16 @@ class UpdateRelValWorkflowsAPI(APIBase):
             results = relval_controller.update_workflows(relval)
             results = results.get_json()
         elif isinstance(relval_json, list):
-            results = []
-            for prepid in relval_json:
-                relval = relval_controller.get(prepid)
-                results.append(relval_controller.update_workflows(relval))
-
+            relvals = [relval_controller.get(prepid) for prepid in relval_json]
+            results, failed = relval_controller.update_workflows_many(relvals)
             results = [x.get_json() for x in results]
+            if failed:
+                failed = {prepid: str(error) for prepid, error in failed.items()}
+                message = '\n'.join(f'{prepid}: {error}' for prepid, error in failed.items())
+                return self.output_text({'response': results,
+                                         'failed': failed,
+                                         'success': False,
+                                         'message': message})
         else:
             raise Exception('Expected a single RelVal dict or a list of RelVal dicts')
 
@@ -2,10 +2,12 @@
 Module that contains all search APIs
 """
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 import flask
 from core_lib.api.api_base import APIBase
+from core_lib.utils.cache import TimeoutCache
 from database.database import Database
+from database.search_index import SearchIndex
 from .model.ticket import Ticket
 from .model.relval import RelVal
 
@@ -15,12 +17,74 @@ class SearchAPI(APIBase):
     Endpoint that is used for search in the database
     """
 
+    # Named sets of attributes that can be requested with "fields" argument
+    # "full" or no "fields" argument returns whole documents
+    # "table" presets have attributes that table pages render by default,
+    # including workflow status cells and global tags of ticket actions
+    FIELD_PRESETS = {'relvals': {'ids': ['prepid'],
+                                 'table': ['prepid',
+                                           'status',
+                                           'jira_ticket',
+                                           'batch_name',
+                                           'campaign_timestamp',
+                                           'notes',
+                                           'workflow_id',
+                                           'workflow_name',
+                                           'cmssw_release',
+                                           'cpu_cores',
+                                           'memory',
+                                           'matrix',
+                                           'label',
+                                           'sample_tag',
+                                           'size_per_event',
+                                           'time_per_event',
+                                           'output_datasets',
+                                           'workflows']},
+                     'tickets': {'ids': ['prepid'],
+                                 'table': ['prepid',
+                                           'status',
+                                           'jira_ticket',
+                                           'batch_name',
+                                           'cmssw_release',
+                                           'cpu_cores',
+                                           'label',
+                                           'memory',
+                                           'scram_arch',
+                                           'workflow_ids',
+                                           'created_relvals',
+                                           'notes',
+                                           'hlt_gt',
+                                           'hlt_gt_ref',
+                                           'prompt_gt',
+                                           'prompt_gt_ref',
+                                           'express_gt',
+                                           'express_gt_ref']}}
+
     def __init__(self):
         APIBase.__init__(self)
         self.classes = {'tickets': Ticket,
                         'relvals': RelVal,
                         'relval-tests': RelVal,}
 
+    def get_fields(self, db_name, fields):
+        """
+        Return list of attributes for comma separated preset names and
+        attributes, e.g. table,steps
+        Empty list means all attributes
+        """
+        if not fields or fields == 'full':
+            return []
+
+        presets = self.FIELD_PRESETS.get(db_name, {})
+        attributes = []
+        for field in fields.split(','):
+            field = field.strip()
+            for attribute in presets.get(field, [field] if field else []):
+                if attribute not in attributes:
+                    attributes.append(attribute)
+
+        return attributes
+
     @APIBase.exceptions_to_errors
     def get(self):
         """
@@ -36,6 +100,10 @@ class SearchAPI(APIBase):
         sort = args.pop('sort', None)
         sort_asc = args.pop('sort_asc', None)
         wild_filter = args.pop('filter', False)
+        estimate_count = args.pop('estimate_count', 'false').lower() == 'true'
+        fields = self.get_fields(db_name, args.pop('fields', None))
+        # Cursor of the last row of previous page, empty for the first page
+        after = args.pop('after', None)
 
         # Special cases
         from_ticket = args.pop('ticket', None)
@@ -43,7 +111,8 @@ class SearchAPI(APIBase):
             ticket_database = Database('tickets')
             tickets = ticket_database.query(query_string=f'prepid={from_ticket}',
                                             limit=100,
-                                            ignore_case=True)
+                                            ignore_case=True,
+                                            projection=['created_relvals'])
             created_relvals = []
             for ticket in tickets:
                 created_relvals.extend(ticket['created_relvals'])
@@ -53,7 +122,8 @@ class SearchAPI(APIBase):
             args['prepid'] = ('%s,%s' % (prepid_query, created_relvals)).strip(',')
 
         # Sorting logic: by default sort dsc by cration time
-        if sort is None:
+        # or by relevance if free text filter is used
+        if sort is None and not wild_filter:
             sort = 'created_on'
 
         if sort == 'created_on' and sort_asc is None:
@@ -62,6 +132,10 @@ class SearchAPI(APIBase):
         if sort_asc is None:
             sort_asc = True
 
+        if sort is None:
+            # Results ordered by relevance are paginated by page number only
+            after = None
+
         limit = max(1, min(limit, 500))
         sort_asc = str(sort_asc).lower() == 'true'
         query_string = '&&'.join(['%s=%s' % (pair) for pair in args.items()])
@@ -73,10 +147,21 @@ class SearchAPI(APIBase):
                                                              sort_attr=sort,
                                                              sort_asc=sort_asc,
                                                              ignore_case=True,
-                                                             wild_filter=wild_filter)
+                                                             wild_filter=wild_filter,
+                                                             count_mode=('estimate'
+                                                                         if estimate_count
+                                                                         else 'facet'),
+                                                             projection=fields,
+                                                             after=after)
+
+        # Cursor to the next page
+        next_cursor = None
+        if len(results) == limit and sort:
+            next_cursor = database.make_cursor(results[-1], sort)
 
         return self.output_text({'response': {'results': results,
-                                              'total_rows': total_rows},
+                                              'total_rows': total_rows,
+                                              'next': next_cursor},
                                  'success': True,
                                  'message': ''})
 
@@ -92,23 +177,23 @@ class SuggestionsAPI(APIBase):
     @APIBase.exceptions_to_errors
     def get(self):
         """
-        Return a list of prepid suggestions for given query
+        Return a list of prepid or other attribute suggestions for given query
         """
         args = flask.request.args.to_dict()
         if args is None:
             args = {}
 
         db_name = args.pop('db_name', None)
-        query = args.pop('query', None).replace(' ', '.*')
-        limit = max(1, min(50, args.pop('limit', 20)))
+        query = args.pop('query', None)
+        attribute = args.pop('attribute', 'prepid')
+        limit = max(1, min(50, int(args.pop('limit', 20))))
 
         if not db_name or not query:
             raise Exception('Bad db_name or query parameter')
 
         database = Database(db_name)
-        db_query = {'prepid': re.compile(f'.*{query}.*', re.IGNORECASE)}
-        results = database.collection.find(db_query).limit(limit)
-        results = [x['prepid'] for x in results]
+        search_index = SearchIndex.get_index(db_name)
+        results = search_index.suggest(database.collection, query, attribute, limit)
 
         return self.output_text({'response': results,
                                  'success': True,
@@ -120,6 +205,31 @@ class WildSearchAPI(APIBase):
     Endpoint that is used for abstract search in the whole database
     """
 
+    # Attributes to search in, in the order of priority
+    # Database name, attribute, whether to wrap query in wildcards
+    ATTEMPTS = [('relvals', 'prepid', False),
+                ('tickets', 'prepid', False),
+                ('relvals', 'prepid', True),
+                ('tickets', 'prepid', True),
+                # Tickets
+                ('tickets', 'cmssw_release', True),
+                ('tickets', 'batch_name', True),
+                ('tickets', 'workflows', False),
+                ('tickets', 'label', True),
+                ('tickets', 'created_relvals', True),
+                # Requests
+                ('relvals', 'cmssw_release', True),
+                ('relvals', 'batch_name', True),
+                ('relvals', 'workflow_id', False),
+                ('relvals', 'workflow_name', True),
+                ('relvals', 'output_dataset', True),
+                ('relvals', 'workflow', True)]
+    MAX_RESULTS = 20
+    # Shared pool limits number of concurrent queries of all searches
+    __executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='wild-search')
+    # Recent searches, users tend to repeat them while typing
+    __cache = TimeoutCache(timeout=15, max_size=500, name='wild_search', sweep_interval=60)
+
     def __init__(self):
         APIBase.__init__(self)
         self.classes = {'tickets': Ticket,
@@ -146,70 +256,68 @@ class WildSearchAPI(APIBase):
                                      'success': True,
                                      'message': 'Query string too short'})
 
-        tickets_db = Database('tickets')
-        relvals_db = Database('relvals')
-
-        attempts = [('relvals', relvals_db, 'prepid', False),
-                    ('tickets', tickets_db, 'prepid', False),
-                    ('relvals', relvals_db, 'prepid', True),
-                    ('tickets', tickets_db, 'prepid', True),
-                    # Tickets
-                    ('tickets', tickets_db, 'cmssw_release', True),
-                    ('tickets', tickets_db, 'batch_name', True),
-                    ('tickets', tickets_db, 'workflows', False),
-                    ('tickets', tickets_db, 'label', True),
-                    ('tickets', tickets_db, 'created_relvals', True),
-                    # Requests
-                    ('relvals', relvals_db, 'cmssw_release', True),
-                    ('relvals', relvals_db, 'batch_name', True),
-                    ('relvals', relvals_db, 'workflow_id', False),
-                    ('relvals', relvals_db, 'workflow_name', True),
-                    ('relvals', relvals_db, 'output_dataset', True),
-                    ('relvals', relvals_db, 'workflow', True),]
+        results = WildSearchAPI.__cache.get(query)
+        if results is None:
+            results = self.search(query)
+            WildSearchAPI.__cache.set(query, results)
+
+        return self.output_text({'response': results,
+                                 'success': True,
+                                 'message': ''})
 
+    def search(self, query):
+        """
+        Run all attempts concurrently and collect results in order of priority
+        Attempts that did not start yet are cancelled once there are enough results
+        """
+        futures = [WildSearchAPI.__executor.submit(self.run_attempt, db_name, attr, query, wrap)
+                   for db_name, attr, wrap in self.ATTEMPTS]
         results = []
         used_values = set()
-        for attempt in attempts:
-            db_name = attempt[0]
-            database = attempt[1]
-            attr = attempt[2]
-            wrap_in_wildcards = attempt[3]
-            if wrap_in_wildcards:
-                wrapped_query = f'*{query}*'
-            else:
-                wrapped_query = f'{query}'
-
-            self.logger.info('Trying to query %s in %s', wrapped_query, db_name)
-            try:
-                typed_query = database.build_query_with_types(f'{attr}={wrapped_query}',
-                                                              self.classes[db_name])
-                query_results = database.query(typed_query, 0, 5, ignore_case=True)
-            except ValueError:
-                # In case text input was casted to a number
-                continue
-
-            for result in query_results:
-                values = self.extract_values(result, attr, wrapped_query, db_name)
-                for value in values:
-                    key = f'{db_name}:{attr}:{value}'
+        try:
+            for future in futures:
+                for result in future.result():
+                    key = f'{result["database"]}:{result["attribute"]}:{result["value"]}'
                     if key not in used_values:
                         used_values.add(key)
-                        results.append({'value': value,
-                                        'attribute': attr,
-                                        'database': db_name,
-                                        'document': result})
+                        results.append(result)
 
-            # Limit results to 20 to save DB some queries
-            if len(results) >= 20:
-                results = results[:20]
-                break
+                if len(results) >= self.MAX_RESULTS:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
 
-            # Limit DB query rate as this is very expensive
-            time.sleep(0.075)
+        return results[:self.MAX_RESULTS]
 
-        return self.output_text({'response': results,
-                                 'success': True,
-                                 'message': ''})
+    def run_attempt(self, db_name, attr, query, wrap_in_wildcards):
+        """
+        Query a single attribute and return found values
+        """
+        if wrap_in_wildcards:
+            wrapped_query = f'*{query}*'
+        else:
+            wrapped_query = f'{query}'
+
+        self.logger.info('Trying to query %s in %s', wrapped_query, db_name)
+        database = Database(db_name)
+        try:
+            typed_query = database.build_query_with_types(f'{attr}={wrapped_query}',
+                                                          self.classes[db_name])
+            query_results = database.query(typed_query, 0, 5, ignore_case=True)
+        except ValueError:
+            # In case text input was casted to a number
+            return []
+
+        results = []
+        for result in query_results:
+            for value in self.extract_values(result, attr, wrapped_query, db_name):
+                results.append({'value': value,
+                                'attribute': attr,
+                                'database': db_name,
+                                'document': result})
+
+        return results
 
     def extract_values(self, item, attribute, query, db_name):
         """
@@ -229,7 +337,8 @@ class WildSearchAPI(APIBase):
             return [item[attribute]]
 
         values = []
-        matcher = re.compile(query.replace('*', '.*'), re.IGNORECASE)
+        matcher = '.*'.join(re.escape(part) for part in query.split('*'))
+        matcher = re.compile(matcher, re.IGNORECASE)
         self.logger.info('Item: %s, attribute: %s, query: %s, db name: %s',
                          item['prepid'],
                          attribute,
@@ -3,11 +3,17 @@ Module that contains all system APIs
 """
 import time
 import os.path
+import flask
 from core_lib.api.api_base import APIBase
 from core_lib.utils.locker import Locker
+from core_lib.utils.connection_wrapper import ConnectionPool
+from core_lib.utils.ssh_executor import SSHSessionPool
+from core_lib.utils.cache import TimeoutCache
+from core_lib.utils.log_store import LogStore
 from database.database import Database
 from core_lib.utils.user_info import UserInfo
 from .utils.submitter import RequestSubmitter
+from .utils.global_tag_cache import GlobalTagCache
 
 
 class SubmissionWorkerStatusAPI(APIBase):
@@ -21,9 +27,9 @@ class SubmissionWorkerStatusAPI(APIBase):
     @APIBase.exceptions_to_errors
     def get(self):
         """
-        Get status of all request submission workers
+        Get status of workers, queues with wait and run time histograms and hosts
         """
-        status = RequestSubmitter().get_worker_status()
+        status = RequestSubmitter().get_status()
         return self.output_text({'response': status, 'success': True, 'message': ''})
 
 
@@ -43,6 +49,37 @@ class SubmissionQueueAPI(APIBase):
         status = RequestSubmitter().get_names_in_queue()
         return self.output_text({'response': status, 'success': True, 'message': ''})
 
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('manager')
+    def put(self):
+        """
+        Change priority of a waiting task, lower number runs first
+        """
+        args = flask.request.args.to_dict()
+        name = args.get('name')
+        if not name or 'priority' not in args:
+            raise Exception('Missing name or priority parameter')
+
+        found = RequestSubmitter().set_priority(name, int(args['priority']))
+        return self.output_text({'response': found,
+                                 'success': found,
+                                 'message': '' if found else f'Task "{name}" is not waiting'})
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('manager')
+    def delete(self):
+        """
+        Remove a waiting task from the queue
+        """
+        name = flask.request.args.get('name')
+        if not name:
+            raise Exception('Missing name parameter')
+
+        cancelled = RequestSubmitter().cancel_task(name)
+        return self.output_text({'response': cancelled,
+                                 'success': cancelled,
+                                 'message': '' if cancelled else f'Task "{name}" is not waiting'})
+
 
 class LockerStatusAPI(APIBase):
     """
@@ -170,6 +207,103 @@ class ObjectsInfoAPI(APIBase):
                                  'message': ''})
 
 
+class DatabaseStatusAPI(APIBase):
+    """
+    Endpoint for getting database connection pool status
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get number of shared database clients, pool settings and connection handshakes
+        """
+        status = Database.get_connection_status()
+        return self.output_text({'response': status, 'success': True, 'message': ''})
+
+
+class ConnectionPoolStatusAPI(APIBase):
+    """
+    Endpoint for getting HTTP connection pool status
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get number of open and idle connections of each host, handshakes and reuses
+        """
+        status = ConnectionPool.get_status()
+        return self.output_text({'response': status, 'success': True, 'message': ''})
+
+
+class SSHSessionPoolStatusAPI(APIBase):
+    """
+    Endpoint for getting SSH session pool status
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get number of SSH connections and sessions of each host, logins and reuses
+        """
+        status = SSHSessionPool.get_status()
+        return self.output_text({'response': status, 'success': True, 'message': ''})
+
+
+class CacheStatusAPI(APIBase):
+    """
+    Endpoint for getting cache statistics
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get number of hits, misses, evictions and cached values of all named caches
+        """
+        status = TimeoutCache.get_all_stats()
+        return self.output_text({'response': status, 'success': True, 'message': ''})
+
+
+class GlobalTagCacheAPI(APIBase):
+    """
+    Endpoint for getting and invalidating cached auto: conditions
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get cached global tags grouped by CMSSW release and scram arch
+        """
+        cached = GlobalTagCache.get_all()
+        return self.output_text({'response': cached, 'success': True, 'message': ''})
+
+    @APIBase.exceptions_to_errors
+    @APIBase.ensure_role('manager')
+    def delete(self):
+        """
+        Remove cached global tags of "cmssw_release" and/or "scram_arch" or all of them
+        """
+        args = flask.request.args.to_dict()
+        removed = GlobalTagCache.invalidate(args.get('cmssw_release'), args.get('scram_arch'))
+        return self.output_text({'response': {'removed': removed},
+                                 'success': True,
+                                 'message': ''})
+
+
 class BuildInfoAPI(APIBase):
     """
     Endpoint for getting build information if it is available
@@ -220,4 +354,28 @@ class UptimeInfoAPI(APIBase):
                                               'minutes': minutes,
                                               'seconds': seconds},
                                  'success': True,
-                                 'message': ''})
\ No newline at end of file
+                                 'message': ''})
+
+
+class LogAPI(APIBase):
+    """
+    Endpoint for getting logs of RelVal tests and DQM comparisons
+    """
+
+    def __init__(self):
+        APIBase.__init__(self)
+
+    @APIBase.exceptions_to_errors
+    def get(self):
+        """
+        Get text of a log, e.g. ?id=tests/<prepid>
+        """
+        log_id = flask.request.args.get('id')
+        if not log_id:
+            raise Exception('Missing id parameter')
+
+        log = LogStore.get(log_id)
+        if log is None:
+            raise Exception(f'Log "{log_id}" does not exist or it expired')
+
+        return self.output_text({'response': log, 'success': True, 'message': ''})
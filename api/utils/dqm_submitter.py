@@ -1,12 +1,16 @@
 """
 Module that has all classes used for request submission to computing
 """
+import os
 import json
+import tempfile
 from uuid import uuid4
+from collections import deque
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.locker import Locker
+from core_lib.utils.log_store import LogStore
 from database.database import Database
-from core_lib.utils.submitter import Submitter as BaseSubmitter
+from core_lib.utils.submitter import Submitter as BaseSubmitter, TaskScheduler
 from core_lib.utils.common_utils import (get_scram_arch,
                                         run_commands_in_cmsenv)
 from core_lib.utils.global_config import Config
@@ -17,18 +21,36 @@ class DQMRequestSubmitter(BaseSubmitter):
     Subclass of base submitter that is tailored for RelVal submission
     """
 
+    QUEUE = 'dqm'
+    QUEUE_WORKERS = 4
+    PRIORITY = TaskScheduler.LOW
+    HOSTS = ('lxplus.cern.ch', )
+    # Number of last lines of comparison output that are attached to emails
+    MAX_OUTPUT_LINES = 2000
+
     def add(self, relvalT, relvalR, dqm_pair, target_pair):
         """
         Add a RelVal to the submission queue
         """
         prepidT = relvalT.get_prepid()
         prepidR = relvalR.get_prepid()
-        super().add_task(prepidT+prepidR,
-                         self.create_dqm_comparison,
-                         relvalT=relvalT,
-                         relvalR=relvalR,
-                         dqm_pair=dqm_pair,
-                         target_pair=target_pair)
+        return self.add_job(prepidT+prepidR,
+                            {'target': prepidT,
+                             'reference': prepidR,
+                             'dqm_pair': dqm_pair,
+                             'target_pair': target_pair})
+
+    def run_job(self, payload):
+        """
+        Compare DQM plots of a persistent job
+        """
+        # Controller imports this module
+        from api.controller.relval_controller import RelValController
+        controller = RelValController()
+        self.create_dqm_comparison(controller.get(payload['target']),
+                                   controller.get(payload['reference']),
+                                   payload['dqm_pair'],
+                                   payload['target_pair'])
 
     def __handle_error(self, relvalT, relvalR, error_message, error_code):
         """
@@ -162,20 +184,21 @@ class DQMRequestSubmitter(BaseSubmitter):
             dqm_script_commands = run_commands_in_cmsenv(command, cmssw_version, scram_arch)
             self.logger.debug('Compare DQM dataset pair command:\n%s', dqm_script_commands)
 
-            ssh = SSHExecutor('lxplus.cern.ch', credentials_file)
-            stdout = ssh.execute_command_new([
-                                            f'mkdir -p {remote_directory}',
-                                            f'cd {remote_directory}', 
-                                            dqm_script_commands
-                                            ])
-            chunk = ''; dummy = True
-            while dummy:
-                line = stdout.readline()
-                chunk += line
-                print(line, end='')
-                if not line: dummy = False
-            exit_code = stdout.channel.recv_exit_status()
-            ssh.close_connections()
+            with SSHExecutor('lxplus.cern.ch', credentials_file) as ssh:
+                # Both streams in order of arrival, only the last lines are kept
+                output = deque(maxlen=self.MAX_OUTPUT_LINES)
+                with tempfile.TemporaryDirectory() as log_dir:
+                    log_file = os.path.join(log_dir, 'dqm.log.gz')
+                    remote_command = [f'mkdir -p {remote_directory}',
+                                      f'cd {remote_directory}',
+                                      dqm_script_commands]
+                    _, _, exit_code = ssh.stream_command(remote_command,
+                                                         on_line=lambda _, line: output.append(line),
+                                                         log_file=log_file,
+                                                         max_lines=1)
+                    LogStore.save_file(f'dqm/{target_prepid}+{reference_prepid}', log_file)
+
+                chunk = '\n'.join(output)
 
             if exit_code:
                 self.__handle_error(relvalT, relvalR, chunk, exit_code)
@@ -0,0 +1,166 @@
+"""
+Module that contains GlobalTagCache class
+"""
+import time
+import logging
+from contextlib import ExitStack
+from core_lib.utils.locker import Locker
+from database.database import Database
+
+
+class GlobalTagCache():
+    """
+    Persistent cache of auto: conditions resolved to global tags
+    auto: keys of a CMSSW release do not change, so once resolved they are
+    kept in the database, one document per CMSSW release and scram arch
+    Cached values are removed only by an explicit invalidation
+    """
+
+    ID_PREFIX = 'global_tags'
+
+    @staticmethod
+    def get_database():
+        """
+        Return database that stores resolved conditions
+        """
+        return Database('caches')
+
+    @staticmethod
+    def get_document_id(cmssw_release, scram_arch):
+        """
+        Return database document id of CMSSW release and scram arch
+        """
+        return f'{GlobalTagCache.ID_PREFIX}/{cmssw_release}/{scram_arch}'
+
+    @staticmethod
+    def load(pairs):
+        """
+        Return dictionary of (CMSSW release, scram arch) pairs and their
+        cached auto: conditions and global tags
+        """
+        document_ids = [GlobalTagCache.get_document_id(*pair) for pair in pairs]
+        collection = GlobalTagCache.get_database().collection
+        cached = {}
+        for document in collection.find({'_id': {'$in': document_ids}}):
+            # Conditions are stored as pairs, auto:... might not be a valid attribute name
+            cached[(document['cmssw_release'], document['scram_arch'])] = dict(document['tags'])
+
+        return cached
+
+    @staticmethod
+    def store(cmssw_release, scram_arch, tags):
+        """
+        Add resolved conditions of CMSSW release and scram arch to the cache
+        """
+        database = GlobalTagCache.get_database()
+        document_id = GlobalTagCache.get_document_id(cmssw_release, scram_arch)
+        document = database.get(document_id) or {'_id': document_id,
+                                                 'cmssw_release': cmssw_release,
+                                                 'scram_arch': scram_arch,
+                                                 'tags': []}
+        all_tags = dict(document['tags'])
+        all_tags.update(tags)
+        document['tags'] = sorted(all_tags.items())
+        document['resolved'] = int(time.time())
+        database.save(document)
+
+    @staticmethod
+    def fill(conditions_tree, cached):
+        """
+        Set cached values in conditions tree
+        Return tree of conditions that are not cached
+        """
+        missing = {}
+        for cmssw_release, scram_tree in conditions_tree.items():
+            for scram_arch, conditions in scram_tree.items():
+                tags = cached.get((cmssw_release, scram_arch), {})
+                for condition in conditions:
+                    if condition in tags:
+                        conditions[condition] = tags[condition]
+                    else:
+                        missing.setdefault(cmssw_release, {}).setdefault(scram_arch, {})
+                        missing[cmssw_release][scram_arch][condition] = None
+
+        return missing
+
+    @staticmethod
+    def resolve(conditions_tree, resolver):
+        """
+        Set global tags of all conditions in conditions tree
+        Conditions that are not cached are resolved with a single resolver call
+        that gets tree of missing conditions and must fill it in
+        Concurrent resolutions of the same CMSSW release and scram arch wait for
+        each other, so each condition is resolved remotely only once
+        """
+        logger = logging.getLogger()
+        pairs = sorted((cmssw_release, scram_arch)
+                       for cmssw_release, scram_tree in conditions_tree.items()
+                       for scram_arch in scram_tree)
+        if not pairs:
+            return
+
+        missing = GlobalTagCache.fill(conditions_tree, GlobalTagCache.load(pairs))
+        if not missing:
+            logger.debug('All auto: conditions are cached')
+            return
+
+        missing_pairs = sorted((cmssw_release, scram_arch)
+                               for cmssw_release, scram_tree in missing.items()
+                               for scram_arch in scram_tree)
+        locker = Locker()
+        with ExitStack() as locks:
+            # Locks are always acquired in the same order
+            for pair in missing_pairs:
+                lock_id = GlobalTagCache.get_document_id(*pair)
+                locks.enter_context(locker.get_lock(lock_id))
+
+            # Maybe conditions were resolved while waiting for locks
+            missing = GlobalTagCache.fill(conditions_tree, GlobalTagCache.load(missing_pairs))
+            if not missing:
+                return
+
+            resolver(missing)
+            for cmssw_release, scram_tree in missing.items():
+                for scram_arch, tags in scram_tree.items():
+                    unresolved = [condition for condition, tag in tags.items() if not tag]
+                    if unresolved:
+                        raise Exception(f'Could not resolve {", ".join(unresolved)} '
+                                        f'in {cmssw_release} ({scram_arch})')
+
+                    GlobalTagCache.store(cmssw_release, scram_arch, tags)
+                    conditions_tree[cmssw_release][scram_arch].update(tags)
+
+    @staticmethod
+    def invalidate(cmssw_release=None, scram_arch=None):
+        """
+        Remove cached conditions of a CMSSW release, scram arch or both
+        If neither is given, remove all cached conditions
+        Return number of removed CMSSW release and scram arch pairs
+        """
+        query = {'_id': {'$regex': f'^{GlobalTagCache.ID_PREFIX}/'}}
+        if cmssw_release:
+            query['cmssw_release'] = cmssw_release
+
+        if scram_arch:
+            query['scram_arch'] = scram_arch
+
+        result = GlobalTagCache.get_database().collection.delete_many(query)
+        logging.getLogger().info('Invalidated %s cached global tag documents of %s (%s)',
+                                 result.deleted_count,
+                                 cmssw_release or 'all releases',
+                                 scram_arch or 'all architectures')
+        return result.deleted_count
+
+    @staticmethod
+    def get_all():
+        """
+        Return all cached conditions grouped by CMSSW release and scram arch
+        """
+        query = {'_id': {'$regex': f'^{GlobalTagCache.ID_PREFIX}/'}}
+        collection = GlobalTagCache.get_database().collection
+        tree = {}
+        for document in collection.find(query).sort('_id', 1):
+            tags = dict(document['tags'])
+            tree.setdefault(document['cmssw_release'], {})[document['scram_arch']] = tags
+
+        return tree
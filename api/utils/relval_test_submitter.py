@@ -3,28 +3,37 @@ Module for submitting relvals for local testing, eventually to fetch job report
 """
 import os
 import time
+import tempfile
+from collections import deque
 from core_lib.utils.locker import Locker
+from core_lib.utils.log_store import LogStore
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.submitter import Submitter as BaseSubmitter
 from core_lib.utils.global_config import Config
 from database.database import Database
 
 class RelvalTestSubmitter(BaseSubmitter):
+
+  QUEUE = 'tests'
+  QUEUE_WORKERS = 8
+  HOSTS = ('lxplus.cern.ch', )
+  # Number of last lines of test output that are stored in the database
+  MAX_OUTPUT_LINES = 2000
+
   def add(self, relval, relval_controller):
     """Add relval to the submission queue"""
     prepid = relval.get_prepid()
-    super().add_task(prepid, 
-      self.submit_relval_test,
-      relval = relval,
-      controller=relval_controller
-    )
+    return self.add_job(prepid, {'prepid': prepid})
+
+  def run_job(self, payload):
+    """Test RelVal of a persistent job"""
+    # Controller imports this module
+    from api.controller.relval_controller import RelValController
+    controller = RelValController()
+    self.submit_relval_test(controller.get(payload['prepid']), controller)
   
-  def parseParamsFromTest(self, relval):
-    """Fetch and return parameters of insterest obtained from local test"""
-    db = Database('relval-tests')
-    data = db.get(relval.get_prepid())
-    stdout = data['test_stdout']
-    stdlines = stdout.split('\n')
+  def parseParamsFromTest(self, stdlines):
+    """Return parameters of insterest obtained from summary lines of local test"""
     params = {}
     steps = ['Step2 ', 'Step3 ']
     for key in steps: params[key.strip()] = {}
@@ -41,16 +50,13 @@ class RelvalTestSubmitter(BaseSubmitter):
         params['dqm_link'] = line.strip('dqm_link: ').strip()
     return params
 
+  def is_summary_line(self, line):
+    """Return whether line is needed by parseParamsFromTest"""
+    return line.startswith(('Step2 ', 'Step3 ', 'dqm_link: '))
+
   def store_submission_output(self, relval, stdout, exit_code):
-    """Store output and exit code of relval test to the database."""
+    """Store last lines of output and exit code of relval test to the database."""
     test_db = Database('relval-tests')
-    dbdoc = test_db.get(relval.get_prepid())
-
-    # Ensure stdout is a string
-    stdout_str = '' if stdout is None else stdout
-
-    # If dbdoc is not None, concatenate the previous stdout with the new stdout
-    test_stdout = dbdoc.get('test_stdout', '') + stdout_str if dbdoc else stdout_str
 
     # Check if the test is complete with an exit code
     if exit_code is not None and type(exit_code) == int:
@@ -60,15 +66,20 @@ class RelvalTestSubmitter(BaseSubmitter):
         status = 'running'
         test_exit_code = '0'  # Standard exit code representing test in progress
 
-    # Update the database document with the new information
+    # Output is replaced, full output is in the compressed test log in LogStore
     doc = {
         "_id": relval.get_prepid(),
         "test_exit_code": test_exit_code,
         "test_status": status,
-        "test_stdout": test_stdout
+        "test_stdout": stdout or '',
+        "test_log": self.get_log_id(relval)
     }
     test_db.save(doc)
 
+  def get_log_id(self, relval):
+    """Return LogStore id of log with full output of relval test"""
+    return f'tests/{relval.get_prepid()}'
+
   def submit_relval_test(self, relval, controller):
     """Submit relval for local test"""
     prepid = relval.get_prepid()
@@ -78,15 +89,19 @@ class RelvalTestSubmitter(BaseSubmitter):
       start_time = time.time()
       relval_db = Database('relvals')
       def execute_scripts():
-        ssh = SSHExecutor('lxplus.cern.ch', credentials_file)
-        self.prepare_workspace(relval, controller, ssh, workspace_dir)
-        exit_code = self.perform_local_tests(ssh, relval, workspace_dir)
-        ssh.close_connections()
-        return exit_code
-      exit_code = execute_scripts()
+        with SSHExecutor('lxplus.cern.ch', credentials_file) as ssh:
+          try:
+            self.prepare_workspace(relval, controller, ssh, workspace_dir)
+          except Exception as ex:
+            # Test cannot run, relval goes back to new
+            self.logger.error('Error preparing test workspace of %s: %s', prepid, ex)
+            return -1, []
+
+          return self.perform_local_tests(ssh, relval, workspace_dir)
+      exit_code, summary = execute_scripts()
       # Repeat failures with following exit codes
       minor_codes = [1, 255]
-      while exit_code in minor_codes: exit_code = execute_scripts()
+      while exit_code in minor_codes: exit_code, summary = execute_scripts()
       if exit_code:
         for step in relval.get('steps'):
           step.set('resolved_globaltag', '')
@@ -95,7 +110,7 @@ class RelvalTestSubmitter(BaseSubmitter):
       else:
         try:
           # Setting optimal params in relval
-          params = self.parseParamsFromTest(relval)
+          params = self.parseParamsFromTest(summary)
           for step in relval.get('steps'):
             idx = step.get_index_in_parent()
             param = params.get(f'Step{idx+1}', {})
@@ -116,23 +131,14 @@ class RelvalTestSubmitter(BaseSubmitter):
     """
     prepid = relval.get_prepid()
     self.logger.info('Preparing workspace for %s', prepid)
-    # Dump config generation to file
-    with open(f'/tmp/{prepid}_test_generate.sh', 'w') as temp_file:
-      config_file_content = controller.get_cmsdriver_test(relval)
-      temp_file.write(config_file_content)
-
-    # Re-create the directory and create a voms proxy there
-    command = [f'rm -rf {workspace_dir}/{prepid}',
-                f'mkdir -p {workspace_dir}/{prepid}',
-                f'cd {workspace_dir}/{prepid}',
-                'voms-proxy-init --rfc -voms cms --valid 1:00 --vomslife 1:00 --verify --out $(pwd)/proxy.txt']
-    ssh_executor.execute_command(command)
-
-    # Upload config generation script - cmsDrivers
-    ssh_executor.upload_file(f'/tmp/{prepid}_test_generate.sh',
-                              f'{workspace_dir}/{prepid}/config_test_generate.sh')
-
-    os.remove(f'/tmp/{prepid}_test_generate.sh')
+    # Config generation script - cmsDrivers, uploaded as an archive
+    files = {'config_test_generate.sh': controller.get_cmsdriver_test(relval)}
+    self.upload_workspace(ssh_executor,
+                          workspace_dir,
+                          prepid,
+                          files,
+                          archive_name='test_workspace',
+                          voms_options='--rfc --valid 1:00 --vomslife 1:00 --verify')
 
   def perform_local_tests(self, ssh, relval, workspace_dir):
     """
@@ -148,24 +154,27 @@ class RelvalTestSubmitter(BaseSubmitter):
                 'echo "$X509_USER_PROXY"',
                 './config_test_generate.sh',
                 f'rm -rf {workspace_dir}/{prepid}']
-    start_time = time.time()
-    stdout = ssh.execute_command_new(command)
-    chunk = ''; x = True; iTime=start_time
-    runOnce = True
-    while x:
-      line = stdout.readline()
-      chunk += line
-      if runOnce:
-        self.store_submission_output(relval, str(chunk), None)
-        runOnce = False; chunk = ''
-      if (time.time() - iTime) > 15:
-        iTime = time.time()
-        self.store_submission_output(relval, str(chunk), None)
-        chunk = ''
-      if not line:
-        self.store_submission_output(relval, str(chunk), None)
-        x = False
-    exit_code = stdout.channel.recv_exit_status()
-    self.store_submission_output(relval, None, exit_code)
-
-    return exit_code
+    # Last lines of output that are shown while test is running
+    output = deque(maxlen=self.MAX_OUTPUT_LINES)
+    summary = []
+    last_store = [time.time()]
+    def on_line(_, line):
+      output.append(line)
+      if self.is_summary_line(line):
+        summary.append(line)
+      if (time.time() - last_store[0]) > 15:
+        last_store[0] = time.time()
+        self.store_submission_output(relval, '\n'.join(output), None)
+
+    self.store_submission_output(relval, '', None)
+    with tempfile.TemporaryDirectory() as log_dir:
+      log_file = os.path.join(log_dir, 'test.log.gz')
+      _, _, exit_code = ssh.stream_command(command,
+                                           on_line=on_line,
+                                           log_file=log_file,
+                                           max_lines=1)
+      LogStore.save_file(self.get_log_id(relval), log_file)
+
+    self.store_submission_output(relval, '\n'.join(output), exit_code)
+
+    return exit_code, summary
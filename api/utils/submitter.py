@@ -1,14 +1,13 @@
 """
 Module that has all classes used for request submission to computing
 """
-import os
-import time
+from contextlib import ExitStack
 from core_lib.utils.ssh_executor import SSHExecutor
 from core_lib.utils.locker import Locker
 from database.database import Database
 from core_lib.utils.connection_wrapper import ConnectionWrapper
 from core_lib.utils.submitter import Submitter as BaseSubmitter
-from core_lib.utils.common_utils import clean_split
+from core_lib.utils.common_utils import clean_split, get_hash
 from core_lib.utils.global_config import Config
 from ..utils.emailer import Emailer
 from resources.smart_tricks import askfor
@@ -16,17 +15,104 @@ from resources.smart_tricks import askfor
 class RequestSubmitter(BaseSubmitter):
     """
     Subclass of base submitter that is tailored for RelVal submission
+    Submission is split into stages with separate queues, so configs of one
+    RelVal are generated on lxplus while another one is submitted to ReqMgr2
+    This submitter generates and uploads configs, ReqMgrSubmitter submits them
+    RelVals of the same CMSSW release and scram arch are batched, so release
+    area is set up once and configs are uploaded in one go
     """
 
+    QUEUE = 'submission'
+    QUEUE_WORKERS = 10
+    HOSTS = ('lxplus.cern.ch', )
+    # Maximum number of RelVals in a batch
+    BATCH_SIZE = 50
+    # Number of RelVals in a batch whose configs are generated at the same time
+    BATCH_PARALLEL = 8
+
     def add(self, relval, relval_controller):
         """
         Add a RelVal to the submission queue
         """
         prepid = relval.get_prepid()
-        super().add_task(prepid,
-                         self.submit_relval,
-                         relval=relval,
-                         controller=relval_controller)
+        return self.add_job(prepid, {'prepid': prepid})
+
+    def add_many(self, relvals, relval_controller):
+        """
+        Add RelVals to the submission queue, RelVals that can share a release
+        area are added as batches of the same CMSSW release and scram arch
+        """
+        batches = {}
+        for relval in relvals:
+            batch_key = self.get_batch_key(relval)
+            if batch_key:
+                batches.setdefault(batch_key, []).append(relval)
+            else:
+                self.add(relval, relval_controller)
+
+        for (cmssw_release, scram_arch), batch in batches.items():
+            for start in range(0, len(batch), self.BATCH_SIZE):
+                chunk = batch[start:start + self.BATCH_SIZE]
+                if len(chunk) == 1:
+                    self.add(chunk[0], relval_controller)
+                    continue
+
+                prepids = sorted(relval.get_prepid() for relval in chunk)
+                self.add_job(self.get_batch_name(prepids),
+                             {'prepids': prepids,
+                              'cmssw_release': cmssw_release,
+                              'scram_arch': scram_arch})
+
+    def get_batch_key(self, relval):
+        """
+        Return CMSSW release and scram arch of RelVal if its configs can be
+        generated in a shared release area, otherwise None
+        """
+        if relval.get('fragment'):
+            # Fragment is added to the release area and it is rebuilt
+            return None
+
+        batch_keys = set()
+        try:
+            for step in relval.get('steps'):
+                if not step.get_config_file_name():
+                    continue
+
+                if 'HLT:Custom' in step.get('driver').get('step'):
+                    # Custom HLT menu is added to the release area
+                    return None
+
+                batch_keys.add((step.get_release(), step.get_scram_arch()))
+        except Exception as ex:
+            # Error will be reported by submission of a single RelVal
+            self.logger.warning('Will not batch %s: %s', relval.get_prepid(), ex)
+            return None
+
+        if len(batch_keys) != 1:
+            return None
+
+        return batch_keys.pop()
+
+    def get_batch_name(self, prepids):
+        """
+        Return job and remote directory name of a batch of RelVals
+        """
+        return f'batch-{get_hash(sorted(prepids))[:16]}'
+
+    def run_job(self, payload):
+        """
+        Upload configs of RelVal or batch of RelVals of a persistent job
+        """
+        # Controller imports this module
+        from api.controller.relval_controller import RelValController
+        controller = RelValController()
+        if 'prepids' in payload:
+            self.upload_batch_configs(payload['prepids'],
+                                      payload['cmssw_release'],
+                                      payload['scram_arch'],
+                                      controller)
+        else:
+            self.upload_relval_configs(controller.get(payload['prepid']), controller)
 
     def __handle_error(self, relval, error_message):
         """
@@ -90,39 +176,41 @@ class RequestSubmitter(BaseSubmitter):
 
     def prepare_workspace(self, relval, controller, ssh_executor, workspace_dir):
         """
-        Clean or create a remote directory and upload all needed files
+        Upload config generation and upload scripts of a RelVal
         """
         prepid = relval.get_prepid()
         self.logger.info('Preparing workspace for %s', prepid)
-        # Dump config generation to file
-        with open(f'/tmp/{prepid}_generate.sh', 'w') as temp_file:
-            config_file_content = controller.get_cmsdriver(relval, for_submission=True)
-            temp_file.write(config_file_content)
-
-        # Dump config upload to file
-        with open(f'/tmp/{prepid}_upload.sh', 'w') as temp_file:
-            upload_file_content = controller.get_config_upload_file(relval)
-            temp_file.write(upload_file_content)
-
-        # Re-create the directory and create a voms proxy there
-        command = [f'rm -rf {workspace_dir}/{prepid}',
-                   f'mkdir -p {workspace_dir}/{prepid}',
-                   f'cd {workspace_dir}/{prepid}',
-                   'voms-proxy-init -voms cms --valid 4:00 --out $(pwd)/proxy.txt']
-        ssh_executor.execute_command(command)
-
-        # Upload config generation script - cmsDrivers
-        ssh_executor.upload_file(f'/tmp/{prepid}_generate.sh',
-                                 f'{workspace_dir}/{prepid}/config_generate.sh')
-        # Upload config upload to ReqMgr2 script
-        ssh_executor.upload_file(f'/tmp/{prepid}_upload.sh',
-                                 f'{workspace_dir}/{prepid}/config_upload.sh')
-        # Upload python script used by upload script
-        ssh_executor.upload_file('./core_lib/utils/config_uploader.py',
-                                 f'{workspace_dir}/{prepid}/config_uploader.py')
-
-        os.remove(f'/tmp/{prepid}_generate.sh')
-        os.remove(f'/tmp/{prepid}_upload.sh')
+        with open('./core_lib/utils/config_uploader.py') as uploader_file:
+            config_uploader = uploader_file.read()
+
+        # Config generation script - cmsDrivers, config upload to ReqMgr2 script
+        # and python script used by upload script
+        files = {'config_generate.sh': controller.get_cmsdriver(relval, for_submission=True),
+                 'config_upload.sh': controller.get_config_upload_file(relval),
+                 'config_uploader.py': config_uploader}
+        self.upload_workspace(ssh_executor, workspace_dir, prepid, files)
+
+    def prepare_batch_workspace(self, relvals, controller, ssh_executor, workspace_dir,
+                                batch_name, cmssw_release, scram_arch):
+        """
+        Upload batch config generation script and config generation scripts
+        of all RelVals of a batch to their directories
+        """
+        self.logger.info('Preparing workspace for %s with %s RelVals', batch_name, len(relvals))
+        with open('./core_lib/utils/config_uploader.py') as uploader_file:
+            config_uploader = uploader_file.read()
+
+        files = {'config_generate.sh': controller.get_cmsdriver_batch(relvals,
+                                                                      cmssw_release,
+                                                                      scram_arch,
+                                                                      self.BATCH_PARALLEL),
+                 'config_uploader.py': config_uploader}
+        for relval in relvals:
+            prepid = relval.get_prepid()
+            files[f'{prepid}/config_generate.sh'] = controller.get_cmsdriver(relval,
+                                                                             for_submission=True)
+
+        self.upload_workspace(ssh_executor, workspace_dir, batch_name, files)
 
     def check_for_submission(self, relval):
         """
@@ -173,6 +261,77 @@ class RequestSubmitter(BaseSubmitter):
         stdout = [tuple(clean_split(x.strip(), ' ')[1:]) for x in stdout]
         return stdout
 
+    def generate_batch_configs(self, relvals, ssh_executor, batch_dir):
+        """
+        SSH to a remote machine and generate cmsDriver config files of all
+        RelVals of a batch
+        Return dictionary of prepids of RelVals that failed and their errors
+        """
+        command = [f'cd {batch_dir}',
+                   'export X509_USER_PROXY=$(pwd)/proxy.txt',
+                   './config_generate.sh']
+        stdout, stderr, exit_code = ssh_executor.execute_command(command)
+        self.logger.debug('Exit code %s for %s config generation', exit_code, batch_dir)
+        if exit_code != 0:
+            raise Exception(f'Error generating configs in {batch_dir}.\n{stderr}')
+
+        prepids = {relval.get_prepid() for relval in relvals}
+        failed = {}
+        for line in clean_split(stdout, '\n'):
+            words = clean_split(line.strip(), ' ')
+            if len(words) != 2 or words[0] != 'Failed':
+                continue
+
+            prepid = words[1]
+            if prepid in prepids and prepid not in failed:
+                log, _, _ = ssh_executor.execute_command(f'tail -n 50 {batch_dir}/{prepid}/'
+                                                         'config_generate.log')
+                failed[prepid] = f'Error generating configs for {prepid}.\n{log}'
+
+        return failed
+
+    def upload_batch_configs_to_reqmgr(self, relvals, controller, ssh_executor, batch_dir,
+                                       cmssw_release, scram_arch):
+        """
+        SSH to a remote machine and upload config files of all RelVals of a
+        batch to ReqMgr2 with a single uploader run
+        Return dictionary of prepids and their config names and hashes
+        """
+        upload_script = controller.get_config_upload_file_batch(relvals,
+                                                                cmssw_release,
+                                                                scram_arch)
+        if not ssh_executor.upload_as_file(upload_script, f'{batch_dir}/config_upload.sh'):
+            raise Exception(f'Error uploading config upload script to {batch_dir}')
+
+        command = [f'cd {batch_dir}',
+                   'chmod +x config_upload.sh',
+                   'export X509_USER_PROXY=$(pwd)/proxy.txt',
+                   './config_upload.sh']
+        stdout, stderr, exit_code = ssh_executor.execute_command(command)
+        self.logger.debug('Exit code %s for %s config upload', exit_code, batch_dir)
+        if exit_code != 0:
+            raise Exception(f'Error uploading configs in {batch_dir}.\n{stderr}')
+
+        stdout = [x for x in clean_split(stdout, '\n') if 'DocID' in x]
+        uploaded = [tuple(clean_split(x.strip(), ' ')[1:]) for x in stdout]
+        # Uploader prints hashes in the same order as files were given
+        expected = [(relval.get_prepid(), step.get_config_file_name())
+                    for relval in relvals
+                    for step in relval.get('steps')
+                    if step.get_config_file_name()]
+        if len(uploaded) != len(expected):
+            raise Exception(f'Expected {len(expected)} config hashes in {batch_dir}, '
+                            f'got {len(uploaded)}')
+
+        config_hashes = {}
+        for (prepid, config_name), (label, config_hash) in zip(expected, uploaded):
+            if label != config_name:
+                raise Exception(f'Expected hash of {config_name} of {prepid}, got {label}')
+
+            config_hashes.setdefault(prepid, []).append((config_name, config_hash))
+
+        return config_hashes
+
     def update_steps_with_config_hashes(self, relval, config_hashes):
         """
         Iterate through RelVal steps and set config_id values
@@ -208,19 +367,25 @@ class RequestSubmitter(BaseSubmitter):
                 step_name = step.get('name')
                 raise Exception(f'Missing hash for step {step_name}')
 
-    def submit_relval(self, relval, controller):
+    def upload_relval_configs(self, relval, controller):
         """
-        Method that is used by submission workers. This is where the actual submission happens
+        First stage of submission that is used by submission workers
+        Generate and upload configs on lxplus, save their hashes in RelVal steps
+        and pass RelVal to ReqMgr2 submission stage
         """
-        prepid = relval.get_prepid()
         credentials_file = Config.get('credentials_file')
         workspace_dir = Config.get('remote_path').rstrip('/')
         prepid = relval.get_prepid()
         self.logger.debug('Will try to acquire lock for %s', prepid)
         with Locker().get_lock(prepid):
-            self.logger.info('Locked %s for submission', prepid)
+            self.logger.info('Locked %s for config upload', prepid)
             relval_db = Database('relvals')
             relval = controller.get(prepid)
+            if relval.get('status') == 'submitted':
+                # Job was started again after the next stage finished
+                self.logger.warning('%s is already submitted, not uploading configs', prepid)
+                return
+
             try:
                 self.check_for_submission(relval)
                 with SSHExecutor('lxplus.cern.ch', credentials_file) as ssh:
@@ -236,29 +401,151 @@ class RequestSubmitter(BaseSubmitter):
                 self.logger.debug(config_hashes)
                 # Iterate through uploaded configs and save their hashes in RelVal steps
                 self.update_steps_with_config_hashes(relval, config_hashes)
-                # Submit job dict to ReqMgr2
-                job_dict = controller.get_job_dict(relval)
+                relval_db.save(relval.get_json())
+            except Exception as ex:
+                self.__handle_error(relval, str(ex))
+                return
+
+        ReqMgrSubmitter().add(relval, controller)
+        self.logger.info('Uploaded configs of %s', prepid)
+
+    def upload_batch_configs(self, prepids, cmssw_release, scram_arch, controller):
+        """
+        First stage of submission of a batch of RelVals of the same CMSSW
+        release and scram arch that is used by submission workers
+        Set up release area once, generate configs of all RelVals in parallel,
+        upload them with a single uploader run and pass RelVals to ReqMgr2
+        submission stage
+        RelVals that fail are handled one by one, others are not affected
+        """
+        credentials_file = Config.get('credentials_file')
+        workspace_dir = Config.get('remote_path').rstrip('/')
+        batch_name = self.get_batch_name(prepids)
+        batch_dir = f'{workspace_dir}/{batch_name}'
+        uploaded = []
+        locker = Locker()
+        with ExitStack() as locks:
+            # Locks are always acquired in the same order
+            for prepid in sorted(prepids):
+                locks.enter_context(locker.get_lock(prepid))
+
+            self.logger.info('Locked %s RelVals of %s for config upload', len(prepids), batch_name)
+            relval_db = Database('relvals')
+            relvals = []
+            for prepid in prepids:
+                relval = controller.get(prepid)
+                if relval.get('status') == 'submitted':
+                    # Job was started again after the next stage finished
+                    self.logger.warning('%s is already submitted, not uploading configs', prepid)
+                    continue
+
+                try:
+                    self.check_for_submission(relval)
+                    relvals.append(relval)
+                except Exception as ex:
+                    self.__handle_error(relval, str(ex))
+
+            if not relvals:
+                return
+
+            try:
+                with SSHExecutor('lxplus.cern.ch', credentials_file) as ssh:
+                    self.prepare_batch_workspace(relvals,
+                                                 controller,
+                                                 ssh,
+                                                 workspace_dir,
+                                                 batch_name,
+                                                 cmssw_release,
+                                                 scram_arch)
+                    failed = self.generate_batch_configs(relvals, ssh, batch_dir)
+                    for relval in relvals:
+                        if relval.get_prepid() in failed:
+                            self.__handle_error(relval, failed[relval.get_prepid()])
+
+                    relvals = [r for r in relvals if r.get_prepid() not in failed]
+                    config_hashes = {}
+                    if relvals:
+                        config_hashes = self.upload_batch_configs_to_reqmgr(relvals,
+                                                                            controller,
+                                                                            ssh,
+                                                                            batch_dir,
+                                                                            cmssw_release,
+                                                                            scram_arch)
+
+                    # Remove remote batch directory
+                    ssh.execute_command([f'rm -rf {batch_dir}'])
+
+            except Exception as ex:
+                for relval in relvals:
+                    self.__handle_error(relval, str(ex))
+
+                return
+
+            for relval in relvals:
+                prepid = relval.get_prepid()
+                try:
+                    self.update_steps_with_config_hashes(relval, config_hashes.get(prepid, []))
+                    relval_db.save(relval.get_json())
+                    uploaded.append(relval)
+                except Exception as ex:
+                    self.__handle_error(relval, str(ex))
+
+        for relval in uploaded:
+            ReqMgrSubmitter().add(relval, controller)
+
+        self.logger.info('Uploaded configs of %s/%s RelVals of %s',
+                         len(uploaded),
+                         len(prepids),
+                         batch_name)
+
+    def submit_relval(self, relval, controller):
+        """
+        Second stage of submission that is used by ReqMgr2 submission workers
+        Submit job dict of RelVal with uploaded configs to ReqMgr2 and approve
+        the workflow once ReqMgr2 has it
+        """
+        prepid = relval.get_prepid()
+        self.logger.debug('Will try to acquire lock for %s', prepid)
+        with Locker().get_lock(prepid):
+            self.logger.info('Locked %s for submission', prepid)
+            relval_db = Database('relvals')
+            relval = controller.get(prepid)
+            workflows = relval.get('workflows')
+            # Job was started again after workflow was submitted
+            resumed = relval.get('status') == 'submitted' and bool(workflows)
+            try:
                 cmsweb_url = Config.get('cmsweb_url')
                 grid_cert = Config.get('grid_user_cert')
                 grid_key = Config.get('grid_user_key')
-                connection = ConnectionWrapper(host=cmsweb_url,
-                                               cert_file=grid_cert,
-                                               key_file=grid_key)
-                workflow_name = self.submit_job_dict(job_dict, connection)
-                # Update RelVal after successful submission
-                relval.set('workflows', [{'name': workflow_name}])
-                relval.set('status', 'submitted')
-                relval.add_history('submission', 'succeeded', 'automatic')
-                relval_db.save(relval.get_json())
-                time.sleep(3)
-                self.approve_workflow(workflow_name, connection)
-                connection.close()
+                with ConnectionWrapper(host=cmsweb_url,
+                                       cert_file=grid_cert,
+                                       key_file=grid_key) as connection:
+                    if resumed:
+                        workflow_name = workflows[-1]['name']
+                        self.logger.warning('%s is already submitted as %s',
+                                            prepid,
+                                            workflow_name)
+                    else:
+                        self.check_for_submission(relval)
+                        # Submit job dict to ReqMgr2
+                        job_dict = controller.get_job_dict(relval)
+                        workflow_name = self.submit_job_dict(job_dict, connection)
+                        # Update RelVal after successful submission
+                        relval.set('workflows', [{'name': workflow_name}])
+                        relval.set('status', 'submitted')
+                        relval.add_history('submission', 'succeeded', 'automatic')
+                        relval_db.save(relval.get_json())
+
+                    # Workflow might not be available right after submission
+                    self.wait_for_workflow(workflow_name, connection)
+                    self.approve_workflow(workflow_name, connection)
 
             except Exception as ex:
                 self.__handle_error(relval, str(ex))
                 return
 
-            self.__handle_success(relval)
+            if not resumed:
+                self.__handle_success(relval)
 
         controller.update_workflows(relval)
 
@@ -308,3 +595,31 @@ class RequestSubmitter(BaseSubmitter):
         recipients = emailer.get_recipients(relval)
         emailer.send_with_mime(subject, body, recipients)
         self.logger.info(f"Email sent to {recipients} about the status update of RelVal {relval_id} to 'announced'.")
+
+
+class ReqMgrSubmitter(RequestSubmitter):
+    """
+    Submission stage that submits RelVals with uploaded configs to ReqMgr2
+    It does not use lxplus, so it is not limited by lxplus sessions
+    """
+
+    QUEUE = 'reqmgr'
+    QUEUE_WORKERS = 5
+    HOSTS = ()
+
+    def add(self, relval, relval_controller):
+        """
+        Add a RelVal to the ReqMgr2 submission queue
+        """
+        prepid = relval.get_prepid()
+        # Job of the previous stage with prepid as name is not finished yet
+        return self.add_job(f'{prepid}-reqmgr', {'prepid': prepid})
+
+    def run_job(self, payload):
+        """
+        Submit RelVal of a persistent job to ReqMgr2
+        """
+        # Controller imports this module
+        from api.controller.relval_controller import RelValController
+        controller = RelValController()
+        self.submit_relval(controller.get(payload['prepid']), controller)
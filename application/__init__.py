@@ -4,13 +4,18 @@ import time
 import json
 import logging
 import logging.handlers
+from urllib.parse import urlencode
 from colorlog import ColoredFormatter
 from flask import Flask, render_template, request, session, g
 from flask_restful import Api
 from flask_cors import CORS
 from jinja2.exceptions import TemplateNotFound
 from database.database import Database
+from database.indexes import IndexReconciler
+from database.search_index import SearchIndex
 from core_lib.utils.global_config import Config
+from core_lib.utils.scram_arch_index import ScramArchIndex
+from core_lib.utils.submitter import Submitter
 from core_lib.utils.username_filter import UsernameFilter
 
 from resources.smart_tricks import askfor
@@ -35,6 +40,17 @@ def get_userinfo():
         session['time'] = time_now
     return session['user']
 
+def get_next_page_url(next_cursor):
+    """Return URL of the next page of a table page or None if it is the last page"""
+    if not next_cursor:
+        return None
+
+    args = request.args.to_dict()
+    # Next page starts after the cursor, page number is not used
+    args.pop('page', None)
+    args['after'] = next_cursor
+    return f'{request.path}?{urlencode(args)}'
+
 def setup_logging(debug):
     """
     Setup logging format and place - console for debug mode and rotating files for production
@@ -116,6 +132,12 @@ def create_app():
                                 SubmissionWorkerStatusAPI,
                                 SubmissionQueueAPI,
                                 ObjectsInfoAPI,
+                                DatabaseStatusAPI,
+                                ConnectionPoolStatusAPI,
+                                SSHSessionPoolStatusAPI,
+                                CacheStatusAPI,
+                                GlobalTagCacheAPI,
+                                LogAPI,
                                 BuildInfoAPI,
                                 UptimeInfoAPI
                                 )
@@ -127,6 +149,10 @@ def create_app():
                               CreateJiraTicketAPI
                               )
 
+    from api.utils.submitter import RequestSubmitter, ReqMgrSubmitter
+    from api.utils.relval_test_submitter import RelvalTestSubmitter
+    from api.utils.dqm_submitter import DQMRequestSubmitter
+
     api = Api(app)
 
     @app.before_first_request
@@ -208,6 +234,12 @@ def create_app():
     api.add_resource(SubmissionWorkerStatusAPI, '/api/system/workers')
     api.add_resource(SubmissionQueueAPI, '/api/system/queue')
     api.add_resource(ObjectsInfoAPI, '/api/system/objects_info')
+    api.add_resource(DatabaseStatusAPI, '/api/system/database')
+    api.add_resource(ConnectionPoolStatusAPI, '/api/system/connections')
+    api.add_resource(SSHSessionPoolStatusAPI, '/api/system/ssh')
+    api.add_resource(CacheStatusAPI, '/api/system/cache')
+    api.add_resource(GlobalTagCacheAPI, '/api/system/global_tags')
+    api.add_resource(LogAPI, '/api/system/logs')
     api.add_resource(BuildInfoAPI, '/api/system/build_info')
     api.add_resource(UptimeInfoAPI, '/api/system/uptime')
     api.add_resource(SettingsAPI,
@@ -265,6 +297,8 @@ def create_app():
     # Init database connection
     Database.set_database_name('relval')
     Database.set_credentials(os.getenv('DATABASE_USER'), os.getenv('DATABASE_PASSWORD'))
+    Database.set_pool_options(config.get('database_pool_size', 100),
+                              config.get('database_idle_time', 300))
     Database.add_search_rename('tickets', 'created_on', 'history.0.time')
     Database.add_search_rename('tickets', 'created_by', 'history.0.user')
     Database.add_search_rename('tickets', 'workflows', 'workflow_ids<float>')
@@ -277,4 +311,24 @@ def create_app():
     debug = config.get('development', False)
     logger = setup_logging(debug)
     logger.info('Starting... Debug: ')
+    # Create missing database indexes
+    try:
+        IndexReconciler().reconcile()
+    except Exception as ex:  # pylint: disable=broad-except
+        logger.error('Could not reconcile database indexes: %s', ex)
+
+    # Submission workers and concurrent lxplus sessions of all submitters,
+    # workers above lxplus sessions run stages that do not need lxplus
+    Submitter.configure(config.get('submission_threads', 20),
+                        {'lxplus.cern.ch': config.get('lxplus_sessions', 12)})
+    # Run persistent jobs, including ones left by stopped replicas
+    Submitter.start_job_queue([RequestSubmitter,
+                               ReqMgrSubmitter,
+                               RelvalTestSubmitter,
+                               DQMRequestSubmitter])
+    # Load scram arch index before first request needs it
+    ScramArchIndex.warm_up()
+    # Build search indexes before first search needs them
+    SearchIndex.warm_up()
+
     return app
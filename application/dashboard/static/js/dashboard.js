@@ -1,6 +1,6 @@
 function fetchWorkerInfo(){
   fetch('api/system/workers').then(res => res.json()).then(d =>{
-    submissionWorkers = d.response;
+    submissionWorkers = d.response.workers;
     $('#threads').html('Submission threads ('+Object.keys(submissionWorkers).length+')')
     $('#threads-list').html("")
     for (var i in submissionWorkers) {
@@ -18,7 +18,9 @@ function fetchQueueInfo() {
     $('#queue').html('Submission queue ('+submissionQueue.length+')')
     $('#queue-list').html("")
     for (var i = 0; i < submissionQueue.length; i++) {
-      $('#queue-list').append('<li><a href="relvals?prepid="'+submissionQueue[i]+' title="Show this RelVal"></a> is waiting in queue</li>')
+      // Persistent jobs are named <queue>:<prepid>
+      let prepid = submissionQueue[i].split(':').pop();
+      $('#queue-list').append('<li><a href="relvals?prepid='+prepid+'" title="Show this RelVal">'+submissionQueue[i]+'</a> is waiting in queue</li>')
     }
   })
 }
@@ -36,7 +36,7 @@ def get_dataset_choices(relvals):
         choices = get_choices(relvals)
     except Exception as e:
         print(e)
-        relvals=update_workflows(relvals)
+        relvals=update_workflows(relvals)['response']
         choices = get_choices(relvals)
     return choices
 
@@ -114,15 +114,13 @@ def dqm_plots():
     return render_template('DQMPlots.html.jinja', table=table)
 
 def update_workflows(relvals):
-    relval_list = []
-    for relval in relvals:
-        data = {'prepid': relval['prepid']}
-        status = askfor.post('/api/relvals/update_workflows',
-                            data=json.dumps(data),
-                            headers=request.headers
-                            ).json()
-        relval_list.append(status)
-    return relval_list
+    # All RelVals are updated in one request, workflows are fetched in batches
+    prepids = [relval['prepid'] for relval in relvals]
+    status = askfor.post('/api/relvals/update_workflows',
+                        data=json.dumps(prepids),
+                        headers=request.headers
+                        ).json()
+    return status
 
 def getValidJSON(jsonset):
     """Convert input json to valid json for reinput to the form"""
@@ -151,7 +149,7 @@ def update_workflows_for_jira(jira):
     response = askfor.get('api/search?db_name=relvals&status=submitted|done' +'&jira_ticket='+jira).json()
     relvals = response['response']['results']
     status = update_workflows(relvals)
-    return jsonify(status[0])
+    return jsonify(status)
 
 @dqm_blueprint.route('/dqm/add_set', methods=['GET', 'PUT'])
 def add_set():
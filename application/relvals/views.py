@@ -11,7 +11,7 @@ from flask import (Blueprint,
                     url_for
                   )
 from werkzeug.datastructures import MultiDict
-from .. import get_userinfo
+from .. import get_userinfo, get_next_page_url
 from resources.smart_tricks import askfor
 from .Table import RelvalTable
 from .relval_forms import RelvalForm, StepsForm
@@ -22,15 +22,18 @@ relval_blueprint = Blueprint('relvals', __name__, url_prefix='/relvals', templat
 # @relval_blueprint.route('', strict_slashes=False, methods=['GET'])
 def get_relval():
     user = get_userinfo()
-    response = askfor.get('api/search?db_name=relvals' +'&'+ request.query_string.decode()).json()
+    # Only attributes that table renders
+    fields = '' if 'fields' in request.args else '&fields=table'
+    response = askfor.get('api/search?db_name=relvals' + fields +'&'+ request.query_string.decode()).json()
     items = response['response']['results']
     table = RelvalTable(items, classes=['table', 'table-hover'])
+    next_url = get_next_page_url(response['response'].get('next'))
 
     ticket = request.args.get('ticket')
     prepid = request.args.get('prepid')
     return render_template('Relvals.html.jinja', user_name=user['response']['fullname'], user=user,
                             table=table, userinfo=user['response'], 
-                            ticket=ticket, prepid=prepid
+                            ticket=ticket, prepid=prepid, next_url=next_url
                           )
 
 def prepareStepForForm(data):
@@ -1,13 +1,12 @@
 import re
 import ast
-import json
 import logging
 from flask_wtf import FlaskForm
 from wtforms import SubmitField
 from wtforms.validators import DataRequired, ValidationError, StopValidation, NumberRange
 
 from core_lib.utils.global_config import Config
-from core_lib.utils.common_utils import ConnectionWrapper
+from core_lib.utils.common_utils import dbs_api, dbs_dataset_runs
 import requests
 from resources.custom_form_fields import (CustomSelect,
                                           SIntegerField,
@@ -58,9 +57,6 @@ class Tier0Api(object):
         return result
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-grid_cert = Config.get('grid_user_cert')
-grid_key = Config.get('grid_user_key')
-cmsweb_url = 'https://cmsweb.cern.ch'
 
 
 class GTDataRequired(object):
@@ -261,18 +257,13 @@ class TicketForm(FlaskForm):
             test_datasets = list(map(lambda x: x.strip(), test_datasets))
             test_datasets = list((filter(lambda x: len(x)>0, test_datasets)))
         wrong_datasets = list()
-        with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-            for dataset in test_datasets:
-                regex = r'^/[a-zA-Z0-9\-_]{1,99}/[a-zA-Z0-9\.\-_]{1,199}/[A-Z\-]{1,50}$'
-                if not re.fullmatch(regex, dataset):
-                    wrong_datasets.append(dataset)
-                    continue
-                res = dbs_conn.api(
-                        'GET',
-                        f'/dbs/prod/global/DBSReader/datasets?dataset={dataset}'
-                        )
-                res = json.loads(res.decode('utf-8'))
-                if not res: wrong_datasets.append(dataset)
+        for dataset in test_datasets:
+            regex = r'^/[a-zA-Z0-9\-_]{1,99}/[a-zA-Z0-9\.\-_]{1,199}/[A-Z\-]{1,50}$'
+            if not re.fullmatch(regex, dataset):
+                wrong_datasets.append(dataset)
+                continue
+            res = dbs_api('datasets', {'dataset': dataset})
+            if not res: wrong_datasets.append(dataset)
         if wrong_datasets and not test:
             raise ValidationError(f'Invalid datasets: {", ".join(wrong_datasets)}')
         elif (not field.data.strip()) and self.input_runs.data and (not test):
@@ -297,17 +288,12 @@ class TicketForm(FlaskForm):
             raise ValidationError('Accepted only comma separated list of runs \
                                     or JSON formatted lumisections')
         wrong_runs = list()
-        with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-            for run in test_runs:
-                if not re.fullmatch(r'^\d{6}$', run):
-                    wrong_runs.append(run)
-                    continue
-                res = dbs_conn.api(
-                        'GET',
-                        f'/dbs/prod/global/DBSReader/runs?run_num={run}'
-                        )
-                res = json.loads(res.decode('utf-8'))
-                if not res: wrong_runs.append(run)
+        for run in test_runs:
+            if not re.fullmatch(r'^\d{6}$', run):
+                wrong_runs.append(run)
+                continue
+            res = dbs_api('runs', {'run_num': run})
+            if not res: wrong_runs.append(run)
         if wrong_runs:
             raise ValidationError(f'Invalid runs: {", ".join(wrong_runs)}')
         if (not field.data.strip()) and self.input_datasets.data:
@@ -317,16 +303,10 @@ class TicketForm(FlaskForm):
         input_datasets = self.validate_input_datasets(self.input_datasets, test=True)
         if input_datasets:
             incompatible_runs = {d: [] for d in input_datasets}
-            with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-                for dataset in input_datasets:
-                    runs_in_dataset = dbs_conn.api(
-                            'GET',
-                            f'/dbs/prod/global/DBSReader/runs?dataset={dataset}'
-                            )
-                    res = json.loads(runs_in_dataset.decode('utf-8'))
-                    res = {a_dict['run_num'] for a_dict in res}
-                    bad_runs = list(set([int(a) for a in test_runs]).difference(res))
-                    incompatible_runs[dataset] = bad_runs
+            for dataset in input_datasets:
+                res = set(dbs_dataset_runs(dataset))
+                bad_runs = list(set([int(a) for a in test_runs]).difference(res))
+                incompatible_runs[dataset] = bad_runs
             if [v for _, v in incompatible_runs.items() if v]:
                 msg = ""
                 for k, v in incompatible_runs.items():
@@ -13,19 +13,15 @@ from flask import (Blueprint,
 
 from werkzeug.datastructures import MultiDict
 
-from core_lib.utils.connection_wrapper import ConnectionWrapper
-from core_lib.utils.global_config import Config
+from core_lib.utils.common_utils import dbs_api, dbs_dataset_runs
 from resources.oms_api import OMSAPI
 from .forms import TicketForm
-from .. import get_userinfo
+from .. import get_userinfo, get_next_page_url
 
 from resources.smart_tricks import askfor, DictObj
 
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-grid_cert = Config.get('grid_user_cert')
-grid_key = Config.get('grid_user_key')
-cmsweb_url = 'https://cmsweb.cern.ch'
 
 ticket_blueprint = Blueprint('tickets', __name__, url_prefix='/tickets', template_folder='templates', static_folder='static')
 
@@ -123,12 +119,15 @@ from .Table import ItemTable
 @ticket_blueprint.route('', strict_slashes=False, methods=['GET'])
 def tickets():
     user = get_userinfo()
-    response = askfor.get('api/search?db_name=tickets' +'&'+ request.query_string.decode()).json()
+    # Only attributes that table and ticket actions use
+    fields = '' if 'fields' in request.args else '&fields=table'
+    response = askfor.get('api/search?db_name=tickets' + fields +'&'+ request.query_string.decode()).json()
     items = response['response']['results']
     table = ItemTable(items, classes=['table', 'table-hover'])
     itemdict = DictObj({value['_id']: value for value in items})
     itemdict = {value['_id']: value for value in items}
-    return render_template('Tickets.html.jinja', user_name=user['response']['fullname'], user=user, table=table, userinfo=user['response'], items = json.dumps(itemdict))
+    next_url = get_next_page_url(response['response'].get('next'))
+    return render_template('Tickets.html.jinja', user_name=user['response']['fullname'], user=user, table=table, userinfo=user['response'], items = json.dumps(itemdict), next_url=next_url)
 
 @ticket_blueprint.route('/fetch-events', methods=['POST'])
 def fetch_events():
@@ -147,19 +146,13 @@ def validateDataAndFetchEvents(data):
         test_datasets = list(map(lambda x: x.strip(), test_datasets))
         test_datasets = list((filter(lambda x: len(x)>0, test_datasets)))
     wrong_datasets = list()
-    if test_datasets:
-        with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-            for dataset in test_datasets:
-                regex = r'^/[a-zA-Z0-9\-_]{1,99}/[a-zA-Z0-9\.\-_]{1,199}/[A-Z\-]{1,50}$'
-                if not re.fullmatch(regex, dataset):
-                    wrong_datasets.append(dataset)
-                    continue
-                res = dbs_conn.api(
-                        'GET',
-                        f'/dbs/prod/global/DBSReader/datasets?dataset={dataset}'
-                        )
-                res = json.loads(res.decode('utf-8'))
-                if not res: wrong_datasets.append(dataset)
+    for dataset in test_datasets:
+        regex = r'^/[a-zA-Z0-9\-_]{1,99}/[a-zA-Z0-9\.\-_]{1,199}/[A-Z\-]{1,50}$'
+        if not re.fullmatch(regex, dataset):
+            wrong_datasets.append(dataset)
+            continue
+        res = dbs_api('datasets', {'dataset': dataset})
+        if not res: wrong_datasets.append(dataset)
 
     if wrong_datasets:
         resp['response'] = f'Invalid datasets: {", ".join(wrong_datasets)}'
@@ -185,18 +178,12 @@ def validate_input_runs(runstring, datasets=[]):
                                 or JSON formatted lumisections'
         return resp
     wrong_runs = list()
-    if test_runs:
-        with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-            for run in test_runs:
-                if not re.fullmatch(r'^\d{6}$', run):
-                    wrong_runs.append(run)
-                    continue
-                res = dbs_conn.api(
-                        'GET',
-                        f'/dbs/prod/global/DBSReader/runs?run_num={run}'
-                        )
-                res = json.loads(res.decode('utf-8'))
-                if not res: wrong_runs.append(run)
+    for run in test_runs:
+        if not re.fullmatch(r'^\d{6}$', run):
+            wrong_runs.append(run)
+            continue
+        res = dbs_api('runs', {'run_num': run})
+        if not res: wrong_runs.append(run)
     if wrong_runs:
         resp['response']=f'Invalid runs: {", ".join(wrong_runs)}'
         return resp
@@ -207,28 +194,19 @@ def validate_input_runs(runstring, datasets=[]):
     # Test if given runs are available in all datasets
     incompatible_runs = {d: [] for d in datasets}
     files_info = {d: 0 for d in datasets}
-    with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as dbs_conn:
-        for dataset in datasets:
-            runs_in_dataset = dbs_conn.api(
-                    'GET',
-                    f'/dbs/prod/global/DBSReader/runs?dataset={dataset}'
-                    )
-            res = json.loads(runs_in_dataset.decode('utf-8'))
-            res = {a_dict['run_num'] for a_dict in res}
-            bad_runs = list(set([int(a) for a in test_runs]).difference(res))
-            incompatible_runs[dataset] = bad_runs
+    for dataset in datasets:
+        run_numbers = ast.literal_eval((runstring))
+        runWithLumi = isinstance(run_numbers, dict)
+        res = set(dbs_dataset_runs(dataset))
+        bad_runs = list(set([int(a) for a in test_runs]).difference(res))
+        incompatible_runs[dataset] = bad_runs
 
-            # Filling files number info
-            for RunNumb in test_runs:
-                run_numbers = ast.literal_eval((runstring))
-                runWithLumi = isinstance(run_numbers, dict)
-                if runWithLumi:
-                    LumiSec = str(run_numbers[RunNumb]).replace(' ', '')
-                LumiSec = f'&lumi_list={LumiSec}' if runWithLumi else ''
-                files = dbs_conn.api('GET',
-                f'/dbs/prod/global/DBSReader/files?dataset={dataset}&run_num={RunNumb}{LumiSec}',
-                )
-                files_info[dataset] += len(json.loads(files.decode('utf-8')))
+        # Filling files number info
+        for RunNumb in test_runs:
+            query = {'dataset': dataset, 'run_num': RunNumb}
+            if runWithLumi:
+                query['lumi_list'] = str(run_numbers[RunNumb]).replace(' ', '')
+            files_info[dataset] += len(dbs_api('files', query))
 
     if [v for _, v in incompatible_runs.items() if v]:
         msg = "<ul style='list-style-type: none; padding: 0;'>"
@@ -85,10 +85,13 @@ class ControllerBase():
         with self.locker.get_nonblocking_lock(prepid):
             self.logger.info('Will edit %s', prepid)
             database = Database(self.database_name)
-            old_object_json = database.get(prepid)
+            old_object_json = database.get(prepid, keep_last_update=True)
             if not old_object_json:
                 raise ObjectNotFound(prepid)
 
+            # Save only if nobody else saved the object since it was fetched
+            last_update = old_object_json.pop('last_update', None)
+
             old_object = self.model_class(json_input=old_object_json, check_attributes=False)
             # Move over history, so it could not be overwritten
             new_object.set('history', old_object.get('history'))
@@ -108,7 +111,7 @@ class ControllerBase():
                     return None
 
             self.before_update(old_object, new_object, changed_values)
-            if not database.save(new_object.get_json()):
+            if not database.save(new_object.get_json(), last_update):
                 raise Exception(f'Error saving {prepid} to database')
 
             self.after_update(old_object, new_object, changed_values)
@@ -3,35 +3,227 @@ Module that contains caching classes
 """
 
 import time
+import logging
+import weakref
+from functools import wraps
+from collections import OrderedDict
+from threading import Lock, Thread
 
 
 class TimeoutCache():
     """
     Simplest time based cache
+    If max_size is set, least recently used values are evicted when cache is full
+    If sweep_interval is set, expired values are removed in the background
+    Named caches are listed in TimeoutCache.get_all_stats()
     """
-    def __init__(self, timeout=300):
+
+    # Caches that are swept in the background
+    __sweep_caches = weakref.WeakSet()
+    __sweeper = None
+    __sweeper_lock = Lock()
+    __sweeper_interval = 60
+    # Named caches for statistics
+    __named_caches = weakref.WeakValueDictionary()
+    # Marker of a missing value
+    __missing = object()
+
+    def __init__(self, timeout=300, max_size=None, name=None, sweep_interval=None):
         self.default_timeout = timeout
-        self.values = {}
+        self.max_size = max_size
+        self.name = name
+        self.values = OrderedDict()
+        self.lock = Lock()
+        # Locks of keys whose values are being computed in get_or_set
+        self.key_locks = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        if name:
+            TimeoutCache.__named_caches[name] = self
+
+        if sweep_interval:
+            TimeoutCache.start_sweeper(self, sweep_interval)
 
     def set(self, key, value, custom_timeout=None):
         """
         Add value to cache
         """
-        self.values[key] = {'time': time.time(),
-                            'timeout': custom_timeout or self.default_timeout,
-                            'value': value}
+        with self.lock:
+            self.values[key] = {'time': time.time(),
+                                'timeout': custom_timeout or self.default_timeout,
+                                'value': value}
+            self.values.move_to_end(key)
+            # Expired values are removed by sweeper and reads, full cache
+            # evicts least recently used value without scanning all values
+            while self.max_size and len(self.values) > self.max_size:
+                _, evicted = self.values.popitem(last=False)
+                if time.time() > evicted['time'] + evicted['timeout']:
+                    self.stats['expirations'] += 1
+                else:
+                    self.stats['evictions'] += 1
 
     def get(self, key, default=None):
         """
         Get value from cache
         Returns None if value does not exist or expired
         """
+        with self.lock:
+            value = self.lookup(key)
+            if value is TimeoutCache.__missing:
+                self.stats['misses'] += 1
+                return default
+
+            self.stats['hits'] += 1
+            return value
+
+    def lookup(self, key):
+        """
+        Return value from cache or missing marker without counting hit or miss
+        Must be called with lock acquired
+        """
         value = self.values.get(key, None)
         if value is None:
-            return default
+            return TimeoutCache.__missing
 
         if time.time() > value['time'] + value['timeout']:
             self.values.pop(key)
-            return default
+            self.stats['expirations'] += 1
+            return TimeoutCache.__missing
+
+        self.values.move_to_end(key)
+        return value['value']
+
+    def get_or_set(self, key, function, custom_timeout=None):
+        """
+        Get value from cache or compute it with function and add to cache
+        Concurrent callers of the same key wait for the first one to compute it
+        Custom timeout can be a function that returns timeout for computed value
+        Each call counts exactly one hit or miss
+        """
+        with self.lock:
+            value = self.lookup(key)
+            if value is not TimeoutCache.__missing:
+                self.stats['hits'] += 1
+                return value
+
+            key_lock = self.key_locks.setdefault(key, [Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                # Maybe value was computed while waiting for a lock
+                with self.lock:
+                    value = self.lookup(key)
+                    if value is not TimeoutCache.__missing:
+                        self.stats['hits'] += 1
+                        return value
+
+                    self.stats['misses'] += 1
+
+                value = function()
+                if callable(custom_timeout):
+                    self.set(key, value, custom_timeout(value))
+                else:
+                    self.set(key, value, custom_timeout)
+
+                return value
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    self.key_locks.pop(key, None)
+
+    def memoize(self, custom_timeout=None):
+        """
+        Decorator that caches results of a function by its arguments
+        Arguments must be hashable
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                key = (function.__qualname__, args, tuple(sorted(kwargs.items())))
+                return self.get_or_set(key, lambda: function(*args, **kwargs), custom_timeout)
+
+            return wrapper
+
+        return decorator
+
+    def delete(self, key):
+        """
+        Remove value from cache if it exists
+        """
+        with self.lock:
+            self.values.pop(key, None)
 
-        return value['value']
\ No newline at end of file
+    def clear(self):
+        """
+        Remove all values from cache
+        """
+        with self.lock:
+            self.values.clear()
+
+    def remove_expired(self):
+        """
+        Remove all expired values
+        Must be called with lock acquired
+        """
+        now = time.time()
+        expired = [k for k, v in self.values.items() if now > v['time'] + v['timeout']]
+        for key in expired:
+            self.values.pop(key)
+
+        self.stats['expirations'] += len(expired)
+
+    def sweep(self):
+        """
+        Remove all expired values
+        """
+        with self.lock:
+            self.remove_expired()
+
+    def get_stats(self):
+        """
+        Return hit, miss, eviction and expiration counters and size of cache
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.values)
+
+        stats['max_size'] = self.max_size
+        return stats
+
+    @staticmethod
+    def get_all_stats():
+        """
+        Return statistics of all named caches
+        """
+        caches = list(TimeoutCache.__named_caches.items())
+        return {name: cache.get_stats() for name, cache in caches}
+
+    @staticmethod
+    def start_sweeper(cache, interval):
+        """
+        Add cache to the background sweeper and start sweeper if it is not running
+        All caches are swept with the shortest of requested intervals
+        """
+        with TimeoutCache.__sweeper_lock:
+            TimeoutCache.__sweep_caches.add(cache)
+            TimeoutCache.__sweeper_interval = min(TimeoutCache.__sweeper_interval, interval)
+            if TimeoutCache.__sweeper is None:
+                TimeoutCache.__sweeper = Thread(target=TimeoutCache.sweep_all,
+                                                name='cache-sweeper',
+                                                daemon=True)
+                TimeoutCache.__sweeper.start()
+
+    @staticmethod
+    def sweep_all():
+        """
+        Periodically remove expired values from all swept caches
+        """
+        logger = logging.getLogger()
+        while True:
+            time.sleep(TimeoutCache.__sweeper_interval)
+            for cache in list(TimeoutCache.__sweep_caches):
+                try:
+                    cache.sweep()
+                except Exception as ex:  # pylint: disable=broad-except
+                    logger.error('Error sweeping cache %s: %s', cache.name, ex)
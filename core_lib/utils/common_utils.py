@@ -5,17 +5,28 @@ import re
 import json
 import logging
 import hashlib
-import xml.etree.ElementTree as XMLet
+from copy import deepcopy
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .ssh_executor import SSHExecutor
 from .cache import TimeoutCache
 from .connection_wrapper import ConnectionWrapper
 from .locker import Locker
 from .global_config import Config
+from .scram_arch_index import ScramArchIndex
 
 
-# Scram arch cache to save some requests to cmssdt.cern.ch
-__scram_arch_cache = TimeoutCache(3600)
+# DBS instance that is used if config does not have dbs_url
+DBS_URL = 'https://cmsweb-prod.cern.ch:8443'
+# Number of seconds to keep DBS responses of each endpoint
+DBS_CACHE_TIMEOUTS = {'datasetlist': 600,
+                      'datasets': 600,
+                      'runs': 1800,
+                      'files': 600}
+# Empty responses, e.g. of datasets that do not exist yet, are kept for a shorter time
+DBS_NEGATIVE_TIMEOUT = 60
+__dbs_cache = TimeoutCache(600, max_size=5000, name='dbs', sweep_interval=60)
 
 
 def clean_split(string, separator=',', maxsplit=-1):
@@ -90,41 +101,71 @@ def get_scram_arch(cmssw_release):
     """
     Get scram arch from
     https://cmssdt.cern.ch/SDT/cgi-bin/ReleasesXML?anytype=1
-    Cache it global variable
+    Releases are kept in a persistent index
     """
     if not cmssw_release:
         return None
 
     cmssw_release = cmssw_release.split('/')[-1]
-    cached_releases = __scram_arch_cache.get('releases', {})
-    cached_value = cached_releases.get(cmssw_release)
-    if cached_value:
-        return cached_value
-
-    with Locker().get_lock('get-scram-arch'):
-        # Maybe cache got updated while waiting for a lock
-        cached_releases = __scram_arch_cache.get('releases', {})
-        cached_value = cached_releases.get(cmssw_release)
-        if cached_value:
-            return cached_value
-
-        with ConnectionWrapper(host='https://cmssdt.cern.ch') as connection:
-            response = connection.api('GET', '/SDT/cgi-bin/ReleasesXML?anytype=1')
-
-        root = XMLet.fromstring(response)
-        releases = {}
-        for architecture in root:
-            if architecture.tag != 'architecture':
-                # This should never happen as children should be <architecture>
+    return ScramArchIndex.get(cmssw_release)
+
+
+def dbs_api(endpoint, params=None, data=None):
+    """
+    Make a GET request with params or a POST request with data to DBSReader
+    endpoint and return parsed response
+    Responses are cached, concurrent requests of the same query wait for the first one
+    Errors are raised and not cached
+    """
+    # Order of values in lists does not change the result
+    query = {k: sorted(v) if isinstance(v, list) else v for k, v in (data or params or {}).items()}
+    method = 'POST' if data else 'GET'
+    cache_key = f'{endpoint}:{method}:{json.dumps(query, sort_keys=True)}'
+    response = __dbs_cache.get_or_set(cache_key,
+                                      lambda: dbs_request(endpoint, method, query),
+                                      lambda response: (DBS_CACHE_TIMEOUTS.get(endpoint)
+                                                        if response
+                                                        else DBS_NEGATIVE_TIMEOUT))
+    return deepcopy(response)
+
+
+def dbs_request(endpoint, method, query, attempts=3):
+    """
+    Make a request to DBSReader endpoint without cache
+    Connection errors and server errors are retried, error responses raise
+    an exception, so they are never cached
+    DBS instance is dbs_url from config, production DBS by default
+    """
+    dbs_url = Config.get('dbs_url', DBS_URL)
+    grid_cert = Config.get('grid_user_cert')
+    grid_key = Config.get('grid_user_key')
+    url = f'/dbs/prod/global/DBSReader/{endpoint}'
+    body = None
+    if method == 'POST':
+        body = json.dumps(query)
+    else:
+        url = f'{url}?{urlencode(query)}'
+
+    headers = {'Content-type': 'application/json',
+               'Accept': 'application/json'}
+    with ConnectionWrapper(dbs_url, grid_cert, grid_key) as dbs_conn:
+        for attempt in range(1, attempts + 1):
+            try:
+                status, _, dbs_response = dbs_conn.request(method, url, body, headers)
+            except Exception as ex:
+                if attempt == attempts:
+                    raise Exception(f'DBS {endpoint} did not respond: {ex}') from ex
+
                 continue
 
-            scram_arch = architecture.attrib.get('name')
-            for release in architecture:
-                releases[release.attrib.get('label')] = scram_arch
+            if status < 500 or attempt == attempts:
+                break
 
-        __scram_arch_cache.set('releases', releases)
+    if status != 200:
+        raise Exception(f'DBS {endpoint} responded with status {status}: '
+                        f'{dbs_response.decode("utf-8")[:500]}')
 
-    return releases.get(cmssw_release)
+    return json.loads(dbs_response.decode('utf-8')) or []
 
 
 def dbs_datasetlist(query):
@@ -142,21 +183,9 @@ def dbs_datasetlist(query):
     else:
         query = query[query.index('/'):]
 
-    grid_cert = Config.get('grid_user_cert')
-    grid_key = Config.get('grid_user_key')
-    with ConnectionWrapper('https://cmsweb-prod.cern.ch:8443', grid_cert, grid_key) as dbs_conn:
-        dbs_response = dbs_conn.api('POST',
-                                    '/dbs/prod/global/DBSReader/datasetlist',
-                                    {'dataset': query,
-                                     'detail': 1,
-                                     'dataset_access_type': '*'},
-                                    headers={'Content-type': 'application/json'})
-
-    dbs_response = json.loads(dbs_response.decode('utf-8'))
-    if not dbs_response:
-        return []
-
-    return dbs_response
+    return dbs_api('datasetlist', data={'dataset': query,
+                                        'detail': 1,
+                                        'dataset_access_type': '*'})
 
 
 def dbs_dataset_runs(dataset):
@@ -166,18 +195,7 @@ def dbs_dataset_runs(dataset):
     if not dataset:
         return []
 
-    grid_cert = Config.get('grid_user_cert')
-    grid_key = Config.get('grid_user_key')
-    with ConnectionWrapper('https://cmsweb-prod.cern.ch:8443', grid_cert, grid_key) as dbs_conn:
-        with Locker().get_lock('get-dataset-runs'):
-            dbs_response = dbs_conn.api('GET',
-                                        f'/dbs/prod/global/DBSReader/runs?dataset={dataset}',
-                                        headers={'Content-type': 'application/json'})
-
-    dbs_response = json.loads(dbs_response.decode('utf-8'))
-    if not dbs_response:
-        return []
-
+    dbs_response = dbs_api('runs', {'dataset': dataset})
     runs = [r['run_num'] for r in dbs_response]
     return runs
 
@@ -255,22 +273,10 @@ def get_workflows_from_reqmgr2_for_prepid(prepid):
     if not prepid:
         return []
 
-    cmsweb_url = Config.get('cmsweb_url')
-    grid_cert = Config.get('grid_user_cert')
-    grid_key = Config.get('grid_user_key')
-    headers = {'Content-type': 'application/json',
-               'Accept': 'application/json'}
-    with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as cmsweb_connection:
-        response = cmsweb_connection.api(
-            'GET',
-            f'/reqmgr2/data/request?prep_id={prepid}',
-            headers=headers
-        )
-    response = json.loads(response.decode('utf-8'))
-    workflows = []
-    for res in response['result']:
-        for value in res.values():
-            workflows.append(value)
+    workflows, failed = get_requests_from_reqmgr2('prep_id', [prepid])
+    if failed:
+        raise Exception(f'Could not fetch {prepid} workflows from ReqMgr2: {failed[prepid]}')
+
     workflows = sort_workflows_by_name(workflows, 'RequestName')
     return workflows
 
@@ -293,33 +299,60 @@ def get_workflows_from_stats(workflow_names):
     workflows = sort_workflows_by_name(workflows, 'RequestName')
     return workflows
 
-def get_workflows_from_reqmgr2(workflow_names):
+def get_requests_from_reqmgr2(attribute, values, batch_size=20, max_workers=4, timeout=60):
     """
-    Fetch workflows from ReqMgr2 with given names
+    Fetch requests from ReqMgr2 where attribute, e.g. name or prep_id, has one of given values
+    Values are grouped to multi-value queries and these are made concurrently
+    Return list of requests and dictionary of values that could not be fetched
+    and exceptions of their batches
     """
-    workflow_names = [w.strip() for w in workflow_names if w.strip()]
-    if not workflow_names:
-        return []
+    values = sorted({v.strip() for v in values if v.strip()})
+    if not values:
+        return [], {}
 
+    logger = logging.getLogger()
     cmsweb_url = Config.get('cmsweb_url')
     grid_cert = Config.get('grid_user_cert')
     grid_key = Config.get('grid_user_key')
-    results = []
     headers = {'Content-type': 'application/json',
                'Accept': 'application/json'}
-    with ConnectionWrapper(cmsweb_url, grid_cert, grid_key) as cmsweb_connection:
-        for workflow_name in workflow_names:
-            response = cmsweb_connection.api(
-                'GET',
-                f'/reqmgr2/data/request?prep_id={workflow_name}',
-                headers=headers
-            )
-            response = json.loads(response.decode('utf-8'))
-            results += response['result']
-    workflows = []
-    for res in results:
-        for value in res.values():
-            workflows.append(value)
+
+    def fetch_batch(batch):
+        query = '&'.join(f'{attribute}={quote(value)}' for value in batch)
+        with ConnectionWrapper(cmsweb_url, grid_cert, grid_key, timeout) as cmsweb_connection:
+            response = cmsweb_connection.api('GET',
+                                             f'/reqmgr2/data/request?{query}',
+                                             headers=headers)
+
+        if response is None:
+            raise Exception('ReqMgr2 did not respond')
+
+        return json.loads(response.decode('utf-8'))['result']
+
+    batches = [values[i:i + batch_size] for i in range(0, len(values), batch_size)]
+    requests = []
+    failed = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        futures = {executor.submit(fetch_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                for result in future.result():
+                    requests.extend(result.values())
+            except Exception as ex:
+                logger.error('Error fetching %s=%s from ReqMgr2: %s', attribute, batch, ex)
+                failed.update({value: ex for value in batch})
+
+    return requests, failed
+
+def get_workflows_from_reqmgr2(workflow_names):
+    """
+    Fetch workflows from ReqMgr2 with given names
+    """
+    workflows, failed = get_requests_from_reqmgr2('name', workflow_names)
+    if failed:
+        raise Exception(f'Could not fetch workflows from ReqMgr2: {", ".join(sorted(failed))}')
+
     workflows = sort_workflows_by_name(workflows, 'RequestName')
     return workflows
 
@@ -3,8 +3,10 @@ Module containing the functions necessary to interact with the wma.
 Credit and less than optimal code has to be spreaded among lots of people.
 '''
 import os
+import sys
 import importlib
 import argparse
+import multiprocessing
 from tweak_maker_lite import TweakMakerLite
 from config_cache_lite import ConfigCacheLite
 #pylint: enable=import-error
@@ -17,7 +19,15 @@ def load_config_file(file_path):
     print('Importing the config, this may take a while...')
     config_base_name = os.path.basename(file_path).replace(".py", "")
     config_dir_name = os.path.dirname(file_path)
-    loaded_config = importlib.import_module(config_base_name, package=config_dir_name)
+    # Configs of different requests have the same names, so previously
+    # imported config must be forgotten and config directory searched first
+    sys.modules.pop(config_base_name, None)
+    sys.path.insert(0, config_dir_name)
+    try:
+        loaded_config = importlib.import_module(config_base_name)
+    finally:
+        sys.path.remove(config_dir_name)
+
     print('Imported %s' % (file_path))
     return loaded_config
 
@@ -38,25 +48,49 @@ def upload_to_couch(cfg_file_name, label, user_name, group_name, database_url):
     config_cache.set_label(label)
     config_cache.set_description(label)
     config_cache.save()
+    return config_cache.document['_id'], config_cache.document['_rev']
+
+
+def upload_in_process(arguments):
+    """
+    Upload a config file, used by worker processes
+    """
+    return upload_to_couch(*arguments)
 
-    print('DocID    %s %s' % (label, config_cache.document['_id']))
-    print('Revision %s %s' % (label, config_cache.document['_rev']))
 
-    return config_cache.document['_id']
+def upload_configs(file_names, labels, user_name, group_name, database_url, processes=4):
+    """
+    Upload config files, each in a new process, so modules imported and
+    customised by one config are not reused by another one
+    Return document ids and revisions in the order of files
+    """
+    arguments = [(file_name, label, user_name, group_name, database_url)
+                 for file_name, label in zip(file_names, labels)]
+    pool = multiprocessing.Pool(processes=max(1, min(processes, len(arguments))),
+                                maxtasksperchild=1)
+    try:
+        return pool.map(upload_in_process, arguments, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def main():
     """
-    Main function - parse arguments and upload config to couch
+    Main function - parse arguments and upload configs to couch
+    Multiple files with their labels can be given, their ids are printed in order
     """
-    parser = argparse.ArgumentParser(description='Upload config file to config database')
+    parser = argparse.ArgumentParser(description='Upload config files to config database')
     parser.add_argument('--file',
-                        dest='filename',
+                        dest='filenames',
                         type=str,
-                        help='File to be uploaded')
+                        action='append',
+                        help='File to be uploaded, can be repeated')
     parser.add_argument('--label',
+                        dest='labels',
                         type=str,
-                        help='Label, e.g. prepid')
+                        action='append',
+                        help='Label of file, e.g. prepid, one for each file')
     parser.add_argument('--user',
                         type=str,
                         help='Username')
@@ -66,10 +100,25 @@ def main():
     parser.add_argument('--db',
                         type=str,
                         help='Database url')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=4,
+                        help='Number of configs uploaded at the same time')
 
 
     args = parser.parse_args()
-    upload_to_couch(args.filename, args.label, args.user, args.group, args.db)
+    if not args.filenames or len(args.filenames) != len(args.labels or []):
+        parser.error('Each --file must have a --label')
+
+    documents = upload_configs(args.filenames,
+                               args.labels,
+                               args.user,
+                               args.group,
+                               args.db,
+                               args.processes)
+    for label, (document_id, revision) in zip(args.labels, documents):
+        print('DocID    %s %s' % (label, document_id))
+        print('Revision %s %s' % (label, revision))
 
 
 if __name__ == '__main__':
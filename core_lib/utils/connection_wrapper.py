@@ -6,19 +6,214 @@ import os
 import json
 import time
 import ssl
+import select
+from threading import Condition
 from http import client
 
 
+class PooledHTTPConnection(client.HTTPConnection):
+    """
+    HTTP connection that counts (re)connects
+    """
+
+    def connect(self):
+        ConnectionPool.count('handshakes')
+        super().connect()
+
+
+class PooledHTTPSConnection(client.HTTPSConnection):
+    """
+    HTTPS connection that counts (re)connects, i.e. TLS handshakes
+    """
+
+    def connect(self):
+        ConnectionPool.count('handshakes')
+        super().connect()
+
+
+class ConnectionPool():
+    """
+    Keep-alive pool of connections shared by all ConnectionWrappers
+    Connections are pooled per host, port and certificate pair
+    """
+
+    # Maximum number of open connections per host
+    MAX_CONNECTIONS = 8
+    # Idle connections are closed after this number of seconds
+    IDLE_TIMEOUT = 60
+    # How long to wait for a free connection before opening one over the limit
+    WAIT_TIMEOUT = 30
+    # Key -> list of (connection, time when it was returned)
+    __idle = {}
+    # Key -> number of open connections, idle and in use
+    __open = {}
+    # (cert_file, key_file) -> SSL context
+    __contexts = {}
+    __condition = Condition()
+    __counters = {'handshakes': 0,
+                  'reused': 0,
+                  'created': 0,
+                  'evicted': 0,
+                  'discarded': 0,
+                  'waited': 0,
+                  'over_limit': 0}
+
+    @staticmethod
+    def count(counter):
+        """
+        Increment a counter
+        """
+        with ConnectionPool.__condition:
+            ConnectionPool.__counters[counter] += 1
+
+    @staticmethod
+    def get_ssl_context(cert_file, key_file):
+        """
+        Return a shared SSL context with loaded certificate
+        """
+        with ConnectionPool.__condition:
+            context_key = (cert_file, key_file)
+            if context_key not in ConnectionPool.__contexts:
+                context = ssl._create_unverified_context()
+                if cert_file and key_file:
+                    context.load_cert_chain(cert_file, key_file)
+
+                ConnectionPool.__contexts[context_key] = context
+
+            return ConnectionPool.__contexts[context_key]
+
+    @staticmethod
+    def is_alive(connection):
+        """
+        Check whether idle connection was not closed by the server
+        Idle socket that is readable either has EOF or unexpected data
+        """
+        if connection.sock is None:
+            # Not connected, will connect when used
+            return True
+
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+            return not readable
+        except (OSError, ValueError):
+            return False
+
+    @staticmethod
+    def evict_idle():
+        """
+        Close connections that were idle for too long
+        Must be called with condition acquired
+        """
+        now = time.time()
+        for key, idle in ConnectionPool.__idle.items():
+            fresh = []
+            for connection, returned in idle:
+                if now - returned > ConnectionPool.IDLE_TIMEOUT:
+                    connection.close()
+                    ConnectionPool.__open[key] -= 1
+                    ConnectionPool.__counters['evicted'] += 1
+                else:
+                    fresh.append((connection, returned))
+
+            idle[:] = fresh
+
+    @staticmethod
+    def acquire(key, create):
+        """
+        Return an idle connection or create a new one with create function
+        """
+        deadline = time.time() + ConnectionPool.WAIT_TIMEOUT
+        with ConnectionPool.__condition:
+            ConnectionPool.evict_idle()
+            idle = ConnectionPool.__idle.setdefault(key, [])
+            while True:
+                while idle:
+                    connection, _ = idle.pop()
+                    if ConnectionPool.is_alive(connection):
+                        ConnectionPool.__counters['reused'] += 1
+                        return connection
+
+                    connection.close()
+                    ConnectionPool.__open[key] -= 1
+                    ConnectionPool.__counters['discarded'] += 1
+
+                if ConnectionPool.__open.get(key, 0) < ConnectionPool.MAX_CONNECTIONS:
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # Leaked connections must not block everyone forever
+                    ConnectionPool.__counters['over_limit'] += 1
+                    break
+
+                ConnectionPool.__counters['waited'] += 1
+                ConnectionPool.__condition.wait(remaining)
+
+            ConnectionPool.__open[key] = ConnectionPool.__open.get(key, 0) + 1
+            ConnectionPool.__counters['created'] += 1
+
+        return create()
+
+    @staticmethod
+    def release(key, connection, reusable=True):
+        """
+        Return a connection to the pool or close it if it is broken
+        """
+        with ConnectionPool.__condition:
+            if reusable:
+                ConnectionPool.__idle.setdefault(key, []).append((connection, time.time()))
+            else:
+                connection.close()
+                ConnectionPool.__open[key] = ConnectionPool.__open.get(key, 1) - 1
+                ConnectionPool.__counters['discarded'] += 1
+
+            ConnectionPool.__condition.notify()
+
+    @staticmethod
+    def close_all():
+        """
+        Close all idle connections
+        """
+        with ConnectionPool.__condition:
+            for key, idle in ConnectionPool.__idle.items():
+                for connection, _ in idle:
+                    connection.close()
+                    ConnectionPool.__open[key] -= 1
+
+                idle.clear()
+
+    @staticmethod
+    def get_status():
+        """
+        Return counters and number of open and idle connections of each host
+        """
+        with ConnectionPool.__condition:
+            ConnectionPool.evict_idle()
+            hosts = {}
+            for key, open_connections in ConnectionPool.__open.items():
+                host = f'{"https" if key[0] else "http"}://{key[1]}:{key[2]}'
+                host_status = hosts.setdefault(host, {'open': 0, 'idle': 0})
+                host_status['open'] += open_connections
+                host_status['idle'] += len(ConnectionPool.__idle.get(key, []))
+
+            return {'max_connections': ConnectionPool.MAX_CONNECTIONS,
+                    'idle_timeout': ConnectionPool.IDLE_TIMEOUT,
+                    'hosts': hosts,
+                    'counters': dict(ConnectionPool.__counters)}
+
+
 class ConnectionWrapper():
     """
     HTTP and HTTPS client wrapper class to re-use existing connection
+    Connections are borrowed from a shared ConnectionPool and returned on close
     Supports user certificate authentication
     """
 
     def __init__(self,
                  host,
                  cert_file=None,
-                 key_file=None):
+                 key_file=None,
+                 timeout=120):
         self.logger = logging.getLogger('logger')
         self.connection = None
         host = host.rstrip('/')
@@ -34,7 +229,8 @@ class ConnectionWrapper():
         self.cert_file = cert_file or os.getenv('USERCRT', None)
         self.key_file = key_file or os.getenv('USERKEY', None)
         self.connection_attempts = 3
-        self.timeout = 120
+        self.timeout = timeout
+        self.pool_key = (self.https, self.host_url, self.port, self.cert_file, self.key_file)
 
     def __enter__(self):
         self.logger.debug('Entering context, host: %s', self.host_url)
@@ -44,33 +240,62 @@ class ConnectionWrapper():
         self.logger.debug('Exiting context, host: %s', self.host_url)
         self.close()
 
-    def init_connection(self):
+    def create_connection(self):
         """
         Return a new HTTPConnection or HTTPSConnection
         """
         params = {'host': self.host_url,
                   'port': self.port,
                   'timeout': self.timeout}
-        if self.cert_file and self.key_file:
-            params['cert_file'] = self.cert_file
-            params['key_file'] = self.key_file
-
         if self.https:
             self.logger.info('Creating HTTPS connection for %s', self.host_url)
-            params['context'] = ssl._create_unverified_context()
-            self.connection = client.HTTPSConnection(**params)
-        else:
-            self.logger.info('Creating HTTP connection for %s', self.host_url)
-            self.connection = client.HTTPConnection(**params)
+            params['context'] = ConnectionPool.get_ssl_context(self.cert_file, self.key_file)
+            return PooledHTTPSConnection(**params)
+
+        self.logger.info('Creating HTTP connection for %s', self.host_url)
+        return PooledHTTPConnection(**params)
+
+    def init_connection(self):
+        """
+        Get a connection from the pool, broken connection is discarded
+        """
+        if self.connection:
+            ConnectionPool.release(self.pool_key, self.connection, reusable=False)
+
+        self.connection = ConnectionPool.acquire(self.pool_key, self.create_connection)
+        # Pooled connection might have been created with a different timeout
+        self.connection.timeout = self.timeout
+        if self.connection.sock:
+            self.connection.sock.settimeout(self.timeout)
 
     def close(self):
         """
-        Close connection if it exists
+        Return connection to the pool if it exists
         """
         if self.connection:
-            self.logger.debug('Closing connection for %s', self.host_url)
-            self.connection.close()
+            self.logger.debug('Releasing connection for %s', self.host_url)
+            ConnectionPool.release(self.pool_key, self.connection)
+            self.connection = None
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Make a single HTTP request without retries
+        Return response status, headers and body
+        """
+        if not self.connection:
+            self.init_connection()
+
+        try:
+            self.connection.request(method,
+                                    url.replace('#', '%23'),
+                                    body=data,
+                                    headers=headers or {})
+            response = self.connection.getresponse()
+            return response.status, response.headers, response.read()
+        except Exception:
+            ConnectionPool.release(self.pool_key, self.connection, reusable=False)
             self.connection = None
+            raise
 
     def api(self, method, url, data=None, headers=None):
         """
@@ -122,7 +347,7 @@ class ConnectionWrapper():
                                   str(ex))
                 if attempt < self.connection_attempts:
                     sleep = attempt ** 3
-                    self.logger.debug('Will sleep for %s and retry')
+                    self.logger.debug('Will sleep for %s and retry', sleep)
                     time.sleep(sleep)
 
                 self.init_connection()
@@ -0,0 +1,268 @@
+"""
+Module that contains JobQueue class
+"""
+import os
+import time
+import socket
+import logging
+from uuid import uuid4
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database.database import Database
+
+
+class JobQueue():
+    """
+    Persistent queue of jobs shared by all replicas
+    Job id is queue and task name, so adding the same job to a queue twice is
+    a no-op, while jobs of different queues may have the same name
+    A process claims a job with a lease and renews leases of its jobs with
+    heartbeats, jobs whose lease expired are claimed again, so each job is
+    executed at least once
+    Jobs that were claimed MAX_ATTEMPTS times without finishing, e.g. because
+    they crashed or hung their process, are moved to "failed" state
+    RelVals are locked only within a process, so only one replica may run,
+    this is enforced with a replica lease, see acquire_replica_lease
+    """
+
+    # Seconds after which a job of a silent replica can be claimed again
+    LEASE_TIMEOUT = 120
+    # Number of times a job is claimed before it is considered failed
+    MAX_ATTEMPTS = 3
+    # Identifier of this process
+    OWNER = f'{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}'
+
+    @staticmethod
+    def get_database():
+        """
+        Return database that stores jobs
+        """
+        return Database('jobs')
+
+    @staticmethod
+    def get_job_id(queue, name):
+        """
+        Return id of a job with given name in a queue
+        """
+        return f'{queue}:{name}'
+
+    @staticmethod
+    def acquire_replica_lease():
+        """
+        Take or renew the lease of the only replica that may run
+        Return whether this process holds the lease
+        """
+        now = time.time()
+        collection = Database('leases').collection
+        try:
+            # Upsert fails with a duplicate key if other process holds the lease
+            collection.update_one({'_id': 'replica',
+                                   '$or': [{'owner': JobQueue.OWNER},
+                                           {'lease_until': {'$lt': now}}]},
+                                  {'$set': {'owner': JobQueue.OWNER,
+                                            'lease_until': now + JobQueue.LEASE_TIMEOUT}},
+                                  upsert=True)
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    @staticmethod
+    def release_replica_lease():
+        """
+        Give up the replica lease, so next replica does not have to wait for it
+        """
+        collection = Database('leases').collection
+        collection.delete_one({'_id': 'replica', 'owner': JobQueue.OWNER})
+
+    @staticmethod
+    def add(queue, name, payload, priority, coalesce=False, max_size=None, timeout=30):
+        """
+        Add a job to a queue
+        If job already exists, it is left as it is, unless coalesce is True
+        and the job is still waiting, then it gets the new payload and the
+        higher of both priorities, failed job is replaced by the new one
+        If queue has max_size or more waiting jobs, wait up to timeout seconds
+        for a free place
+        Return "added", "coalesced" or "exists"
+        """
+        collection = JobQueue.get_database().collection
+        job_id = JobQueue.get_job_id(queue, name)
+        if max_size is not None:
+            deadline = time.time() + timeout
+            while collection.count_documents({'queue': queue, 'state': 'waiting'}) >= max_size:
+                if time.time() >= deadline:
+                    raise Exception(f'Queue "{queue}" is full, try again later')
+
+                time.sleep(1)
+
+        job = {'_id': job_id,
+               'name': name,
+               'queue': queue,
+               'payload': payload,
+               'priority': priority,
+               'state': 'waiting',
+               'owner': None,
+               'lease_until': 0,
+               'attempts': 0,
+               'added': time.time()}
+        try:
+            collection.insert_one(job)
+            return 'added'
+        except DuplicateKeyError:
+            pass
+
+        if collection.replace_one({'_id': job_id, 'state': 'failed'}, job).matched_count:
+            return 'added'
+
+        if coalesce:
+            result = collection.update_one({'_id': job_id, 'state': 'waiting'},
+                                           {'$set': {'payload': payload},
+                                            '$min': {'priority': priority}})
+            if result.matched_count:
+                return 'coalesced'
+
+        return 'exists'
+
+    @staticmethod
+    def claim(queue):
+        """
+        Atomically take the most important waiting or abandoned job of a queue
+        that was not attempted MAX_ATTEMPTS times yet
+        Return job or None if there is nothing to do
+        """
+        now = time.time()
+        collection = JobQueue.get_database().collection
+        claimed = {'$set': {'state': 'running',
+                            'owner': JobQueue.OWNER,
+                            'lease_until': now + JobQueue.LEASE_TIMEOUT,
+                            'claimed': now},
+                   '$inc': {'attempts': 1}}
+        return collection.find_one_and_update({'queue': queue,
+                                               'lease_until': {'$lt': now},
+                                               'state': {'$in': ['waiting', 'running']},
+                                               'attempts': {'$lt': JobQueue.MAX_ATTEMPTS}},
+                                              claimed,
+                                              sort=[('priority', ASCENDING),
+                                                    ('added', ASCENDING)],
+                                              return_document=ReturnDocument.AFTER)
+
+    @staticmethod
+    def heartbeat(job_ids):
+        """
+        Renew leases of jobs with given ids if they are claimed by this process
+        Return number of renewed leases
+        """
+        collection = JobQueue.get_database().collection
+        result = collection.update_many({'_id': {'$in': job_ids}, 'owner': JobQueue.OWNER},
+                                        {'$set': {'lease_until': (time.time()
+                                                                  + JobQueue.LEASE_TIMEOUT)}})
+        return result.modified_count
+
+    @staticmethod
+    def complete(job_id):
+        """
+        Remove a finished job if it is still owned by this process
+        """
+        collection = JobQueue.get_database().collection
+        collection.delete_one({'_id': job_id, 'owner': JobQueue.OWNER})
+
+    @staticmethod
+    def release(job_id):
+        """
+        Return a claimed job to the queue, e.g. when it cannot be started locally
+        Such claim is not counted as an attempt
+        """
+        collection = JobQueue.get_database().collection
+        collection.update_one({'_id': job_id, 'owner': JobQueue.OWNER},
+                              {'$set': {'state': 'waiting', 'owner': None, 'lease_until': 0},
+                               '$inc': {'attempts': -1}})
+
+    @staticmethod
+    def cancel(job_id):
+        """
+        Remove a waiting or failed job
+        Return whether job was removed
+        """
+        collection = JobQueue.get_database().collection
+        result = collection.delete_one({'_id': job_id, 'state': {'$in': ['waiting', 'failed']}})
+        return bool(result.deleted_count)
+
+    @staticmethod
+    def set_priority(job_id, priority):
+        """
+        Change priority of a waiting job
+        Return whether job was found waiting
+        """
+        collection = JobQueue.get_database().collection
+        result = collection.update_one({'_id': job_id, 'state': 'waiting'},
+                                       {'$set': {'priority': priority}})
+        return bool(result.matched_count)
+
+    @staticmethod
+    def reclaim_expired():
+        """
+        Put jobs whose lease expired back to waiting state and move ones that
+        used up their attempts to failed state
+        Return number of reclaimed jobs
+        """
+        JobQueue.fail_exhausted()
+        collection = JobQueue.get_database().collection
+        result = collection.update_many({'state': 'running', 'lease_until': {'$lt': time.time()}},
+                                        {'$set': {'state': 'waiting', 'owner': None}})
+        if result.modified_count:
+            logging.getLogger().warning('Reclaimed %s jobs with expired leases',
+                                        result.modified_count)
+
+        return result.modified_count
+
+    @staticmethod
+    def fail_exhausted():
+        """
+        Move jobs that used up their attempts and are not running to failed state
+        Return number of failed jobs
+        """
+        collection = JobQueue.get_database().collection
+        result = collection.update_many({'state': {'$in': ['waiting', 'running']},
+                                         'lease_until': {'$lt': time.time()},
+                                         'attempts': {'$gte': JobQueue.MAX_ATTEMPTS}},
+                                        {'$set': {'state': 'failed', 'owner': None}})
+        if result.modified_count:
+            logging.getLogger().error('%s jobs failed after %s attempts',
+                                      result.modified_count,
+                                      JobQueue.MAX_ATTEMPTS)
+
+        return result.modified_count
+
+    @staticmethod
+    def get_names_in_queue():
+        """
+        Return ids of waiting jobs in the order they will run
+        """
+        collection = JobQueue.get_database().collection
+        jobs = collection.find({'state': 'waiting'}, {'_id': 1})
+        jobs = jobs.sort([('priority', ASCENDING), ('added', ASCENDING)])
+        return [job['_id'] for job in jobs]
+
+    @staticmethod
+    def get_status():
+        """
+        Return number of waiting, running and failed jobs in each queue
+        and ids of failed jobs
+        """
+        collection = JobQueue.get_database().collection
+        status = {}
+        for row in collection.aggregate([{'$group': {'_id': {'queue': '$queue',
+                                                             'state': '$state'},
+                                                     'count': {'$sum': 1}}}]):
+            queue_status = status.setdefault(row['_id']['queue'], {'waiting': 0,
+                                                                   'running': 0,
+                                                                   'failed': 0})
+            queue_status[row['_id']['state']] = row['count']
+
+        failed = [job['_id'] for job in collection.find({'state': 'failed'}, {'_id': 1})]
+        return {'owner': JobQueue.OWNER,
+                'lease_timeout': JobQueue.LEASE_TIMEOUT,
+                'max_attempts': JobQueue.MAX_ATTEMPTS,
+                'queues': status,
+                'failed': failed}
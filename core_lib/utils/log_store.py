@@ -0,0 +1,70 @@
+"""
+Module that contains LogStore class
+"""
+import os
+import time
+import zlib
+import logging
+from database.database import Database
+
+
+class LogStore():
+    """
+    Compressed logs of remote commands kept in the database, so every replica
+    can read them
+    Logs older than retention time are removed when new logs are saved
+    """
+
+    # Seconds to keep logs for
+    RETENTION = 30 * 24 * 3600
+    # Logs are cut to this number of compressed bytes to fit in a document
+    MAX_SIZE = 8 * 1024 * 1024
+
+    @staticmethod
+    def get_database():
+        """
+        Return database that stores logs
+        """
+        return Database('logs')
+
+    @staticmethod
+    def save_file(log_id, file_path):
+        """
+        Store gzip compressed log file and remove expired logs
+        Beginning of too big logs is kept, end of the output is usually
+        stored next to the results
+        """
+        with open(file_path, 'rb') as log_file:
+            log = log_file.read(LogStore.MAX_SIZE + 1)
+
+        truncated = len(log) > LogStore.MAX_SIZE
+        if truncated:
+            logging.getLogger().warning('Log %s is over %s bytes, it is cut',
+                                        log_id,
+                                        LogStore.MAX_SIZE)
+            log = log[:LogStore.MAX_SIZE]
+
+        database = LogStore.get_database()
+        database.save({'_id': log_id,
+                       'log': log,
+                       'size': os.path.getsize(file_path),
+                       'truncated': truncated,
+                       'created': time.time()})
+        database.collection.delete_many({'created': {'$lt': time.time() - LogStore.RETENTION}})
+
+    @staticmethod
+    def get(log_id):
+        """
+        Return text of a log or None if it does not exist or expired
+        """
+        document = LogStore.get_database().get(log_id)
+        if not document:
+            return None
+
+        # Cut logs are not complete gzip streams, so decompress what is there
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        text = decompressor.decompress(document['log']).decode('utf-8', errors='replace')
+        if document.get('truncated'):
+            text += '\n... log is cut ...\n'
+
+        return text
@@ -0,0 +1,200 @@
+"""
+Module that contains ScramArchIndex class
+"""
+import time
+import logging
+import xml.etree.ElementTree as XMLet
+from threading import Lock, Thread
+from database.database import Database
+from .connection_wrapper import ConnectionWrapper
+
+
+class ScramArchIndex():
+    """
+    Index of CMSSW releases and their scram architectures from
+    https://cmssdt.cern.ch/SDT/cgi-bin/ReleasesXML?anytype=1
+    Index is kept in memory and in the database, so all processes share it
+    and it survives restarts
+    Stale index is refreshed in the background with a conditional request,
+    if cmssdt is not reachable, stale index is used
+    """
+
+    HOST = 'https://cmssdt.cern.ch'
+    URL = '/SDT/cgi-bin/ReleasesXML?anytype=1'
+    # Index older than this is refreshed in the background
+    MAX_AGE = 3600
+    # Unknown release triggers a refresh, but not more often than this
+    MIN_REFRESH_INTERVAL = 300
+    DOCUMENT_ID = 'scram_arch_index'
+    __index = {'releases': {}, 'etag': None, 'last_modified': None, 'refreshed': 0}
+    __loaded = False
+    __last_attempt = 0
+    __lock = Lock()
+    # Held while index is being refreshed
+    __refresh_lock = Lock()
+    __refreshing = False
+
+    @staticmethod
+    def get_database():
+        """
+        Return database that stores the index
+        """
+        return Database('caches')
+
+    @staticmethod
+    def load():
+        """
+        Load index from the database if it is newer than the one in memory
+        """
+        try:
+            document = ScramArchIndex.get_database().get(ScramArchIndex.DOCUMENT_ID)
+        except Exception as ex:  # pylint: disable=broad-except
+            logging.getLogger().error('Could not load scram arch index: %s', ex)
+            document = None
+
+        if document and document.get('refreshed', 0) >= ScramArchIndex.__index['refreshed']:
+            # Releases are stored as pairs, they are not valid attribute names
+            ScramArchIndex.__index = {'releases': dict(document['releases']),
+                                      'etag': document.get('etag'),
+                                      'last_modified': document.get('last_modified'),
+                                      'refreshed': document['refreshed']}
+
+        ScramArchIndex.__loaded = True
+
+    @staticmethod
+    def fetch(etag=None, last_modified=None):
+        """
+        Fetch and parse releases XML from cmssdt
+        Return dictionary of releases and architectures, ETag and Last-Modified
+        or None if index did not change
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        with ConnectionWrapper(host=ScramArchIndex.HOST, timeout=60) as connection:
+            status, response_headers, response = connection.request('GET',
+                                                                     ScramArchIndex.URL,
+                                                                     headers=headers)
+
+        if status == 304:
+            return None
+
+        if status != 200:
+            raise Exception(f'cmssdt responded with status {status}')
+
+        root = XMLet.fromstring(response)
+        releases = {}
+        for architecture in root:
+            if architecture.tag != 'architecture':
+                # This should never happen as children should be <architecture>
+                continue
+
+            scram_arch = architecture.attrib.get('name')
+            for release in architecture:
+                releases[release.attrib.get('label')] = scram_arch
+
+        return {'releases': releases,
+                'etag': response_headers.get('ETag'),
+                'last_modified': response_headers.get('Last-Modified')}
+
+    @staticmethod
+    def refresh():
+        """
+        Refresh index if it is stale, errors are logged and stale index is kept
+        Concurrent refreshes wait for each other
+        """
+        logger = logging.getLogger()
+        with ScramArchIndex.__refresh_lock:
+            ScramArchIndex.__last_attempt = time.time()
+            try:
+                # Maybe other process or thread refreshed it already
+                ScramArchIndex.load()
+                index = ScramArchIndex.__index
+                recently = time.time() - index['refreshed'] < ScramArchIndex.MIN_REFRESH_INTERVAL
+                if recently and index['releases']:
+                    return
+
+                fetched = ScramArchIndex.fetch(index['etag'], index['last_modified'])
+                if fetched is None:
+                    logger.info('Scram arch index did not change')
+                    index = dict(index)
+                else:
+                    logger.info('Fetched scram arch index with %s releases',
+                                len(fetched['releases']))
+                    index = fetched
+
+                index['refreshed'] = time.time()
+                ScramArchIndex.__index = index
+                ScramArchIndex.get_database().save({'_id': ScramArchIndex.DOCUMENT_ID,
+                                                    'releases': sorted(index['releases'].items()),
+                                                    'etag': index['etag'],
+                                                    'last_modified': index['last_modified'],
+                                                    'refreshed': index['refreshed']})
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.error('Could not refresh scram arch index, using stale one: %s', ex)
+
+    @staticmethod
+    def refresh_in_background():
+        """
+        Start a background refresh if one is not running
+        """
+        with ScramArchIndex.__lock:
+            if ScramArchIndex.__refreshing:
+                return
+
+            ScramArchIndex.__refreshing = True
+
+        def run():
+            try:
+                ScramArchIndex.refresh()
+            finally:
+                ScramArchIndex.__refreshing = False
+
+        Thread(target=run, name='scram-arch-index', daemon=True).start()
+
+    @staticmethod
+    def warm_up():
+        """
+        Load index at startup and refresh it in the background if it is stale
+        """
+        with ScramArchIndex.__lock:
+            ScramArchIndex.load()
+
+        if time.time() - ScramArchIndex.__index['refreshed'] > ScramArchIndex.MAX_AGE:
+            ScramArchIndex.refresh_in_background()
+
+    @staticmethod
+    def get(cmssw_release):
+        """
+        Return scram arch of CMSSW release or None if it is not known
+        """
+        if not ScramArchIndex.__loaded:
+            with ScramArchIndex.__lock:
+                if not ScramArchIndex.__loaded:
+                    ScramArchIndex.load()
+
+        index = ScramArchIndex.__index
+        scram_arch = index['releases'].get(cmssw_release)
+        if scram_arch is None and not index['releases']:
+            # Index is empty, e.g. fresh deployment or failed fetch,
+            # wait for a running refresh or refresh now
+            ScramArchIndex.refresh()
+            return ScramArchIndex.__index['releases'].get(cmssw_release)
+
+        if scram_arch is None:
+            # Release might be new, refresh now if it was not tried recently
+            with ScramArchIndex.__lock:
+                last_attempt = time.time() - ScramArchIndex.__last_attempt
+                if last_attempt > ScramArchIndex.MIN_REFRESH_INTERVAL:
+                    ScramArchIndex.refresh()
+
+            return ScramArchIndex.__index['releases'].get(cmssw_release)
+
+        if time.time() - index['refreshed'] > ScramArchIndex.MAX_AGE:
+            ScramArchIndex.refresh_in_background()
+
+        return scram_arch
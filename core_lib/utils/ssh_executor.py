@@ -1,19 +1,328 @@
 """
 Module that handles all SSH operations - both ssh and ftp
 """
+import os
+import gzip
 import json
 import time
+import codecs
+import select
+import tarfile
 import logging
 from io import BytesIO
+from collections import deque
+from threading import Condition
 import paramiko
 
 
+class SSHSessionPool():
+    """
+    Pool of authenticated SSH connections shared by all SSHExecutors
+    Connections are pooled per host and credentials file
+    Each connection is leased to several executors at once, they open their
+    own exec and SFTP channels over the same transport
+    """
+
+    # Maximum number of connections per host
+    MAX_CONNECTIONS = 4
+    # Maximum number of executors that use one connection at the same time
+    MAX_SESSIONS = 4
+    # Unused connections are closed after this number of seconds
+    IDLE_TIMEOUT = 300
+    # Connections older than this are not leased anymore, so load balancer
+    # can move new work to other nodes
+    MAX_AGE = 3600
+    # Interval of SSH keepalive messages
+    KEEPALIVE_INTERVAL = 30
+    # How long to wait for a free session before opening a connection over the limit
+    WAIT_TIMEOUT = 60
+    # Key -> list of connection dictionaries
+    __connections = {}
+    # Key -> number of connections that are being opened
+    __opening = {}
+    # Credentials file path -> (modification time, credentials)
+    __credentials = {}
+    __condition = Condition()
+    __counters = {'logins': 0,
+                  'reused': 0,
+                  'retired': 0,
+                  'evicted': 0,
+                  'failed_logins': 0,
+                  'waited': 0,
+                  'over_limit': 0}
+
+    @staticmethod
+    def load_credentials(credentials_path):
+        """
+        Return credentials from a JSON file, file is read again only if it changed
+        """
+        modified = os.path.getmtime(credentials_path)
+        with SSHSessionPool.__condition:
+            cached = SSHSessionPool.__credentials.get(credentials_path)
+            if cached and cached[0] == modified:
+                return cached[1]
+
+        with open(credentials_path) as json_file:
+            credentials = json.load(json_file)
+
+        with SSHSessionPool.__condition:
+            SSHSessionPool.__credentials[credentials_path] = (modified, credentials)
+
+        return credentials
+
+    @staticmethod
+    def login(host, credentials_path):
+        """
+        Open a new SSH connection
+        """
+        logger = logging.getLogger()
+        credentials = SSHSessionPool.load_credentials(credentials_path)
+        logger.info('Logging in to %s as %s', host, credentials['username'])
+        start_time = time.time()
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(host,
+                           username=credentials['username'],
+                           password=credentials['password'],
+                           timeout=30)
+        ssh_client.get_transport().set_keepalive(SSHSessionPool.KEEPALIVE_INTERVAL)
+        logger.info('Logged in to %s in %.2fs', host, time.time() - start_time)
+        return ssh_client
+
+    @staticmethod
+    def is_alive(connection):
+        """
+        Check whether connection's transport is still usable
+        """
+        transport = connection['client'].get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        try:
+            transport.send_ignore()
+        except (OSError, EOFError, paramiko.SSHException):
+            return False
+
+        return True
+
+    @staticmethod
+    def close_unused(key):
+        """
+        Close retired, idle and broken connections that are not leased
+        Must be called with condition acquired
+        """
+        now = time.time()
+        kept = []
+        for connection in SSHSessionPool.__connections.get(key, []):
+            if connection['sessions']:
+                kept.append(connection)
+                continue
+
+            if not connection['retired'] and now - connection['created'] > SSHSessionPool.MAX_AGE:
+                connection['retired'] = True
+                SSHSessionPool.__counters['retired'] += 1
+
+            if connection['retired']:
+                connection['client'].close()
+            elif now - connection['last_used'] > SSHSessionPool.IDLE_TIMEOUT:
+                connection['client'].close()
+                SSHSessionPool.__counters['evicted'] += 1
+            else:
+                kept.append(connection)
+
+        SSHSessionPool.__connections[key] = kept
+
+    @staticmethod
+    def lease(key):
+        """
+        Return least used healthy connection that has a free session or None
+        Must be called with condition acquired
+        """
+        now = time.time()
+        candidates = [c for c in SSHSessionPool.__connections.get(key, [])
+                      if not c['retired'] and c['sessions'] < SSHSessionPool.MAX_SESSIONS]
+        for connection in sorted(candidates, key=lambda c: c['sessions']):
+            if now - connection['created'] > SSHSessionPool.MAX_AGE:
+                connection['retired'] = True
+                SSHSessionPool.__counters['retired'] += 1
+                continue
+
+            if not SSHSessionPool.is_alive(connection):
+                connection['retired'] = True
+                SSHSessionPool.__counters['retired'] += 1
+                continue
+
+            connection['sessions'] += 1
+            connection['last_used'] = now
+            SSHSessionPool.__counters['reused'] += 1
+            return connection
+
+        return None
+
+    @staticmethod
+    def acquire(host, credentials_path):
+        """
+        Lease a session of a pooled connection or log in if there is none
+        """
+        key = (host, credentials_path)
+        deadline = time.time() + SSHSessionPool.WAIT_TIMEOUT
+        with SSHSessionPool.__condition:
+            while True:
+                SSHSessionPool.close_unused(key)
+                connection = SSHSessionPool.lease(key)
+                if connection:
+                    return connection
+
+                opened = (len(SSHSessionPool.__connections[key])
+                          + SSHSessionPool.__opening.get(key, 0))
+                if opened < SSHSessionPool.MAX_CONNECTIONS:
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # Leaked sessions must not block everyone forever
+                    SSHSessionPool.__counters['over_limit'] += 1
+                    break
+
+                SSHSessionPool.__counters['waited'] += 1
+                SSHSessionPool.__condition.wait(remaining)
+
+            SSHSessionPool.__opening[key] = SSHSessionPool.__opening.get(key, 0) + 1
+
+        # Log in without holding the condition, it takes a while
+        try:
+            ssh_client = SSHSessionPool.login(host, credentials_path)
+        except Exception:
+            with SSHSessionPool.__condition:
+                SSHSessionPool.__opening[key] -= 1
+                SSHSessionPool.__counters['failed_logins'] += 1
+                SSHSessionPool.__condition.notify()
+
+            raise
+
+        now = time.time()
+        connection = {'client': ssh_client,
+                      'sessions': 1,
+                      'created': now,
+                      'last_used': now,
+                      'retired': False}
+        with SSHSessionPool.__condition:
+            SSHSessionPool.__opening[key] -= 1
+            SSHSessionPool.__connections.setdefault(key, []).append(connection)
+            SSHSessionPool.__counters['logins'] += 1
+
+        return connection
+
+    @staticmethod
+    def release(host, credentials_path, connection, retire=False):
+        """
+        Return a session to the pool
+        Retired connection is not leased again and is closed when all its
+        sessions are returned
+        """
+        key = (host, credentials_path)
+        with SSHSessionPool.__condition:
+            connection['sessions'] -= 1
+            connection['last_used'] = time.time()
+            if retire and not connection['retired']:
+                connection['retired'] = True
+                SSHSessionPool.__counters['retired'] += 1
+
+            SSHSessionPool.close_unused(key)
+            SSHSessionPool.__condition.notify_all()
+
+    @staticmethod
+    def close_all():
+        """
+        Close all connections that are not leased and retire the rest
+        """
+        with SSHSessionPool.__condition:
+            for key, connections in SSHSessionPool.__connections.items():
+                for connection in connections:
+                    connection['retired'] = True
+
+                SSHSessionPool.close_unused(key)
+
+    @staticmethod
+    def get_status():
+        """
+        Return counters and number of connections and sessions of each host
+        """
+        with SSHSessionPool.__condition:
+            hosts = {}
+            for key in list(SSHSessionPool.__connections):
+                SSHSessionPool.close_unused(key)
+                connections = SSHSessionPool.__connections[key]
+                hosts[key[0]] = {'connections': len(connections),
+                                 'sessions': sum(c['sessions'] for c in connections),
+                                 'retired': sum(1 for c in connections if c['retired'])}
+
+            return {'max_connections': SSHSessionPool.MAX_CONNECTIONS,
+                    'max_sessions': SSHSessionPool.MAX_SESSIONS,
+                    'idle_timeout': SSHSessionPool.IDLE_TIMEOUT,
+                    'hosts': hosts,
+                    'counters': dict(SSHSessionPool.__counters)}
+
+
+class OutputBuffer():
+    """
+    Buffer that splits a stream of bytes to lines and keeps only the last
+    max_lines of them, lines longer than max_line_length are split
+    """
+
+    def __init__(self, max_lines=None, max_line_length=4096):
+        self.lines = deque(maxlen=max_lines)
+        self.max_line_length = max_line_length
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ''
+        self.total_lines = 0
+
+    def split(self, text):
+        """
+        Split text to complete lines and keep the unfinished one
+        """
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        length = self.max_line_length
+        # Long lines are split to keep memory bounded
+        lines = [line[i:i + length] for line in lines for i in range(0, max(len(line), 1), length)]
+        while len(self.partial) > length:
+            lines.append(self.partial[:length])
+            self.partial = self.partial[length:]
+
+        lines = [line.rstrip('\r') for line in lines]
+        self.lines.extend(lines)
+        self.total_lines += len(lines)
+        return lines
+
+    def feed(self, data):
+        """
+        Add received bytes, return list of lines that were completed
+        """
+        return self.split(self.decoder.decode(data))
+
+    def finish(self):
+        """
+        Complete the last line, return list with it or an empty list
+        """
+        lines = self.split(self.decoder.decode(b'', final=True) + '\n')
+        return [line for line in lines if line]
+
+    def get_text(self):
+        """
+        Return kept lines as a single string
+        """
+        return '\n'.join(self.lines).strip()
+
+
 class SSHExecutor():
     """
     SSH executor allows to perform remote commands and upload/download files
+    SSH connection is leased from a shared SSHSessionPool and returned on close
     """
 
     def __init__(self, host, credentials_path):
+        self.connection = None
         self.ssh_client = None
         self.ftp_client = None
         self.logger = logging.getLogger()
@@ -21,6 +330,8 @@ class SSHExecutor():
         self.credentials_file_path = credentials_path
         self.timeout = 3600
         self.max_retries = 3
+        # Number of last lines of each stream that execute_command returns
+        self.max_output_lines = 10000
 
     def __enter__(self):
         return self
@@ -31,22 +342,14 @@ class SSHExecutor():
 
     def setup_ssh(self):
         """
-        Initiate SSH connection and save it as self.ssh_client
+        Lease a pooled SSH connection and save it as self.ssh_client
         """
         self.logger.debug('Will set up ssh')
         if self.ssh_client:
             self.close_connections()
 
-        with open(self.credentials_file_path) as json_file:
-            credentials = json.load(json_file)
-
-        self.logger.info('Credentials loaded successfully: %s', credentials['username'])
-        self.ssh_client = paramiko.SSHClient()
-        self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_client.connect(self.remote_host,
-                                username=credentials["username"],
-                                password=credentials["password"],
-                                timeout=30)
+        self.connection = SSHSessionPool.acquire(self.remote_host, self.credentials_file_path)
+        self.ssh_client = self.connection['client']
         self.logger.debug('Done setting up ssh')
 
     def setup_ftp(self):
@@ -75,27 +378,27 @@ class SSHExecutor():
         self.logger.debug('Executing %s', command)
         retries = 0
         while retries <= self.max_retries:
-            if not self.ssh_client:
-                self.setup_ssh()
-
-            (_, stdout, stderr) = self.ssh_client.exec_command(command, timeout=self.timeout)
-            self.logger.debug('Executed %s. Reading response', command)
-            stdout_list = []
-            stderr_list = []
-            for line in stdout.readlines():
-                stdout_list.append(line[0:256])
-
-            for line in stderr.readlines():
-                stderr_list.append(line[0:256])
-
-            exit_code = stdout.channel.recv_exit_status()
-            stdout = ''.join(stdout_list).strip()
-            stderr = ''.join(stderr_list).strip()
+            try:
+                stdout, stderr, exit_code = self.stream_command(command,
+                                                                max_lines=self.max_output_lines)
+            except paramiko.SSHException as ex:
+                # Pooled connection might have been closed by the server
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+
+                self.logger.warning('Could not open SSH channel: %s, will do a retry number %s',
+                                    ex,
+                                    retries)
+                self.close_connections(retire=True)
+                continue
+
             # Retry if AFS error occured
             if '.bashrc: Permission denied' in stderr:
                 retries += 1
                 self.logger.warning('SSH execution failed, will do a retry number %s', retries)
-                self.close_connections()
+                # Log in again, possibly to a different node
+                self.close_connections(retire=True)
                 time.sleep(3)
             else:
                 break
@@ -115,6 +418,65 @@ class SSHExecutor():
 
         return stdout, stderr, exit_code
 
+    def stream_command(self, command, on_line=None, log_file=None, max_lines=1000):
+        """
+        Execute command over SSH and read stdout and stderr at the same time
+        Only the last max_lines lines of each stream are kept in memory
+        on_line is called with stream name, "stdout" or "stderr", and a line
+        as soon as the line is received
+        If log_file is given, all lines of both streams are written to it,
+        gzip compressed
+        Return stdout, stderr and exit code
+        """
+        if isinstance(command, list):
+            command = '; '.join(command)
+
+        if not self.ssh_client:
+            self.setup_ssh()
+
+        channel = self.ssh_client.get_transport().open_session(timeout=30)
+        buffers = {'stdout': OutputBuffer(max_lines), 'stderr': OutputBuffer(max_lines)}
+        log = None
+        try:
+            if log_file:
+                os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+                log = gzip.open(log_file, 'wt')
+
+            def handle_lines(stream, lines):
+                for line in lines:
+                    if log:
+                        log.write(f'{line}\n')
+
+                    if on_line:
+                        on_line(stream, line)
+
+            deadline = time.time() + self.timeout
+            channel.exec_command(command)
+            while True:
+                if channel.recv_ready():
+                    handle_lines('stdout', buffers['stdout'].feed(channel.recv(32768)))
+                elif channel.recv_stderr_ready():
+                    handle_lines('stderr', buffers['stderr'].feed(channel.recv_stderr(32768)))
+                elif channel.eof_received or channel.closed:
+                    # EOF comes after all output
+                    break
+                elif time.time() > deadline:
+                    raise Exception(f'Command did not finish in {self.timeout}s')
+                else:
+                    # Channel's file descriptor is readable when any stream has data
+                    select.select([channel], [], [], 1)
+
+            for stream, output_buffer in buffers.items():
+                handle_lines(stream, output_buffer.finish())
+
+            exit_code = channel.recv_exit_status()
+        finally:
+            channel.close()
+            if log:
+                log.close()
+
+        return buffers['stdout'].get_text(), buffers['stderr'].get_text(), exit_code
+
     def upload_as_file(self, content, copy_to):
         """
         Upload given string as file
@@ -132,6 +494,41 @@ class SSHExecutor():
 
         return True
 
+    def upload_archive(self, files, copy_to):
+        """
+        Pack files to a gzip compressed tarball in memory and upload it
+        Files is a dictionary of file names and their contents, all files
+        are executable
+        """
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, content in files.items():
+                if isinstance(content, str):
+                    content = content.encode()
+
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mode = 0o755
+                info.mtime = int(time.time())
+                tar.addfile(info, BytesIO(content))
+
+        self.logger.debug('Will upload %s files in %s bytes as %s',
+                          len(files),
+                          archive.tell(),
+                          copy_to)
+        if not self.ftp_client:
+            self.setup_ftp()
+
+        try:
+            archive.seek(0)
+            self.ftp_client.putfo(archive, copy_to)
+            self.logger.debug('Uploaded archive to %s', copy_to)
+        except Exception as ex:
+            self.logger.error('Error uploading archive to %s. %s', copy_to, ex)
+            return False
+
+        return True
+
     def upload_file(self, copy_from, copy_to):
         """
         Upload a file
@@ -188,9 +585,10 @@ class SSHExecutor():
 
         return True
 
-    def close_connections(self):
+    def close_connections(self, retire=False):
         """
-        Close any active connections
+        Close SFTP channel and return SSH connection to the pool
+        If retire is True, connection is not reused anymore
         """
         if self.ftp_client:
             self.logger.debug('Closing ftp client')
@@ -199,22 +597,11 @@ class SSHExecutor():
             self.logger.debug('Closed ftp client')
 
         if self.ssh_client:
-            self.logger.debug('Closing ssh client')
-            self.ssh_client.close()
+            self.logger.debug('Returning ssh client')
+            SSHSessionPool.release(self.remote_host,
+                                   self.credentials_file_path,
+                                   self.connection,
+                                   retire)
+            self.connection = None
             self.ssh_client = None
-            self.logger.debug('Closed ssh client')
-
-    def execute_command_new(self, command):
-        """Executing provided command: Combines stdout and stderr into 'stdout'.
-        Returns stdout file object to be read continously until end of execution.
-        """
-        if isinstance(command, list):
-            command = '; '.join(command)
-        if not self.ssh_client:
-            self.setup_ssh()
-        tran = self.ssh_client.get_transport()
-        chan = tran.open_session()
-        chan.get_pty()
-        stdout = chan.makefile()
-        chan.exec_command(command)
-        return stdout
+            self.logger.debug('Returned ssh client')
@@ -1,107 +1,419 @@
 """
 Module that has all classes used for request submission to computing
 """
+import atexit
 import logging
 import time
+import heapq
 import traceback
 import json
-from threading import Thread
-from queue import Queue, Empty
+from abc import ABC, abstractmethod
+from itertools import count
+from collections import deque
+from threading import Thread, Condition, Event
+from core_lib.utils.global_config import Config
+from core_lib.utils.job_queue import JobQueue
 
 
-class Worker(Thread):
+class Histogram():
+    """
+    Histogram of durations in seconds with fixed buckets
+    Each bucket counts values that are less or equal to its upper bound
+    """
+
+    BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram
+        """
+        for index, bucket in enumerate(self.BUCKETS):
+            if value <= bucket:
+                break
+        else:
+            index = len(self.BUCKETS)
+
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+
+    def get_status(self):
+        """
+        Return counts of values in buckets, their total number and sum
+        """
+        buckets = {str(bucket): value for bucket, value in zip(self.BUCKETS, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'buckets': buckets,
+                'count': self.total,
+                'sum': round(self.sum, 3)}
+
+
+class Task():
     """
-    A single worker thread that loops and submits requests from the queue
+    A single task waiting in a queue or running in a worker
     """
 
-    def __init__(self, name, worker_pool):
-        Thread.__init__(self)
+    def __init__(self, name, function, args, kwargs, queue, priority, hosts):
         self.name = name
-        self.worker_pool = worker_pool
-        self.queue = self.worker_pool.task_queue
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.queue = queue
+        self.priority = priority
+        self.hosts = tuple(hosts)
+        self.added = time.time()
+        self.started = None
+        # waiting, running, done or cancelled
+        self.state = None
+        self.worker = None
+        # Order of tasks with the same priority
+        self.sequence = None
+        # Current entry in the queue's heap, older entries are skipped
+        self.entry = None
+
+    def __repr__(self):
+        return f'Task({self.name}, queue={self.queue}, priority={self.priority})'
+
+
+class Worker(Thread):
+    """
+    A single worker thread that loops and runs tasks picked by the scheduler
+    """
+
+    def __init__(self, name, scheduler):
+        Thread.__init__(self, name=name, daemon=True)
+        self.scheduler = scheduler
         self.logger = logging.getLogger()
         self.logger.debug('Worker "%s" is being created', self.name)
-        self.job_name = None
-        self.job_start_time = None
-        self.running = True
+        self.task = None
         self.start()
 
     def run(self):
         self.logger.debug('Worker "%s" is starting', self.name)
-        while self.running:
+        while True:
+            task = self.scheduler.next_task(self)
+            self.logger.debug('Worker "%s" got a task "%s" from "%s" queue',
+                              self.name,
+                              task.name,
+                              task.queue)
+            failed = False
             try:
-                job_name, function, args, kwargs = self.queue.get(timeout=1)
-                self.job_name = job_name
-                self.job_start_time = time.time()
-                self.logger.debug('Worker "%s" got a task "%s". Queue size %s',
+                task.function(*task.args, **task.kwargs)
+            except Exception as ex:
+                failed = True
+                self.logger.error('Exception in "%s" during task "%s"',
                                   self.name,
-                                  job_name,
-                                  self.queue.qsize())
-                try:
-                    function(*args, **kwargs)
-                except Exception as ex:
-                    self.logger.error('Exception in "%s" during task "%s"',
-                                      self.name,
-                                      job_name)
-                    self.logger.error(traceback.format_exc())
-                    self.logger.error(ex)
-                finally:
-                    self.logger.debug('Worker "%s" has finished a task "%s". Queue size %s',
-                                      self.name,
-                                      job_name,
-                                      self.queue.qsize())
-                    self.job_name = None
-                    self.job_start_time = 0
-            except Empty:
-                # If there is nothing in the queue, stop running
-                self.running = False
-                # Stop existing
-                self.worker_pool.remove_worker(self)
-
-    def join(self, timeout=None):
-        self.running = False
-        self.logger.debug('Joining the "%s" worker', self.name)
-        Thread.join(self, timeout)
-
-
-class WorkerPool:
+                                  task.name)
+                self.logger.error(traceback.format_exc())
+                self.logger.error(ex)
+            finally:
+                self.logger.debug('Worker "%s" has finished a task "%s"', self.name, task.name)
+                self.scheduler.task_done(self, task, failed)
+
+
+class TaskScheduler():
     """
-    Pool that contains all worker threads
+    Scheduler with named queues and a persistent pool of worker threads
+    Tasks with higher priority (lower number) run first, tasks of the same
+    priority run in the order they were added
+    Each queue limits number of its running and waiting tasks and each host
+    limits number of running tasks that use it, e.g. concurrent lxplus sessions
+    Task names are unique, all waiting and running tasks are in a registry,
+    so they can be found, cancelled or reprioritized by name
+    Cancelled and reprioritized tasks leave stale entries in queue heaps,
+    they are dropped when they get to the top
     """
 
-    def __init__(self, max_workers, task_queue):
+    HIGH = 0
+    NORMAL = 10
+    LOW = 20
+    # Seconds of finished tasks that are used to compute throughput
+    THROUGHPUT_WINDOW = 600
+
+    def __init__(self, max_workers=15):
         self.logger = logging.getLogger()
-        self.workers = []
+        self.condition = Condition()
         self.max_workers = max_workers
-        self.task_queue = task_queue
-        self.worker_counter = 0
+        self.workers = []
+        # Queue name -> queue dictionary
+        self.queues = {}
+        # Host name -> maximum number of tasks using it
+        self.host_limits = {}
+        # Host name -> number of running tasks using it
+        self.host_usage = {}
+        # Task name -> waiting or running task
+        self.tasks = {}
+        self.sequence = count()
+
+    def configure(self, max_workers=None, host_limits=None):
+        """
+        Set number of worker threads and limits of hosts
+        Workers are never stopped, so number of workers can only grow
+        """
+        with self.condition:
+            if max_workers:
+                self.max_workers = max(max_workers, len(self.workers))
+
+            if host_limits:
+                self.host_limits.update(host_limits)
+
+            self.condition.notify_all()
+
+    def add_queue(self, name, max_workers, max_size):
+        """
+        Create a queue or update its limits
+        """
+        with self.condition:
+            if name not in self.queues:
+                self.queues[name] = {'pending': [],
+                                     'waiting': 0,
+                                     'running': 0,
+                                     'done': 0,
+                                     'failed': 0,
+                                     'cancelled': 0,
+                                     'wait_time': Histogram(),
+                                     'run_time': Histogram(),
+                                     'finished': deque()}
+
+            self.queues[name]['max_workers'] = max_workers
+            self.queues[name]['max_size'] = max_size
+
+    def hosts_available(self, hosts):
+        """
+        Return whether all hosts are below their limits
+        Must be called with condition acquired
+        """
+        for host in hosts:
+            limit = self.host_limits.get(host)
+            if limit is not None and self.host_usage.get(host, 0) >= limit:
+                return False
+
+        return True
+
+    def describe(self, task):
+        """
+        Return description of where the task is
+        """
+        if task.state == 'running':
+            return f'being worked on by "{task.worker}"'
+
+        return f'waiting in "{task.queue}" queue'
+
+    def push(self, task, priority):
+        """
+        Add a new heap entry of a waiting task with given priority
+        Must be called with condition acquired
+        """
+        task.priority = priority
+        task.entry = (priority, task.sequence, task)
+        heapq.heappush(self.queues[task.queue]['pending'], task.entry)
+
+    def peek(self, queue):
+        """
+        Return the first waiting task of a queue or None
+        Must be called with condition acquired
+        """
+        pending = queue['pending']
+        while pending:
+            task = pending[0][2]
+            if task.state == 'waiting' and task.entry is pending[0]:
+                return task
+
+            heapq.heappop(pending)
+
+        return None
+
+    def add_task(self, task, timeout=30, coalesce=False):
+        """
+        Add a task to its queue
+        If a task with the same name is waiting and coalesce is True, waiting
+        task gets arguments of the new one and the higher of both priorities
+        If queue is full, wait up to timeout seconds for a free place
+        Return "added" or "coalesced"
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            queue = self.queues[task.queue]
+            while True:
+                existing = self.tasks.get(task.name)
+                if existing:
+                    if (coalesce
+                            and existing.state == 'waiting'
+                            and existing.queue == task.queue):
+                        existing.function = task.function
+                        existing.args = task.args
+                        existing.kwargs = task.kwargs
+                        if task.priority < existing.priority:
+                            self.push(existing, task.priority)
+
+                        self.logger.info('Task "%s" coalesced with a waiting one', task.name)
+                        return 'coalesced'
+
+                    raise Exception(f'Task "{task.name}" is already {self.describe(existing)}')
+
+                if queue['waiting'] < queue['max_size']:
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Exception(f'Queue "{task.queue}" is full, try again later')
+
+                self.condition.wait(remaining)
+
+            self.logger.info('Adding a task "%s" to "%s" queue. Queue size %s',
+                             task.name,
+                             task.queue,
+                             queue['waiting'])
+            task.state = 'waiting'
+            task.sequence = next(self.sequence)
+            self.tasks[task.name] = task
+            queue['waiting'] += 1
+            self.push(task, task.priority)
+            if len(self.workers) < self.max_workers:
+                self.workers.append(Worker(f'worker-{len(self.workers)}', self))
+
+            self.condition.notify_all()
+            return 'added'
+
+    def cancel_task(self, name):
+        """
+        Remove a waiting task
+        Return whether task was cancelled, running tasks cannot be cancelled
+        """
+        with self.condition:
+            task = self.tasks.get(name)
+            if not task:
+                return False
+
+            if task.state != 'waiting':
+                raise Exception(f'Task "{name}" is {self.describe(task)}, it cannot be cancelled')
+
+            task.state = 'cancelled'
+            del self.tasks[name]
+            queue = self.queues[task.queue]
+            queue['waiting'] -= 1
+            queue['cancelled'] += 1
+            self.logger.info('Task "%s" was cancelled', name)
+            # Place in queue became free
+            self.condition.notify_all()
+            return True
+
+    def set_priority(self, name, priority):
+        """
+        Change priority of a waiting task
+        Return whether task was found waiting
+        """
+        with self.condition:
+            task = self.tasks.get(name)
+            if not task or task.state != 'waiting':
+                return False
+
+            self.push(task, priority)
+            self.condition.notify_all()
+            return True
+
+    def next_task(self, worker):
+        """
+        Wait for and return the most important task that can run now
+        """
+        with self.condition:
+            while True:
+                best = None
+                for queue in self.queues.values():
+                    if queue['running'] >= queue['max_workers']:
+                        continue
+
+                    # All tasks of a queue use the same hosts, so it is enough to check the first
+                    task = self.peek(queue)
+                    if task and self.hosts_available(task.hosts):
+                        if best is None or task.entry < best.entry:
+                            best = task
+
+                if best:
+                    break
 
-    def add_task(self, name, function, *args, **kwargs):
+                self.condition.wait()
+
+            queue = self.queues[best.queue]
+            heapq.heappop(queue['pending'])
+            queue['waiting'] -= 1
+            queue['running'] += 1
+            for host in best.hosts:
+                self.host_usage[host] = self.host_usage.get(host, 0) + 1
+
+            best.state = 'running'
+            best.worker = worker.name
+            best.started = time.time()
+            queue['wait_time'].observe(best.started - best.added)
+            worker.task = best
+            # Place in queue became free
+            self.condition.notify_all()
+            return best
+
+    def task_done(self, worker, task, failed=False):
+        """
+        Release task's queue and hosts
+        """
+        with self.condition:
+            queue = self.queues[task.queue]
+            queue['running'] -= 1
+            queue['failed' if failed else 'done'] += 1
+            queue['run_time'].observe(time.time() - task.started)
+            queue['finished'].append(time.time())
+            self.forget_finished(queue)
+            for host in task.hosts:
+                self.host_usage[host] -= 1
+
+            task.state = 'done'
+            self.tasks.pop(task.name, None)
+            worker.task = None
+            self.condition.notify_all()
+
+    def forget_finished(self, queue):
+        """
+        Drop finish times that are older than throughput window
+        Must be called with condition acquired
+        """
+        oldest = time.time() - self.THROUGHPUT_WINDOW
+        finished = queue['finished']
+        while finished and finished[0] < oldest:
+            finished.popleft()
+
+    def has_capacity(self, queue_name):
         """
-        Add a task to a queue
+        Return whether queue has fewer waiting and running tasks than workers
         """
-        self.logger.info('Adding a task "%s". Queue size %s', name, self.get_queue_size())
-        self.task_queue.put((name, function, args, kwargs))
-        if len(self.workers) < self.max_workers:
-            worker = Worker(f'worker-{self.worker_counter}', self)
-            self.workers.append(worker)
-            self.worker_counter += 1
+        with self.condition:
+            queue = self.queues[queue_name]
+            return queue['waiting'] + queue['running'] < queue['max_workers']
+
+    def get_task_names(self):
+        """
+        Return names of all waiting and running tasks
+        """
+        with self.condition:
+            return list(self.tasks)
 
     def get_queue_size(self):
         """
-        Return queue size
+        Return number of waiting tasks in all queues
         """
-        return self.task_queue.qsize()
+        with self.condition:
+            return sum(queue['waiting'] for queue in self.queues.values())
 
-    def remove_worker(self, worker):
+    def get_names_in_queue(self):
         """
-        Remove worker from worker pool
+        Return names of waiting tasks in the order they will run
         """
-        self.logger.debug('Worker %s will be removed', worker.name)
-        self.workers.remove(worker)
-        if not self.workers:
-            # If last worker is removed, reset IDs to 0
-            self.worker_counter = 0
+        with self.condition:
+            waiting = [task.entry for task in self.tasks.values() if task.state == 'waiting']
+
+        return [task.name for _, _, task in sorted(waiting)]
 
     def get_worker_status(self):
         """
@@ -110,63 +422,302 @@ class WorkerPool:
         """
         status = {}
         now = time.time()
-        for worker in self.workers:
-            job_time = int(now - worker.job_start_time if worker.job_name else 0)
-            status[worker.name] = {'job_name': worker.job_name,
-                                   'job_time': job_time}
+        with self.condition:
+            for worker in self.workers:
+                task = worker.task
+                status[worker.name] = {'job_name': task.name if task else None,
+                                       'job_queue': task.queue if task else None,
+                                       'job_time': int(now - task.started) if task else 0}
 
         return status
 
+    def get_status(self):
+        """
+        Return status of workers, queues with wait and run time histograms,
+        throughput and hosts
+        """
+        workers = self.get_worker_status()
+        with self.condition:
+            queues = {}
+            for name, queue in self.queues.items():
+                self.forget_finished(queue)
+                # Tasks finished per minute during throughput window
+                throughput = len(queue['finished']) * 60 / self.THROUGHPUT_WINDOW
+                queues[name] = {'waiting': queue['waiting'],
+                                'running': queue['running'],
+                                'done': queue['done'],
+                                'failed': queue['failed'],
+                                'cancelled': queue['cancelled'],
+                                'max_workers': queue['max_workers'],
+                                'max_size': queue['max_size'],
+                                'wait_time': queue['wait_time'].get_status(),
+                                'run_time': queue['run_time'].get_status(),
+                                'throughput': round(throughput, 2)}
+
+            hosts = {host: {'running': self.host_usage.get(host, 0), 'limit': limit}
+                     for host, limit in self.host_limits.items()}
+
+        return {'max_workers': self.max_workers,
+                'workers': workers,
+                'queues': queues,
+                'hosts': hosts}
+
 
-class Submitter:
+class Submitter(ABC):
     """
-    Request submitter has a reference to the whole worker pool as well as job queue
+    Request submitter adds tasks to its queue in the shared scheduler
+    Subclasses set their queue, its limits, default priority and hosts that
+    their tasks use
+    Number of workers of a queue can be set in config as <queue>_workers
+    Jobs added with add_job are persisted in the JobQueue and executed by
+    run_job of the submitter, also after a restart of the replica
+    Objects are locked only within a process, so only one replica may run,
+    the job queue does not start in a replica that cannot take the replica lease
     """
 
-    # A FIFO queue. maxsize is an integer that sets the upperbound
-    # limit on the number of items that can be placed in the queue.
-    # If maxsize is less than or equal to zero, the queue size is infinite.
-    __task_queue = Queue(maxsize=0)
-    # All worker threads
-    __max_workers = 15
-    __worker_pool = WorkerPool(max_workers=__max_workers,
-                               task_queue=__task_queue)
+    QUEUE = 'default'
+    QUEUE_WORKERS = 15
+    QUEUE_SIZE = 1000
+    PRIORITY = TaskScheduler.NORMAL
+    HOSTS = ()
+    # How often to look for new jobs and renew leases, in seconds
+    JOB_POLL_INTERVAL = 10
+    __scheduler = TaskScheduler(max_workers=15)
+    # Queue name -> submitter that runs its jobs
+    __job_submitters = {}
+    __job_poller = None
+    __job_event = Event()
 
     def __init__(self):
         self.logger = logging.getLogger()
+        Submitter.__scheduler.add_queue(self.QUEUE,
+                                        Config.get(f'{self.QUEUE}_workers', self.QUEUE_WORKERS),
+                                        self.QUEUE_SIZE)
 
-    def add_task(self, name, function, *args, **kwargs):
+    @staticmethod
+    def configure(max_workers=None, host_limits=None):
+        """
+        Set total number of worker threads and limits of concurrent tasks per host
+        """
+        Submitter.__scheduler.configure(max_workers, host_limits)
+
+    def add_task(self, name, function, *args, priority=None, coalesce=False, **kwargs):
         """
         Add a job to do to submission queue
-        Name must be unique in the queue
+        Name must be unique in the queue, unless coalesce is True, then
+        waiting task with the same name is updated instead
+        Return "added" or "coalesced"
+        """
+        if priority is None:
+            priority = self.PRIORITY
+
+        task = Task(name, function, args, kwargs, self.QUEUE, priority, self.HOSTS)
+        return Submitter.__scheduler.add_task(task, coalesce=coalesce)
+
+    def add_job(self, name, payload, priority=None, coalesce=False):
+        """
+        Add a persistent job, payload must be JSON serializable
+        Adding a job that is already queued or running does nothing, unless
+        coalesce is True and job is waiting, then its payload is replaced
+        If there are QUEUE_SIZE waiting jobs, wait for a free place
+        Return "added", "coalesced" or "exists"
+        """
+        if priority is None:
+            priority = self.PRIORITY
+
+        result = JobQueue.add(self.QUEUE,
+                              name,
+                              payload,
+                              priority,
+                              coalesce,
+                              max_size=self.QUEUE_SIZE)
+        if result == 'exists':
+            self.logger.warning('Job "%s" is already in "%s" queue, it was not added',
+                                name,
+                                self.QUEUE)
+        else:
+            self.logger.info('Job "%s" in "%s" queue: %s', name, self.QUEUE, result)
+
+        Submitter.__job_event.set()
+        return result
+
+    @abstractmethod
+    def run_job(self, payload):
+        """
+        Execute a persistent job
+        """
+
+    def start_job(self, job):
+        """
+        Add a claimed job to the scheduler, job is removed when it finishes
+        Job id is used as task name, so tasks of jobs with the same name
+        in different queues do not clash
+        Return whether job was added
         """
-        for task in list(Submitter.__task_queue.queue):
-            if task[0] == name:
-                raise Exception(f'Task "{name}" is already in the queue')
+        name = job['_id']
+
+        def run():
+            try:
+                self.run_job(job['payload'])
+            finally:
+                JobQueue.complete(name)
+                Submitter.__job_event.set()
+
+        task = Task(name, run, (), {}, self.QUEUE, job['priority'], self.HOSTS)
+        try:
+            Submitter.__scheduler.add_task(task, timeout=0)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.error('Could not start job "%s": %s', name, ex)
+            JobQueue.release(name)
+            return False
 
-        for worker, worker_info in Submitter.__worker_pool.get_worker_status().items():
-            if worker_info['job_name'] == name:
-                raise Exception(f'Task "{name}" is being worked on by "{worker}"')
+        if job['attempts'] > 1:
+            self.logger.warning('Job "%s" is started again, attempt %s', name, job['attempts'])
 
-        self.__worker_pool.add_task(name, function, *args, **kwargs)
+        return True
+
+    @staticmethod
+    def start_job_queue(submitter_classes):
+        """
+        Start a thread that claims jobs of given submitters when their queues
+        have free workers and renews leases of claimed jobs
+        Wait for the replica lease, e.g. of a stopped replica, and raise an
+        exception if other replica keeps it
+        """
+        deadline = time.time() + JobQueue.LEASE_TIMEOUT + Submitter.JOB_POLL_INTERVAL
+        while not JobQueue.acquire_replica_lease():
+            if time.time() > deadline:
+                raise Exception('Other replica is running, only one replica is supported')
+
+            logging.getLogger().warning('Waiting for the replica lease')
+            time.sleep(Submitter.JOB_POLL_INTERVAL)
+
+        atexit.register(JobQueue.release_replica_lease)
+        for submitter_class in submitter_classes:
+            Submitter.__job_submitters[submitter_class.QUEUE] = submitter_class()
+
+        if Submitter.__job_poller is None:
+            Submitter.__job_poller = Thread(target=Submitter.poll_jobs,
+                                            name='job-poller',
+                                            daemon=True)
+            Submitter.__job_poller.start()
+
+    @staticmethod
+    def poll_jobs():
+        """
+        Claim jobs and renew leases until the process exits
+        Jobs of crashed replicas are reclaimed when their leases expire
+        """
+        logger = logging.getLogger()
+        try:
+            JobQueue.reclaim_expired()
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.error('Error reclaiming expired jobs: %s', ex)
+
+        while True:
+            try:
+                names = Submitter.__scheduler.get_task_names()
+                if names:
+                    JobQueue.heartbeat(names)
+
+                if not JobQueue.acquire_replica_lease():
+                    raise Exception('Replica lease is taken by other replica, not claiming jobs')
+
+                JobQueue.fail_exhausted()
+                for queue, submitter in Submitter.__job_submitters.items():
+                    while Submitter.__scheduler.has_capacity(queue):
+                        job = JobQueue.claim(queue)
+                        if not job or not submitter.start_job(job):
+                            break
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.error('Error polling jobs: %s', ex)
+
+            Submitter.__job_event.wait(Submitter.JOB_POLL_INTERVAL)
+            Submitter.__job_event.clear()
+
+    def cancel_task(self, name):
+        """
+        Remove a waiting job or task from the queue
+        Name is as listed by get_names_in_queue, jobs are named <queue>:<name>
+        """
+        if JobQueue.cancel(name):
+            return True
+
+        if Submitter.__scheduler.cancel_task(name):
+            # Job was claimed by this replica, but did not start yet
+            JobQueue.complete(name)
+            return True
+
+        return False
+
+    def set_priority(self, name, priority):
+        """
+        Change priority of a waiting job or task
+        Name is as listed by get_names_in_queue, jobs are named <queue>:<name>
+        """
+        if JobQueue.set_priority(name, priority):
+            return True
+
+        return Submitter.__scheduler.set_priority(name, priority)
 
     def get_queue_size(self):
         """
         Return size of submission queue
         """
-        return self.__worker_pool.get_queue_size()
+        return Submitter.__scheduler.get_queue_size()
 
     def get_worker_status(self):
         """
         Return dictionary of all worker statuses
         """
-        return self.__worker_pool.get_worker_status()
+        return Submitter.__scheduler.get_worker_status()
 
     def get_names_in_queue(self):
         """
-        Return a list of task names that are waiting in the queue
+        Return a list of task names that are waiting in the queue,
+        claimed jobs first
+        """
+        names = Submitter.__scheduler.get_names_in_queue()
+        return names + [name for name in JobQueue.get_names_in_queue() if name not in names]
+
+    def get_status(self):
+        """
+        Return status of workers, queues and hosts of the scheduler and
+        numbers of persistent jobs
         """
-        return [x[0] for x in self.__task_queue.queue]
+        status = Submitter.__scheduler.get_status()
+        status['jobs'] = JobQueue.get_status()
+        return status
+
+    def upload_workspace(self,
+                         ssh_executor,
+                         workspace_dir,
+                         name,
+                         files,
+                         archive_name='workspace',
+                         voms_options='--valid 4:00'):
+        """
+        Clean or create a remote directory and upload files to it
+        Files are uploaded as a single archive and unpacked in the same
+        command that creates a voms proxy
+        Archive name must differ between stages that may use the same directory
+        """
+        archive = f'{workspace_dir}/{name}_{archive_name}.tar.gz'
+        if not ssh_executor.upload_archive(files, archive):
+            # Maybe workspace directory does not exist yet
+            ssh_executor.execute_command(f'mkdir -p {workspace_dir}')
+            if not ssh_executor.upload_archive(files, archive):
+                raise Exception(f'Error uploading workspace of {name}')
+
+        # Re-create the directory, create a voms proxy and unpack files there
+        command = [f'rm -rf {workspace_dir}/{name}',
+                   f'mkdir -p {workspace_dir}/{name}',
+                   f'cd {workspace_dir}/{name}',
+                   f'voms-proxy-init -voms cms {voms_options} --out $(pwd)/proxy.txt',
+                   f'tar -xzf {archive} && rm -f {archive}']
+        _, stderr, exit_code = ssh_executor.execute_command(command)
+        if exit_code != 0:
+            raise Exception(f'Error unpacking workspace of {name}.\n{stderr}')
 
     def submit_job_dict(self, job_dict, connection):
         """
@@ -209,6 +760,32 @@ class Submitter:
 
         return workflow_name
 
+    def wait_for_workflow(self, workflow_name, connection, timeout=60):
+        """
+        Poll ReqMgr2 with exponential backoff until workflow can be fetched
+        Return whether workflow appeared before timeout
+        """
+        headers = {'Accept': 'application/json'}
+        deadline = time.time() + timeout
+        delay = 0.5
+        while True:
+            try:
+                response = connection.api('GET',
+                                          f'/reqmgr2/data/request?name={workflow_name}',
+                                          headers=headers)
+                result = json.loads(response).get('result', [])
+                if result and workflow_name in result[0]:
+                    return True
+            except Exception as ex:
+                self.logger.warning('Error fetching %s: %s', workflow_name, str(ex))
+
+            if time.time() + delay > deadline:
+                self.logger.error('Workflow %s did not appear in %ss', workflow_name, timeout)
+                return False
+
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
     def approve_workflow(self, workflow_name, connection):
         """
         Approve workflow in ReqMgr2
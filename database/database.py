@@ -5,8 +5,84 @@ import logging
 import time
 import json
 import os
-import re
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+import atexit
+import base64
+from collections import deque
+from threading import Lock
+from pymongo import (MongoClient,
+                     ASCENDING,
+                     DESCENDING,
+                     InsertOne,
+                     ReplaceOne,
+                     UpdateOne,
+                     monitoring)
+from bson import json_util
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from database.search_index import SearchIndex
+from database.query_parser import QueryParser
+
+
+class HandshakeCounter(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener that counts new connections (TCP + auth handshakes)
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.timestamps = deque()
+        self.lock = Lock()
+
+    def connection_created(self, event):
+        now = time.time()
+        with self.lock:
+            self.total += 1
+            self.timestamps.append(now)
+            self.__trim(now)
+
+    def __trim(self, now):
+        """
+        Forget handshakes that happened more than a minute ago
+        """
+        while self.timestamps and self.timestamps[0] < now - 60:
+            self.timestamps.popleft()
+
+    def get_status(self):
+        """
+        Return total number of handshakes and number of handshakes in the last minute
+        """
+        with self.lock:
+            self.__trim(time.time())
+            return {'total': self.total,
+                    'last_minute': len(self.timestamps)}
+
+    #pylint: disable=missing-function-docstring
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+    #pylint: enable=missing-function-docstring
 
 
 class Database():
@@ -20,6 +96,17 @@ class Database():
     SEARCH_RENAME = {}
     USERNAME = None
     PASSWORD = None
+    MAX_POOL_SIZE = 100
+    MAX_IDLE_TIME = 300
+    # Shared MongoClients, one per host, port and credentials
+    __clients = {}
+    __clients_lock = Lock()
+    __handshake_counter = HandshakeCounter()
+    # Parser with a cache of compiled queries
+    __query_parser = QueryParser()
+    # Types of attributes in object schemas
+    __schema_types = {}
+    __schema_types_lock = Lock()
 
     def __init__(self, collection_name=None):
         """
@@ -32,20 +119,72 @@ class Database():
         if not Database.DATABASE_NAME:
             raise Exception('Database name is not set')
 
-        if Database.USERNAME and Database.PASSWORD:
-            self.logger.debug('Using DB with username and password. DB: %s', collection_name)
-            self.client = MongoClient(db_host,
-                                      db_port,
-                                      username=Database.USERNAME,
-                                      password=Database.PASSWORD,
-                                      authSource='admin',
-                                      authMechanism='SCRAM-SHA-256')[Database.DATABASE_NAME]
-        else:
-            self.logger.debug('Using DB without username and password')
-            self.client = MongoClient(db_host, db_port)[Database.DATABASE_NAME]
-
+        self.client = Database.get_client(db_host, db_port)[Database.DATABASE_NAME]
         self.collection = self.client[collection_name]
 
+    @staticmethod
+    def get_client(host, port):
+        """
+        Return a shared MongoClient for given host, port and current credentials
+        Client is created on first use and reused by all Database objects
+        """
+        key = (host, port, Database.USERNAME, Database.PASSWORD)
+        client = Database.__clients.get(key)
+        if client:
+            return client
+
+        with Database.__clients_lock:
+            # Maybe client was created while waiting for a lock
+            client = Database.__clients.get(key)
+            if client:
+                return client
+
+            logger = logging.getLogger()
+            options = {'maxPoolSize': Database.MAX_POOL_SIZE,
+                       'maxIdleTimeMS': Database.MAX_IDLE_TIME * 1000,
+                       'event_listeners': [Database.__handshake_counter]}
+            if Database.USERNAME and Database.PASSWORD:
+                logger.debug('Creating DB client with username and password for %s:%s',
+                             host,
+                             port)
+                client = MongoClient(host,
+                                     port,
+                                     username=Database.USERNAME,
+                                     password=Database.PASSWORD,
+                                     authSource='admin',
+                                     authMechanism='SCRAM-SHA-256',
+                                     **options)
+            else:
+                logger.debug('Creating DB client without username and password for %s:%s',
+                             host,
+                             port)
+                client = MongoClient(host, port, **options)
+
+            Database.__clients[key] = client
+
+        return client
+
+    @staticmethod
+    def close_clients():
+        """
+        Close all shared MongoClients
+        """
+        with Database.__clients_lock:
+            for client in Database.__clients.values():
+                client.close()
+
+            Database.__clients.clear()
+
+    @staticmethod
+    def get_connection_status():
+        """
+        Return number of shared clients, pool settings and handshake counters
+        """
+        return {'clients': len(Database.__clients),
+                'max_pool_size': Database.MAX_POOL_SIZE,
+                'max_idle_time': Database.MAX_IDLE_TIME,
+                'handshakes': Database.__handshake_counter.get_status()}
+
     @staticmethod
     def set_host_port(host, port):
         """
@@ -54,6 +193,15 @@ class Database():
         Database.DATABASE_HOST = host
         Database.DATABASE_PORT = port
 
+    @staticmethod
+    def set_pool_options(max_pool_size, max_idle_time):
+        """
+        Set maximum number of connections per client and seconds
+        after which idle connections are closed
+        """
+        Database.MAX_POOL_SIZE = max_pool_size
+        Database.MAX_IDLE_TIME = max_idle_time
+
     @staticmethod
     def set_database_name(database_name):
         """
@@ -95,22 +243,22 @@ class Database():
         """
         return self.collection.count_documents({})
 
-    def get(self, document_id):
+    def get(self, document_id, keep_last_update=False):
         """
         Get a single document with given identifier
+        last_update is removed unless keep_last_update is True
         """
         result = self.collection.find_one({'_id': document_id})
-        if result and 'last_update' in result:
+        if result and 'last_update' in result and not keep_last_update:
             del result['last_update']
 
         return result
 
     def document_exists(self, document_id):
         """
-        Do a GET request to check whether document exists
+        Check whether document exists without fetching it
         """
-        response = self.get(document_id)
-        return bool(response)
+        return bool(self.collection.count_documents({'_id': document_id}, limit=1))
 
     def delete_document(self, document, purge=False):
         """
@@ -136,9 +284,12 @@ class Database():
                             'deleted': True}
         return self.save(deleted_document)
 
-    def save(self, document):
+    def save(self, document, last_update=None):
         """
-        Save a document
+        Save a document in a single upsert
+        If last_update is given, existing document is replaced only if its
+        last_update is still the same, i.e. nobody else saved it in the meantime
+        Return "created" or "replaced" on success and False on failure
         """
         if not isinstance(document, dict):
             self.logger.error('%s is not a dictionary', document)
@@ -149,20 +300,142 @@ class Database():
             self.logger.error('%s does not have a _id', document)
             return False
 
+        document_filter = {'_id': document_id}
+        if last_update is not None:
+            document_filter['last_update'] = last_update
+
         document['last_update'] = int(time.time())
-        if self.document_exists(document_id):
-            self.logger.debug('Updating %s', document_id)
-            return self.collection.replace_one({'_id': document_id}, document)
+        try:
+            result = self.collection.replace_one(document_filter, document, upsert=True)
+        except DuplicateKeyError:
+            # Document exists, but last_update did not match
+            self.logger.error('%s was modified since %s, not saving', document_id, last_update)
+            return False
+
+        if result.upserted_id is not None:
+            self.logger.debug('Created %s', document_id)
+            return 'created'
+
+        self.logger.debug('Replaced %s', document_id)
+        return 'replaced'
+
+    def save_many(self, documents, ordered=False, insert_only=False):
+        """
+        Save multiple documents in a single bulk write
+        If ordered is True, writing stops at the first error, otherwise all
+        documents are attempted
+        If insert_only is True, documents are only created and ones whose _id
+        already exists fail instead of being replaced
+        Return a dictionary with lists of created and replaced document ids
+        and a dictionary of failed document ids and their error messages
+        """
+        result = {'created': [], 'replaced': [], 'failed': {}}
+        requests = []
+        document_ids = []
+        now = int(time.time())
+        for document in documents:
+            document_id = document.get('_id', '') if isinstance(document, dict) else ''
+            if not document_id:
+                self.logger.error('%s is not a dictionary or does not have a _id', document)
+                result['failed'][str(document)] = 'Not a dictionary or does not have a _id'
+                continue
+
+            document['last_update'] = now
+            if insert_only:
+                requests.append(InsertOne(document))
+            else:
+                requests.append(ReplaceOne({'_id': document_id}, document, upsert=True))
+
+            document_ids.append(document_id)
+
+        if not requests:
+            return result
 
-        self.logger.debug('Creating %s', document_id)
-        return self.collection.insert_one(document)
+        upserted, failed, _ = self.__bulk_write(requests, document_ids, ordered)
+        result['failed'].update(failed)
+        for index, document_id in enumerate(document_ids):
+            if document_id in result['failed']:
+                continue
+
+            if insert_only or index in upserted:
+                result['created'].append(document_id)
+            else:
+                result['replaced'].append(document_id)
+
+        self.logger.info('Bulk save in "%s": %s created, %s replaced, %s failed',
+                         self.collection_name,
+                         len(result['created']),
+                         len(result['replaced']),
+                         len(result['failed']))
+        return result
+
+    def bulk_update(self, updates, ordered=False):
+        """
+        Apply multiple update operations in a single bulk write
+        Updates is a list of (document id, update dictionary) pairs, for example
+        [('prepid-00001', {'$set': {'status': 'approved'}})]
+        Return a dictionary with number of matched and modified documents
+        and a dictionary of failed document ids and their error messages
+        """
+        requests = []
+        document_ids = []
+        now = int(time.time())
+        for document_id, update in updates:
+            update = dict(update)
+            update['$set'] = dict(update.get('$set', {}), last_update=now)
+            requests.append(UpdateOne({'_id': document_id}, update))
+            document_ids.append(document_id)
+
+        if not requests:
+            return {'matched': 0, 'modified': 0, 'failed': {}}
+
+        _, failed, counts = self.__bulk_write(requests, document_ids, ordered)
+        self.logger.info('Bulk update in "%s": %s matched, %s modified, %s failed',
+                         self.collection_name,
+                         counts['matched'],
+                         counts['modified'],
+                         len(failed))
+        return {'matched': counts['matched'],
+                'modified': counts['modified'],
+                'failed': failed}
+
+    def __bulk_write(self, requests, document_ids, ordered):
+        """
+        Perform a bulk write and return upserted indices, per document errors
+        and number of matched and modified documents
+        """
+        try:
+            bulk_result = self.collection.bulk_write(requests, ordered=ordered)
+            upserted = set(bulk_result.upserted_ids.keys())
+            details = {'nMatched': bulk_result.matched_count,
+                       'nModified': bulk_result.modified_count}
+            failed = {}
+        except BulkWriteError as ex:
+            details = ex.details
+            upserted = {item['index'] for item in details.get('upserted', [])}
+            failed = {}
+            for error in details.get('writeErrors', []):
+                document_id = document_ids[error['index']]
+                self.logger.error('Error writing %s: %s', document_id, error.get('errmsg'))
+                failed[document_id] = error.get('errmsg', 'Unknown error')
+
+            if ordered and failed:
+                # Ordered bulk write stops at first error
+                first_error = min(error['index'] for error in details['writeErrors'])
+                for document_id in document_ids[first_error + 1:]:
+                    failed[document_id] = 'Not written because of a previous error'
+
+        counts = {'matched': details.get('nMatched', 0),
+                  'modified': details.get('nModified', 0)}
+        return upserted, failed, counts
 
     def query(self,
               query_string=None,
               page=0, limit=20,
               sort_attr=None, sort_asc=True,
               include_deleted=False,
-              ignore_case=False):
+              ignore_case=False,
+              projection=None):
         """
         Same as query_with_total_rows, but return only list of objects
         """
@@ -172,75 +445,48 @@ class Database():
                                           sort_attr,
                                           sort_asc,
                                           include_deleted,
-                                          ignore_case)[0]
-
-    def get_value_condition(self, value):
-        """
-        Get a condition from value and return value and condition separately
-        """
-        value_condition = None
-        if '<' in value[0]:
-            value_condition = '$lt'
-            value = value[1:]
-        elif value[0] == '>':
-            value_condition = '$gt'
-            value = value[1:]
-        elif value[0] == '!':
-            value_condition = '$ne'
-            value = value[1:]
-
-        self.logger.debug('Value: %s, condition: %s', value, value_condition)
-        return value, value_condition
-
-    def get_value_query(self, key, values, ignore_case=False):
-        """
-        Check for < > and ! in front of values, handle OR operation, use correct attribute type
-        """
-        value_or = []
-        for value in values:
-            value, value_condition = self.get_value_condition(value.strip())
-            if '<int>' in key:
-                value = int(value)
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<int>', ''): value})
-            elif '<float>' in key:
-                value = float(value)
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<float>', ''): value})
-            elif '<bool>' in key:
-                value = bool(value.lower() in ('true', 'yes'))
-                if value_condition:
-                    value = {value_condition: value}
-
-                value_or.append({key.replace('<bool>', ''): value})
-            else:
-                if value_condition:
-                    value = {value_condition: value}
-                    value_or.append({key: value})
-                else:
-                    if '*' in value:
-                        if ignore_case:
-                            value = re.compile(f'^{value}$', re.IGNORECASE)
+                                          ignore_case,
+                                          count_mode=None,
+                                          projection=projection)[0]
 
-                        value_or.append({key: {'$regex': value}})
-                    else:
-                        if ignore_case:
-                            value = re.compile(f'^{value}$', re.IGNORECASE)
+    def build_query(self, query_string=None, include_deleted=False, ignore_case=False):
+        """
+        Build a MongoDB query dictionary from a query string
+        And operator is &&
+        Example prepid=*19*&&is_root=false
+        Return None if query cannot match anything
+        Returned dictionary is shared and must not be modified
+        """
+        query_dict = Database.__query_parser.compile(query_string, include_deleted, ignore_case)
+        self.logger.debug('Query string %s, query %s', query_string, query_dict)
+        return query_dict
 
-                        value_or.append({key: value})
+    @staticmethod
+    def get_projection(attributes):
+        """
+        Make a MongoDB projection from a list of attribute names
+        Return None if all attributes should be returned
+        """
+        if not attributes:
+            return None
 
-        self.logger.debug('Key: %s, values: %s, query: %s', key, values, value_or)
-        if len(value_or) > 1:
-            return {'$or': value_or}
+        if isinstance(attributes, dict):
+            return dict(attributes)
 
-        if len(value_or) == 1:
-            return value_or[0]
+        projection = {attribute: 1 for attribute in attributes}
+        projection['_id'] = 1
+        return projection
 
-        return None
+    def get_sort_attr(self, sort_attr=None):
+        """
+        Return attribute name to sort on, default is _id
+        """
+        if not sort_attr:
+            sort_attr = '_id'
+        elif sort_attr in Database.SEARCH_RENAME.get(self.collection_name, {}):
+            sort_attr = Database.SEARCH_RENAME[self.collection_name][sort_attr]
+
+        return sort_attr.replace('<int>', '').replace('<float>', '').replace('<bool>', '')
 
     def query_with_total_rows(self,
                               query_string=None,
@@ -248,84 +494,202 @@ class Database():
                               sort_attr=None, sort_asc=True,
                               include_deleted=False,
                               ignore_case=False,
-                              wild_filter=False):
+                              wild_filter=False,
+                              count_mode='facet',
+                              projection=None,
+                              after=None):
         """
         Perform a query in a database
         And operator is &&
         Example prepid=*19*&&is_root=false
         This is horrible, please think of something better
-        """
-        query_dict = {'$and': []}
-        if not include_deleted:
-            query_dict['$and'].append({'deleted': {'$ne': True}})
-
-        if query_string:
-            query_string_parts = [x for x in query_string.split('&&') if x.strip()]
-            self.logger.debug('Query parts %s', query_string_parts)
-            for part in query_string_parts:
-                split_part = part.split('=')
-                key = split_part[0].strip()
-                if key == 'deleted':
-                    # Prevent cheating
-                    continue
-
-                values = split_part[1].strip().replace('**', '*').replace('*', '.*')
-                values = [value.strip() for value in values.split(',') if value.strip()]
-                if not values:
-                    # If no value is given, then no results will be returned
-                    # For example "prepid=" shou return nothing
-                    return [], 0
-
-                value_query = self.get_value_query(key, values, ignore_case)
-                if value_query:
-                    query_dict['$and'].append(value_query)
+        Count mode defines how total number of rows is obtained:
+          'facet' - page and total are fetched in a single aggregation
+          'estimate' - use collection's estimated document count if query
+                       only excludes deleted documents, otherwise same as 'facet'
+          None - do not count, total is returned as -1
+        Projection is a list of attributes to return, all attributes are returned if it is empty
+        If after is not None, page is ignored and results start after the
+        document that cursor was made for, see make_cursor
+        """
+        projection = self.get_projection(projection)
+        query_dict = self.build_query(query_string, include_deleted, ignore_case)
+        if query_dict is None:
+            # If no value is given, then no results will be returned
+            return [], 0
 
         if wild_filter:
-            # Create a list of queries that match the regex against each field
-            query = rf".*{wild_filter}.*"
-            queries = []
-            for field_name in self.collection.find_one().keys():
-                queries.append({field_name: {"$regex": re.compile(str(query))}})
+            # Full text search in the in-process search index
+            search_index = SearchIndex.get_index(self.collection_name)
+            ranked_ids = search_index.search(self.collection, wild_filter)
+            query = {'_id': {'$in': ranked_ids}}
+            query_dict = {'$and': [query_dict, query]} if query_dict else query
+            if not sort_attr and after is None:
+                # Order by relevance
+                return self.query_ranked(query_dict, ranked_ids, page, limit, projection)
+
+        sort_attr = self.get_sort_attr(sort_attr)
+        self.logger.debug('Database "%s" query dict %s', self.collection_name, query_dict)
+        self.logger.debug('Sorting on %s ascending %s', sort_attr, 'YES' if sort_asc else 'NO')
+        sort_direction = ASCENDING if sort_asc else DESCENDING
+        sort = [(sort_attr, sort_direction)]
+        if sort_attr != '_id':
+            # Unique tie breaker makes the order stable and cursors unambiguous
+            sort.append(('_id', sort_direction))
+
+        only_not_deleted = query_dict in ({}, {'deleted': {'$ne': True}})
+        if after is not None:
+            if count_mode is None:
+                total_rows = -1
+            elif count_mode == 'estimate' and only_not_deleted:
+                total_rows = self.collection.estimated_document_count()
+            else:
+                total_rows = self.collection.count_documents(query_dict)
+
+            if after:
+                cursor_query = self.get_cursor_query(after, sort_attr, sort_asc)
+                query_dict = {'$and': [query_dict, cursor_query]} if query_dict else cursor_query
+
+            result = list(self.collection.find(query_dict, projection).sort(sort).limit(limit))
+            return result, total_rows
+
+        if count_mode is None or (count_mode == 'estimate' and only_not_deleted):
+            result = self.collection.find(query_dict, projection).sort(sort)
+            result = list(result.skip(page * limit).limit(limit))
+            total_rows = self.collection.estimated_document_count() if count_mode else -1
+            return result, total_rows
+
+        page_stages = [{'$skip': page * limit}, {'$limit': limit}]
+        if projection:
+            page_stages.append({'$project': projection})
+
+        pipeline = [{'$match': query_dict},
+                    {'$sort': dict(sort)},
+                    {'$facet': {'results': page_stages,
+                                'total': [{'$count': 'count'}]}}]
+        try:
+            facet = next(self.collection.aggregate(pipeline, allowDiskUse=True), {})
+        except OperationFailure as ex:
+            # Whole page must fit in a single 16MB document, if it does not,
+            # fall back to separate count and find
+            self.logger.warning('Faceted query failed, will count separately: %s', ex)
+            total_rows = self.collection.count_documents(query_dict)
+            result = self.collection.find(query_dict, projection).sort(sort)
+            result = list(result.skip(page * limit).limit(limit))
+            return result, total_rows
+
+        total = facet.get('total')
+        total_rows = total[0]['count'] if total else 0
+        return facet.get('results', []), int(total_rows)
 
-            query = {"$or": queries}
-            self.collection.create_index([("$**", TEXT)])
-            query_dict['$and'].append(query)
+    @staticmethod
+    def get_attribute(document, attribute):
+        """
+        Return value of a possibly nested attribute, e.g. history.0.time
+        """
+        value = document
+        for key in attribute.split('.'):
+            if isinstance(value, list) and key.isdigit():
+                value = value[int(key)] if int(key) < len(value) else None
+            elif isinstance(value, dict):
+                value = value.get(key)
+            else:
+                return None
 
-        if len(query_dict['$and']) == 1:
-            query_dict = query_dict['$and'][0]
-        elif not query_dict['$and']:
-            query_dict = {}
+        return value
 
-        if not sort_attr:
-            sort_attr = '_id'
-        elif sort_attr in Database.SEARCH_RENAME.get(self.collection_name, {}):
-            sort_attr = Database.SEARCH_RENAME[self.collection_name][sort_attr]
+    def make_cursor(self, document, sort_attr=None):
+        """
+        Make an opaque cursor that points to the given document in results
+        sorted by sort_attr and _id
+        """
+        sort_attr = self.get_sort_attr(sort_attr)
+        if sort_attr.split('.')[0] not in document:
+            # Sort attribute was not projected, fetch just its value instead of
+            # adding e.g. whole history to the results
+            path = '.'.join(key for key in sort_attr.split('.') if not key.isdigit())
+            document = self.collection.find_one({'_id': document['_id']}, {path: 1}) or document
 
-        sort_attr = sort_attr.replace('<int>', '').replace('<float>', '').replace('<bool>', '')
-        self.logger.debug('Database "%s" query dict %s', self.collection_name, query_dict)
-        self.logger.debug('Sorting on %s ascending %s', sort_attr, 'YES' if sort_asc else 'NO')
-        result = self.collection.find(query_dict)
-        result = result.sort(sort_attr, ASCENDING if sort_asc else DESCENDING)
-        total_rows = result.count()
-        result = result.skip(page * limit).limit(limit)
-        return list(result), int(total_rows)
+        position = [self.get_attribute(document, sort_attr), document['_id']]
+        position = json_util.dumps(position).encode('utf-8')
+        return base64.urlsafe_b64encode(position).decode('utf-8')
+
+    def get_cursor_query(self, cursor, sort_attr, sort_asc):
+        """
+        Return a query that matches documents after the cursor
+        """
+        try:
+            value, document_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        except (ValueError, TypeError) as ex:
+            raise Exception(f'Invalid cursor "{cursor}"') from ex
+
+        compare = '$gt' if sort_asc else '$lt'
+        if sort_attr == '_id':
+            return {'_id': {compare: document_id}}
+
+        if value is None:
+            # Missing values are the smallest ones
+            same_value = {sort_attr: None, '_id': {compare: document_id}}
+            if sort_asc:
+                return {'$or': [{sort_attr: {'$ne': None}}, same_value]}
+
+            return same_value
+
+        after = [{sort_attr: {compare: value}},
+                 {sort_attr: value, '_id': {compare: document_id}}]
+        if not sort_asc:
+            after.append({sort_attr: None})
+
+        return {'$or': after}
+
+    def query_ranked(self, query_dict, ranked_ids, page=0, limit=20, projection=None):
+        """
+        Return a page of documents that match the query in the order of given ids
+        """
+        matching = {x['_id'] for x in self.collection.find(query_dict, {'_id': 1})}
+        ranked_ids = [document_id for document_id in ranked_ids if document_id in matching]
+        page_ids = ranked_ids[page * limit:(page + 1) * limit]
+        documents = self.collection.find({'_id': {'$in': page_ids}}, projection)
+        documents = {x['_id']: x for x in documents}
+        return [documents[x] for x in page_ids if x in documents], len(ranked_ids)
+
+    @staticmethod
+    def get_schema_types(object_class):
+        """
+        Return a dictionary of attribute names and type names of numeric and
+        boolean attributes in object class schema
+        """
+        with Database.__schema_types_lock:
+            if object_class not in Database.__schema_types:
+                schema = object_class.schema()
+                Database.__schema_types[object_class] = {
+                    key: type(value).__name__ for key, value in schema.items()
+                    if isinstance(value, (int, float, bool))
+                }
+
+            return Database.__schema_types[object_class]
 
     def build_query_with_types(self, query_string, object_class):
         """
-        This is horrible, please think of something better
+        Rename attributes in the query string and add type suffixes to
+        numeric and boolean attributes, e.g. cpu_cores=4 -> cpu_cores<int>=4
         """
-        schema = object_class.schema()
-        query_string_parts = [x.strip() for x in query_string.split('&&') if x.strip()]
+        schema_types = self.get_schema_types(object_class)
+        renames = Database.SEARCH_RENAME.get(self.collection_name, {})
         typed_arguments = []
-        for part in query_string_parts:
-            split_part = part.split('=')
-            key = split_part[0]
-            value = split_part[1]
-            if key in Database.SEARCH_RENAME.get(self.collection_name, {}):
-                key = Database.SEARCH_RENAME[self.collection_name][key]
-            elif isinstance(schema.get(key), (int, float, bool)):
-                key = f'{key}<{type(schema.get(key)).__name__}>'
+        for part in query_string.split('&&'):
+            if not part.strip():
+                continue
 
-            typed_arguments.append(f'{key}={value}')
+            key, separator, value = part.strip().partition('=')
+            if key in renames:
+                key = renames[key]
+            elif key in schema_types:
+                key = f'{key}<{schema_types[key]}>'
+
+            typed_arguments.append(f'{key}{separator}{value}')
 
         return '&&'.join(typed_arguments)
+
+
+atexit.register(Database.close_clients)
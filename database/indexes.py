@@ -0,0 +1,236 @@
+"""
+Module that declares MongoDB indexes of all collections and keeps them in sync
+Can be run as a script:
+  python3 -m database.indexes [--explain]
+"""
+import os
+import sys
+import logging
+import argparse
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from database.database import Database
+
+
+# Declared indexes of each collection
+# Index name: list of (attribute, direction) pairs
+# Searches are sorted by attribute and _id, so sort indexes end with _id
+INDEXES = {
+    'relvals': {
+        'prepid': [('prepid', ASCENDING)],
+        'status': [('status', ASCENDING)],
+        'campaign': [('cmssw_release', ASCENDING),
+                     ('batch_name', ASCENDING),
+                     ('campaign_timestamp', DESCENDING)],
+        'campaign_timestamp': [('campaign_timestamp', DESCENDING), ('_id', DESCENDING)],
+        'created_on': [('history.0.time', DESCENDING), ('_id', DESCENDING)],
+        'workflows': [('workflows.name', ASCENDING)],
+        'output_datasets': [('output_datasets', ASCENDING)],
+        'jira_ticket': [('jira_ticket', ASCENDING)],
+    },
+    'tickets': {
+        'prepid': [('prepid', ASCENDING)],
+        'status': [('status', ASCENDING)],
+        'campaign': [('cmssw_release', ASCENDING),
+                     ('batch_name', ASCENDING)],
+        'created_on': [('history.0.time', DESCENDING), ('_id', DESCENDING)],
+        'created_relvals': [('created_relvals', ASCENDING)],
+        'jira_ticket': [('jira_ticket', ASCENDING)],
+    },
+    'jobs': {
+        'claim': [('queue', ASCENDING), ('priority', ASCENDING), ('added', ASCENDING)],
+        'state': [('state', ASCENDING), ('lease_until', ASCENDING)],
+    },
+    'logs': {
+        'created': [('created', ASCENDING)],
+    },
+}
+
+# Typical queries that SearchAPI and controllers make
+# Query string, sort attribute, sort ascending
+SEARCH_PATTERNS = {
+    'relvals': [('status=new', 'created_on', False),
+                ('prepid=CMSSW_13_0_0__Test-1.0-00001', 'created_on', False),
+                ('cmssw_release=CMSSW_13_0_0&&batch_name=Test', 'campaign_timestamp', False),
+                ('workflows.name=pdmvserv_RVCMSSW_13_0_0*', 'created_on', False),
+                ('output_datasets=/RelValTTbar/*', 'created_on', False),
+                ('jira_ticket=CMSALCA-1', 'created_on', False)],
+    'tickets': [('status=new', 'created_on', False),
+                ('created_relvals=CMSSW_13_0_0__Test-1.0-00001', None, True),
+                ('cmssw_release=CMSSW_13_0_0&&batch_name=Test', 'created_on', False)],
+}
+
+
+class IndexReconciler():
+    """
+    Index reconciler creates missing declared indexes and reports
+    undeclared, unused and redundant ones
+    """
+
+    def __init__(self, indexes=None):
+        self.logger = logging.getLogger()
+        self.indexes = indexes or INDEXES
+
+    def reconcile(self):
+        """
+        Create missing indexes in all collections and return a report
+        """
+        report = {}
+        for collection_name, indexes in self.indexes.items():
+            report[collection_name] = self.reconcile_collection(collection_name, indexes)
+
+        return report
+
+    def reconcile_collection(self, collection_name, indexes):
+        """
+        Create missing indexes in a single collection and return a report
+        """
+        collection = Database(collection_name).collection
+        existing = {name: [tuple(pair) for pair in info['key']]
+                    for name, info in collection.index_information().items()}
+        existing_keys = list(existing.values())
+        created = []
+        for index_name, keys in indexes.items():
+            if keys in existing_keys:
+                continue
+
+            if index_name in existing:
+                # Declaration changed, index has to be rebuilt
+                self.logger.info('Dropping outdated index %s %s in %s',
+                                 index_name,
+                                 existing[index_name],
+                                 collection_name)
+                collection.drop_index(index_name)
+
+            self.logger.info('Creating index %s %s in %s', index_name, keys, collection_name)
+            collection.create_index(keys, name=index_name, background=True)
+            existing[index_name] = keys
+            created.append(index_name)
+
+        declared_keys = list(indexes.values())
+        undeclared = [name for name, keys in existing.items()
+                      if name != '_id_' and keys not in declared_keys]
+        redundant = self.get_redundant(existing)
+        unused = self.get_unused(collection)
+        for name in undeclared:
+            self.logger.warning('Index %s in %s is not declared', name, collection_name)
+
+        for name, covered_by in redundant.items():
+            self.logger.warning('Index %s in %s is a prefix of %s',
+                                name,
+                                collection_name,
+                                covered_by)
+
+        for name in unused:
+            self.logger.warning('Index %s in %s was never used', name, collection_name)
+
+        return {'created': created,
+                'undeclared': undeclared,
+                'redundant': redundant,
+                'unused': unused}
+
+    @staticmethod
+    def get_redundant(indexes):
+        """
+        Return dictionary of index names that are prefixes of other indexes
+        and names of indexes that cover them
+        """
+        redundant = {}
+        for name, keys in indexes.items():
+            if name == '_id_':
+                continue
+
+            for other_name, other_keys in indexes.items():
+                if other_name != name and len(other_keys) > len(keys):
+                    if other_keys[:len(keys)] == keys:
+                        redundant[name] = other_name
+                        break
+
+        return redundant
+
+    def get_unused(self, collection):
+        """
+        Return list of index names that were not used since server start
+        """
+        try:
+            stats = list(collection.aggregate([{'$indexStats': {}}]))
+        except OperationFailure as ex:
+            self.logger.warning('Could not get index stats of %s: %s', collection.name, ex)
+            return []
+
+        return sorted(stat['name'] for stat in stats
+                      if stat['name'] != '_id_' and not stat['accesses']['ops'])
+
+    def explain(self, patterns=None):
+        """
+        Return winning plans of typical search queries
+        """
+        plans = {}
+        for collection_name, queries in (patterns or SEARCH_PATTERNS).items():
+            database = Database(collection_name)
+            plans[collection_name] = []
+            for query_string, sort_attr, sort_asc in queries:
+                query_dict = database.build_query(query_string, ignore_case=True)
+                sort_attr = database.get_sort_attr(sort_attr)
+                cursor = database.collection.find(query_dict)
+                direction = ASCENDING if sort_asc else DESCENDING
+                sort = [(sort_attr, direction)]
+                if sort_attr != '_id':
+                    sort.append(('_id', direction))
+
+                cursor = cursor.sort(sort).limit(50)
+                explained = cursor.explain()
+                winning_plan = explained.get('queryPlanner', {}).get('winningPlan', {})
+                plans[collection_name].append({'query': query_string,
+                                               'sort': sort_attr,
+                                               'plan': self.get_plan_stages(winning_plan)})
+
+        return plans
+
+    @staticmethod
+    def get_plan_stages(plan):
+        """
+        Flatten a winning plan to a readable chain of stages, e.g.
+        LIMIT <- FETCH <- IXSCAN (prepid)
+        """
+        stages = []
+        while plan:
+            stage = plan.get('stage', '?')
+            if plan.get('indexName'):
+                stage += f' ({plan["indexName"]})'
+
+            stages.append(stage)
+            plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+
+        return ' <- '.join(stages)
+
+
+def main():
+    """
+    Reconcile indexes and optionally print query plans
+    """
+    parser = argparse.ArgumentParser(description='Create missing MongoDB indexes')
+    parser.add_argument('--explain',
+                        action='store_true',
+                        help='Print query plans of typical search queries')
+    args = parser.parse_args()
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
+    Database.set_database_name('relval')
+    Database.set_credentials(os.getenv('DATABASE_USER'), os.getenv('DATABASE_PASSWORD'))
+    reconciler = IndexReconciler()
+    for collection_name, report in reconciler.reconcile().items():
+        print(f'{collection_name}:')
+        for key, value in report.items():
+            print(f'  {key}: {value}')
+
+    if args.explain:
+        for collection_name, plans in reconciler.explain().items():
+            print(f'{collection_name} query plans:')
+            for plan in plans:
+                print(f'  {plan["query"]} sorted by {plan["sort"]}:\n    {plan["plan"]}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Module that parses query strings of Database queries to MongoDB queries
+Query string is a list of attribute=values parts joined with &&, e.g.
+prepid=*TTbar*&&status=new,approved&&cpu_cores<int>=>4
+Values are separated with , or | and any of them can match
+Value can start with <, > or ! to compare instead of matching
+* in a value matches any number of any characters
+Attribute can have a type suffix - <int>, <float> or <bool>
+"""
+import re
+from collections import OrderedDict
+from threading import Lock
+
+
+class Condition():
+    """
+    Comparison of an attribute with a single value
+    Operator is None for a match, otherwise $lt, $gt or $ne
+    Value of a wildcard condition is a list of parts between wildcards
+    """
+
+    def __init__(self, operator, value, wildcard=False):
+        self.operator = operator
+        self.value = value
+        self.wildcard = wildcard
+
+    def __repr__(self):
+        return f'Condition({self.operator}, {self.value!r}, wildcard={self.wildcard})'
+
+
+class Clause():
+    """
+    Attribute and a list of conditions, at least one of which must be true
+    """
+
+    def __init__(self, attribute, value_type, conditions):
+        self.attribute = attribute
+        self.value_type = value_type
+        self.conditions = conditions
+
+    def __repr__(self):
+        return f'Clause({self.attribute}, {self.value_type.__name__}, {self.conditions})'
+
+
+class QueryParser():
+    """
+    Query parser turns query strings to lists of clauses (AND of ORs) and
+    compiles them to MongoDB queries
+    Compiled queries are kept in a LRU cache, they must not be modified
+    """
+
+    TYPES = {'int': int, 'float': float, 'bool': bool}
+    OPERATORS = {'<': '$lt', '>': '$gt', '!': '$ne'}
+    __key_regex = re.compile(r'^(.+?)(?:<(int|float|bool)>)?$')
+    __value_splitter = re.compile('[,|]')
+    # Characters that have a special meaning in regular expressions
+    __special_characters = re.compile(r'([\\.^$|?+()\[\]{}])')
+
+    def __init__(self, cache_size=512):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = Lock()
+
+    def parse(self, query_string):
+        """
+        Parse a query string to a list of clauses
+        Return None if some attribute has no values, such query cannot match anything
+        """
+        clauses = []
+        for part in query_string.split('&&'):
+            if not part.strip():
+                continue
+
+            key, separator, values = part.partition('=')
+            key = key.strip()
+            if not separator or not key:
+                raise Exception(f'Invalid query part "{part}"')
+
+            attribute, value_type = self.__key_regex.match(key).groups()
+            if attribute == 'deleted':
+                # Prevent cheating
+                continue
+
+            value_type = self.TYPES.get(value_type, str)
+            values = values.replace('**', '*')
+            values = [v.strip() for v in self.__value_splitter.split(values) if v.strip()]
+            if not values:
+                # If no value is given, then no results will be returned
+                # For example "prepid=" should return nothing
+                return None
+
+            conditions = [self.parse_value(value, value_type) for value in values]
+            clauses.append(Clause(attribute, value_type, conditions))
+
+        return clauses
+
+    def parse_value(self, value, value_type):
+        """
+        Parse a single value to a condition
+        """
+        operator = self.OPERATORS.get(value[0])
+        if operator:
+            value = value[1:].strip()
+
+        if value_type is bool:
+            return Condition(operator, value.lower() in ('true', 'yes'))
+
+        if value_type is not str:
+            # Raises ValueError if value is not a number
+            return Condition(operator, value_type(value))
+
+        if not operator and '*' in value:
+            return Condition(operator, value.split('*'), wildcard=True)
+
+        return Condition(operator, value)
+
+    def escape(self, value):
+        """
+        Escape characters that have a special meaning in regular expressions
+        """
+        return self.__special_characters.sub(r'\\\1', value)
+
+    def compile_condition(self, condition, ignore_case=False):
+        """
+        Compile a condition to a MongoDB value query
+        Regular expressions are anchored at the beginning whenever possible,
+        so MongoDB can use index bounds of the literal prefix
+        """
+        if condition.operator:
+            return {condition.operator: condition.value}
+
+        if not isinstance(condition.value, (str, list)):
+            return condition.value
+
+        if condition.wildcard:
+            parts = condition.value
+            pattern = '.*'.join(self.escape(part) for part in parts)
+            # ^abc.*$ is same as ^abc, .*abc$ is same as abc$
+            pattern = pattern[2:] if not parts[0] else f'^{pattern}'
+            pattern = pattern[:-2] if not parts[-1] else f'{pattern}$'
+            text = ''.join(parts)
+        else:
+            pattern = f'^{self.escape(condition.value)}$'
+            text = condition.value
+
+        # Case does not matter if text has no letters
+        ignore_case = ignore_case and text.lower() != text.upper()
+        if not condition.wildcard and not ignore_case:
+            return condition.value
+
+        if ignore_case:
+            return {'$regex': pattern, '$options': 'i'}
+
+        return {'$regex': pattern}
+
+    def compile_clause(self, clause, ignore_case=False):
+        """
+        Compile a clause to a MongoDB query
+        """
+        values = [self.compile_condition(c, ignore_case) for c in clause.conditions]
+        if len(values) == 1:
+            return {clause.attribute: values[0]}
+
+        if not any(isinstance(value, dict) for value in values):
+            return {clause.attribute: {'$in': values}}
+
+        return {'$or': [{clause.attribute: value} for value in values]}
+
+    def compile(self, query_string=None, include_deleted=False, ignore_case=False):
+        """
+        Return a MongoDB query for a query string
+        Return None if query cannot match anything
+        """
+        cache_key = (query_string, include_deleted, ignore_case)
+        with self.cache_lock:
+            if cache_key in self.cache:
+                self.cache.move_to_end(cache_key)
+                return self.cache[cache_key]
+
+        clauses = self.parse(query_string) if query_string else []
+        if clauses is None:
+            query_dict = None
+        else:
+            queries = [] if include_deleted else [{'deleted': {'$ne': True}}]
+            queries.extend(self.compile_clause(c, ignore_case) for c in clauses)
+            if len(queries) > 1:
+                query_dict = {'$and': queries}
+            else:
+                query_dict = queries[0] if queries else {}
+
+        with self.cache_lock:
+            self.cache[cache_key] = query_dict
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return query_dict
@@ -0,0 +1,346 @@
+"""
+Module that contains in-process full text search index
+"""
+import re
+import time
+import logging
+from bisect import bisect_left
+from threading import Lock, Thread
+
+
+class SearchIndex():
+    """
+    Inverted index of words in selected attributes of documents in a collection
+    Words are lowercase alphanumeric parts of attribute values, e.g.
+    /RelValTTbar_14TeV/CMSSW_13_0_0-130X-v1/DQMIO gives relvalttbar, 14tev,
+    cmssw, 13, 0, 130x, v1 and dqmio
+    Index also keeps sorted values of some attributes for suggestions
+    Index is rebuilt in the background when it gets older than max_age seconds,
+    searches use the old index until the new one is ready
+    """
+
+    # Attributes that are indexed in each collection
+    SEARCH_FIELDS = {
+        'relvals': ['prepid',
+                    'cmssw_release',
+                    'batch_name',
+                    'workflow_name',
+                    'workflows.name',
+                    'output_datasets',
+                    'steps.input.dataset'],
+        'tickets': ['prepid',
+                    'cmssw_release',
+                    'batch_name',
+                    'created_relvals',
+                    'label',
+                    'title',
+                    'jira_ticket'],
+    }
+    # Attributes whose whole values are suggested
+    SUGGESTION_FIELDS = {
+        'relvals': ['prepid',
+                    'batch_name',
+                    'cmssw_release',
+                    'output_datasets'],
+        'tickets': ['prepid',
+                    'batch_name',
+                    'cmssw_release'],
+    }
+    # Max number of words that contain a search term not at the beginning
+    MAX_INFIX_WORDS = 1000
+    # Max seconds to wait for the first build of an index
+    FIRST_BUILD_TIMEOUT = 30
+    __indexes = {}
+    __indexes_lock = Lock()
+    __word_splitter = re.compile('[^a-z0-9]+')
+
+    def __init__(self, collection_name, max_age=60):
+        self.logger = logging.getLogger()
+        self.collection_name = collection_name
+        self.fields = SearchIndex.SEARCH_FIELDS.get(collection_name, ['prepid'])
+        self.suggestion_fields = SearchIndex.SUGGESTION_FIELDS.get(collection_name, ['prepid'])
+        self.max_age = max_age
+        self.build_time = 0
+        self.build_thread = None
+        self.build_lock = Lock()
+        # Word -> set of document ids
+        self.words = {}
+        # Sorted list of all words for prefix lookup
+        self.sorted_words = []
+        # Three letter part of a word -> set of words for infix lookup
+        self.trigrams = {}
+        # Attribute -> (sorted lowercase values, original values)
+        self.values = {}
+        # Attribute -> three letter part of a lowercase value -> set of value indices
+        self.value_trigrams = {}
+
+    @staticmethod
+    def get_index(collection_name):
+        """
+        Return a shared search index of a collection
+        """
+        with SearchIndex.__indexes_lock:
+            if collection_name not in SearchIndex.__indexes:
+                SearchIndex.__indexes[collection_name] = SearchIndex(collection_name)
+
+            return SearchIndex.__indexes[collection_name]
+
+    @staticmethod
+    def warm_up():
+        """
+        Start building indexes of all searchable collections in the background
+        """
+        # Database module imports this module
+        from database.database import Database  # pylint: disable=import-outside-toplevel
+        for collection_name in SearchIndex.SEARCH_FIELDS:
+            collection = Database(collection_name).collection
+            SearchIndex.get_index(collection_name).refresh(collection, wait=False)
+
+    @staticmethod
+    def split_words(value):
+        """
+        Split a string to lowercase alphanumeric words
+        """
+        return [word for word in SearchIndex.__word_splitter.split(str(value).lower()) if word]
+
+    @staticmethod
+    def split_trigrams(word):
+        """
+        Return set of all three letter parts of a word
+        """
+        return {word[i:i + 3] for i in range(len(word) - 2)}
+
+    @staticmethod
+    def get_values(document, attribute):
+        """
+        Return all values of a possibly nested attribute, e.g. workflows.name
+        """
+        values = [document]
+        for key in attribute.split('.'):
+            next_values = []
+            for value in values:
+                if isinstance(value, list):
+                    next_values.extend(item.get(key) for item in value if isinstance(item, dict))
+                elif isinstance(value, dict):
+                    next_values.append(value.get(key))
+
+            values = [value for value in next_values if value not in (None, '')]
+
+        flat_values = []
+        for value in values:
+            if isinstance(value, list):
+                flat_values.extend(value)
+            else:
+                flat_values.append(value)
+
+        return flat_values
+
+    def build(self, collection):
+        """
+        Scan the collection and build a new index
+        """
+        start_time = time.time()
+        words = {}
+        values = {field: set() for field in self.suggestion_fields}
+        projection = {field: 1 for field in self.fields + self.suggestion_fields}
+        for document in collection.find({'deleted': {'$ne': True}}, projection):
+            document_id = document['_id']
+            for field in self.fields:
+                for value in self.get_values(document, field):
+                    for word in self.split_words(value):
+                        words.setdefault(word, set()).add(document_id)
+
+            for field in self.suggestion_fields:
+                values[field].update(str(value) for value in self.get_values(document, field))
+
+        sorted_words = sorted(words.keys())
+        trigrams = {}
+        for word in sorted_words:
+            for trigram in self.split_trigrams(word):
+                trigrams.setdefault(trigram, set()).add(word)
+
+        value_trigrams = {}
+        for field, field_values in values.items():
+            field_values = sorted((value.lower(), value) for value in field_values)
+            values[field] = ([pair[0] for pair in field_values],
+                             [pair[1] for pair in field_values])
+            field_trigrams = value_trigrams.setdefault(field, {})
+            for index, value in enumerate(values[field][0]):
+                for trigram in self.split_trigrams(value):
+                    field_trigrams.setdefault(trigram, set()).add(index)
+
+        # Swap whole index at once, readers never see a half built index
+        (self.words,
+         self.sorted_words,
+         self.trigrams,
+         self.values,
+         self.value_trigrams) = (words, sorted_words, trigrams, values, value_trigrams)
+        self.build_time = time.time()
+        self.logger.info('Built search index of %s with %s words in %.2fs',
+                         self.collection_name,
+                         len(sorted_words),
+                         self.build_time - start_time)
+
+    def refresh(self, collection, wait=True):
+        """
+        Rebuild index in the background if it does not exist or is too old
+        Old index is used while the new one is being built, only if there is
+        no index yet, wait for the build to finish
+        """
+        with self.build_lock:
+            thread = self.build_thread
+            if thread is None and time.time() - self.build_time >= self.max_age:
+                thread = Thread(target=self.rebuild, args=(collection, ), daemon=True)
+                self.build_thread = thread
+                thread.start()
+
+        if wait and thread is not None and not self.build_time:
+            thread.join(SearchIndex.FIRST_BUILD_TIMEOUT)
+            if not self.build_time:
+                self.logger.warning('Search index of %s is not built yet',
+                                    self.collection_name)
+
+    def rebuild(self, collection):
+        """
+        Build index and log errors, old index is kept if build fails
+        """
+        try:
+            self.build(collection)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.error('Error building search index of %s: %s',
+                              self.collection_name,
+                              ex)
+        finally:
+            with self.build_lock:
+                self.build_thread = None
+
+    def match_word(self, term):
+        """
+        Return a dictionary of document ids and scores for a single search term
+        Exact word match scores 3, prefix match 2 and match inside a word 1
+        Words that contain the term are looked up by their three letter parts,
+        terms shorter than three letters match only beginnings of words
+        """
+        scores = {}
+        index = bisect_left(self.sorted_words, term)
+        while index < len(self.sorted_words) and self.sorted_words[index].startswith(term):
+            word = self.sorted_words[index]
+            score = 3 if word == term else 2
+            for document_id in self.words[word]:
+                scores[document_id] = max(scores.get(document_id, 0), score)
+
+            index += 1
+
+        if len(term) < 3:
+            return scores
+
+        trigrams = sorted((self.trigrams.get(trigram, set())
+                           for trigram in self.split_trigrams(term)),
+                          key=len)
+        candidates = set.intersection(*trigrams)
+        infix_words = sorted(word for word in candidates
+                             if term in word and not word.startswith(term))
+        if len(infix_words) > SearchIndex.MAX_INFIX_WORDS:
+            self.logger.debug('%s words contain "%s", using first %s',
+                              len(infix_words),
+                              term,
+                              SearchIndex.MAX_INFIX_WORDS)
+            infix_words = infix_words[:SearchIndex.MAX_INFIX_WORDS]
+
+        for word in infix_words:
+            for document_id in self.words[word]:
+                scores.setdefault(document_id, 1)
+
+        return scores
+
+    def search(self, collection, query, limit=None):
+        """
+        Return a list of document ids that match all words in the query,
+        best matches first
+        """
+        self.refresh(collection)
+        terms = self.split_words(query)
+        if not terms:
+            return []
+
+        total_scores = None
+        for term in terms:
+            scores = self.match_word(term)
+            if total_scores is None:
+                total_scores = scores
+            else:
+                total_scores = {document_id: total_scores[document_id] + score
+                                for document_id, score in scores.items()
+                                if document_id in total_scores}
+
+            if not total_scores:
+                return []
+
+        ranked = sorted(total_scores.items(), key=lambda pair: (-pair[1], pair[0]))
+        ranked = [document_id for document_id, _ in ranked]
+        return ranked[:limit] if limit else ranked
+
+    @staticmethod
+    def contains_in_order(value, parts, start=0):
+        """
+        Return whether all parts are in the value in the given order
+        """
+        for part in parts:
+            start = value.find(part, start)
+            if start < 0:
+                return False
+
+            start += len(part)
+
+        return True
+
+    def suggest(self, collection, query, attribute='prepid', limit=20):
+        """
+        Return values of an attribute that contain space separated parts
+        of the query in the same order
+        Exact match is the first, then values that start with the query,
+        then values that contain it
+        Values that contain the query are looked up by three letter parts of
+        the query, query without such parts matches only beginnings of values
+        """
+        if attribute not in self.suggestion_fields:
+            raise Exception(f'Suggestions of "{attribute}" in {self.collection_name} '
+                            'are not available')
+
+        self.refresh(collection)
+        if attribute not in self.values:
+            # Index is not built yet
+            return []
+
+        parts = query.lower().split()
+        if not parts:
+            return []
+
+        lower_values, original_values = self.values[attribute]
+        found = []
+        index = bisect_left(lower_values, parts[0])
+        while index < len(lower_values) and len(found) < limit:
+            value = lower_values[index]
+            if not value.startswith(parts[0]):
+                break
+
+            if self.contains_in_order(value, parts[1:], len(parts[0])):
+                found.append(index)
+
+            index += 1
+
+        trigrams = [self.value_trigrams[attribute].get(trigram, set())
+                    for part in parts
+                    for trigram in self.split_trigrams(part)]
+        if len(found) < limit and trigrams:
+            candidates = set.intersection(*sorted(trigrams, key=len))
+            for index in sorted(candidates):
+                value = lower_values[index]
+                if value.startswith(parts[0]) or not self.contains_in_order(value, parts):
+                    continue
+
+                found.append(index)
+                if len(found) >= limit:
+                    break
+
+        return [original_values[index] for index in found]
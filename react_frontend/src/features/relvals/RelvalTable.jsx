@@ -12,6 +12,10 @@ import { useColumns, getHiddenColumns } from './useActionsColumn';
 import NavBar from '../components/NavBar';
 import GlobalFilter from '../components/GlobalFilter';
 
+// Large attributes that are not in the "table" fields preset, they are
+// fetched only when their columns are shown
+const LARGE_COLUMNS = ['steps', 'history', 'fragment'];
+
 export const RelvalTable = () => {
   const [state, dispatch] = React.useReducer(reducer, initialState);
   const {role, userInfo} = useUserRole();
@@ -48,10 +52,14 @@ export const RelvalTable = () => {
     checkboxHook,
   );
 
+  const hiddenColumns = getHiddenColumns(state.shown, tableColumns);
+  const fields = ['table', ...LARGE_COLUMNS.filter(name => !hiddenColumns.includes(name))].join(',');
+
   function fetchData(){
     dispatch({type: "TOGGLE_LOADING_STATE", payload: true});
     let url = 'api/search?db_name=relvals';
     url += actions.getQueryString(state, true);
+    url += '&fields=' + fields;
 
     fetch(url)
     .then(res => res.json())
@@ -60,7 +68,8 @@ export const RelvalTable = () => {
         dispatch({
           type: "SET_DATA",
           data: data.response.results,
-          totalRows: data.response.total_rows
+          totalRows: data.response.total_rows,
+          next: data.response.next
         });
         dispatch({type: "REFRESH_DATA", payload: false});
         dispatch({type: "TOGGLE_LOADING_STATE", payload: false});
@@ -81,7 +90,7 @@ export const RelvalTable = () => {
 
   React.useEffect(() => {
     fetchData();
-  }, [state.currentPage, state.pageSize, state.refreshData, state.sort, state.sort_asc, state.filterData]);
+  }, [state.currentPage, state.pageSize, state.refreshData, state.sort, state.sort_asc, state.filterData, fields]);
 
   // Retain selected rows when page changes
   React.useEffect(() => {
@@ -36,6 +36,7 @@ export const getQueryString = (state, forData=false) => {
                   sort_asc: state.sort_asc,
                   filter: state.filterData
                 };
+  delete query.after;
   let queryString = '';
   Object.entries({...query, ...object}).forEach(([k, value]) => {
     // ignore shown param when fetching data
@@ -44,6 +45,11 @@ export const getQueryString = (state, forData=false) => {
     if (k.includes('sort') && value===null) return;
     queryString += '&' + k + '=' + value;
   });
+  // Continue from the last row of previous page instead of skipping rows
+  const cursor = state.cursors[state.currentPage];
+  if (forData && cursor !== undefined) {
+    queryString += '&after=' + encodeURIComponent(cursor);
+  }
   return queryString;
 }
 
@@ -15,6 +15,8 @@ export const initialState = {
   totalRows: "",
   currentPage: initPageNumber,
   pageSize: initPageSize,
+  // Cursors of pages that are known, page number: cursor
+  cursors: {0: ''},
   selectedItems: {},
   shown: shown,
   sort: sort,
@@ -37,7 +39,8 @@ function reducer(state=initialState, action) {
       return {
         ...state,
         data: action.data,
-        totalRows: action.totalRows
+        totalRows: action.totalRows,
+        cursors: action.next ? {...state.cursors, [state.currentPage + 1]: action.next} : state.cursors
       };
     case "REFRESH_DATA":
       return {...state, refreshData: action.payload}
@@ -46,7 +49,7 @@ function reducer(state=initialState, action) {
     case "CHANGE_PAGE":
       return {...state, currentPage: action.payload};
     case "SET_PAGE_SIZE":
-      return {...state, pageSize: action.payload};
+      return {...state, pageSize: action.payload, cursors: {0: ''}};
     case "SET_SELECTED_ITEMS":
       return {...state, selectedItems: action.payload};
     case "UPDATE_SHOWN":
@@ -56,9 +59,9 @@ function reducer(state=initialState, action) {
     case "TOGGLE_MODAL_DIALOG":
       return {...state, dialog: {...state.dialog, ...action.payload}};
     case "UPDATE_SORT_STATE":
-      return {...state, sort: action.payload.sort, sort_asc: action.payload.sort_asc};
+      return {...state, sort: action.payload.sort, sort_asc: action.payload.sort_asc, cursors: {0: ''}};
     case "FILTER_DATA":
-      return {...state, filterData: action.payload}
+      return {...state, filterData: action.payload, cursors: {0: ''}}
     default:
       throw new Error();
   }
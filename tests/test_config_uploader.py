@@ -0,0 +1,105 @@
+"""
+Tests of config uploader batch mode
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-ins of ConfigCacheLite and TweakMakerLite, document id is made of
+# config's label and its tweaks, so it changes if configs leak into each other
+FAKE_MODULES = {
+    'tweak_maker_lite.py': '''
+class TweakMakerLite():
+    def make(self, process):
+        return list(process)
+''',
+    'config_cache_lite.py': '''
+import json
+
+class ConfigCacheLite():
+    def __init__(self, database_url):
+        self.document = {}
+
+    def set_user_group(self, user_name, group_name):
+        pass
+
+    def add_config(self, file_name):
+        pass
+
+    def set_PSet_tweaks(self, tweaks):
+        self.document['tweaks'] = tweaks
+
+    def set_label(self, label):
+        self.document['label'] = label
+
+    def set_description(self, description):
+        pass
+
+    def save(self):
+        self.document['_id'] = json.dumps([self.document['label'], self.document['tweaks']])
+        self.document['_rev'] = '1-rev'
+''',
+    # Module that configs customise, like a CMSSW module
+    'shared_customisation.py': '''
+applied = []
+''',
+}
+
+CONFIG = '''
+import shared_customisation
+shared_customisation.applied.append('%s')
+process = list(shared_customisation.applied)
+'''
+
+
+class ConfigUploaderTest(unittest.TestCase):
+    """
+    Tests of uploading multiple configs with a single uploader run
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, content in FAKE_MODULES.items():
+            with open(os.path.join(self.directory, name), 'w') as module_file:
+                module_file.write(content)
+
+        self.configs = []
+        for prepid in ('RVA', 'RVB'):
+            os.makedirs(os.path.join(self.directory, prepid))
+            config = os.path.join(self.directory, prepid, 'step_1_cfg.py')
+            with open(config, 'w') as config_file:
+                config_file.write(CONFIG % (prepid))
+
+            self.configs.append(config)
+
+        self.sys_path = list(sys.path)
+        sys.path[:0] = [self.directory, REPO_DIR]
+
+    def tearDown(self):
+        sys.path[:] = self.sys_path
+        for name in ('tweak_maker_lite', 'config_cache_lite', 'core_lib.utils.config_uploader'):
+            sys.modules.pop(name, None)
+
+        shutil.rmtree(self.directory)
+
+    def test_batch_same_as_single_uploads(self):
+        """
+        Two configs uploaded in one batch get the same documents as when
+        they are uploaded one by one
+        """
+        from core_lib.utils import config_uploader
+        labels = ['step_1_cfg', 'step_1_cfg']
+        batch = config_uploader.upload_configs(self.configs, labels, 'user', 'ppd', 'db')
+        single = [config_uploader.upload_configs([config], [label], 'user', 'ppd', 'db')[0]
+                  for config, label in zip(self.configs, labels)]
+        self.assertEqual(batch, single)
+        self.assertEqual(batch[1][0], '["step_1_cfg", ["RVB"]]')
+
+
+if __name__ == '__main__':
+    unittest.main()